@@ -33,6 +33,7 @@ const ALLOWED_TYPES = [
 const MAX_FILE_SIZE = 10 * 1024 * 1024 // 10MB
 
 interface AIAnalysis {
+  staging_id: string
   summary: string
   tags: string[]
   extracted_text_preview: string
@@ -140,7 +141,12 @@ export default function UploadPage() {
       formDataToSend.append("summary", formData.summary)
       formDataToSend.append("tags", formData.tags)
       formDataToSend.append("visibility", formData.visibility)
-      formDataToSend.append("file", file)
+      // The analyzed file is already on the server, only send its staging id
+      if (aiAnalysis?.staging_id) {
+        formDataToSend.append("staging_id", aiAnalysis.staging_id)
+      } else {
+        formDataToSend.append("file", file)
+      }
 
       const xhr = new XMLHttpRequest()
 
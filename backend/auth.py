@@ -1,3 +1,6 @@
+import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -12,6 +15,10 @@ from bson import ObjectId
 SECRET_KEY = "your-secret-key-here"  # In production, use environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Authenticated users are cached per API worker; profile changes made through another
+# worker, or directly in Mongo, take effect after at most this long
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -22,6 +29,46 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class UserCache:
+    """Recently authenticated users by token subject, for at most ``USER_CACHE_TTL_SECONDS``"""
+    _users: "OrderedDict[str, tuple]" = OrderedDict()
+    _stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @classmethod
+    def get(cls, username: str) -> Optional[User]:
+        entry = cls._users.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            cls._stats["misses"] += 1
+            return None
+        cls._users.move_to_end(username)
+        cls._stats["hits"] += 1
+        return entry[1].copy()
+
+    @classmethod
+    def put(cls, username: str, user: User):
+        cls._users[username] = (time.monotonic() + USER_CACHE_TTL_SECONDS, user)
+        cls._users.move_to_end(username)
+        while len(cls._users) > USER_CACHE_SIZE:
+            cls._users.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, username: str):
+        """Forget a user after a profile change, deactivation or deletion"""
+        if cls._users.pop(username, None) is not None:
+            cls._stats["invalidations"] += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {**cls._stats, "entries": len(cls._users), "ttl_seconds": USER_CACHE_TTL_SECONDS}
+
+def token_claims(user: User) -> dict:
+    """Claims signed into a user's token next to the subject.
+
+    Only the user id, the profile (group, admin flag) is read from the
+    database so a change applies to tokens already issued.
+    """
+    return {"uid": str(user.id)}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -43,20 +90,44 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
+        token_data = TokenData(username=username, user_id=payload.get("uid"))
     except JWTError:
         raise credentials_exception
     return token_data
 
 async def get_current_user(token_data: TokenData = Depends(verify_token)):
-    db = await get_database()
-    user = await db.users.find_one({"username": token_data.username})
+    user = UserCache.get(token_data.username)
     if user is None:
+        db = await get_database()
+        record = await db.users.find_one({"username": token_data.username})
+        if record is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        user = User(**record)
+        UserCache.put(token_data.username, user)
+    # A token of a deleted account does not work for a new account with the same username
+    if token_data.user_id and token_data.user_id != str(user.id):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
-    return User(**user)
+    if not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Inactive user"
+        )
+    return user
+
+async def get_current_admin(current_user: User = Depends(get_current_user)):
+    """Users flagged ``is_admin`` in the database; registration cannot set the flag"""
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
 
 async def authenticate_user(username: str, password: str):
     db = await get_database()
@@ -65,4 +136,6 @@ async def authenticate_user(username: str, password: str):
         return False
     if not verify_password(password, user["password"]):
         return False
+    if not user.get("is_active", True):
+        return False
     return User(**user)
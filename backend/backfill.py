@@ -0,0 +1,130 @@
+"""
+Backfill runner: re-processes the documents that are not at the current
+pipeline version of a stage, after the extractor, the summary prompt or the
+tag list changed. The work itself is done by the job queue workers
+(worker.py), which must be running.
+
+Run it from the backend directory, separately from the API process:
+
+    python backfill.py start tags --dry-run
+    python backfill.py start tags --batch-size 50 --max-in-flight 100
+    python backfill.py status
+    python backfill.py pause RUN_ID
+    python backfill.py resume RUN_ID
+
+Stages: extract (re-extract text), summary, tags, index (near-duplicate
+signatures and question-answering passages). Progress is checkpointed in
+Mongo; Ctrl+C pauses the run and ``resume`` continues it.
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.backfill import BackfillRunner, BACKFILL_TASKS, RUN_RUNNING
+
+
+def print_json(value: dict):
+    print(json.dumps(value, indent=2, ensure_ascii=False, default=str))
+
+
+async def run_until_stopped(db, run: dict):
+    """Enqueue a claimed run's documents; SIGINT/SIGTERM pause it"""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    print(f"Backfill {run['_id']} ({run['task']} -> version {run['target_version']}) running")
+    run = await BackfillRunner.run(db, run, stopping)
+    if stopping.is_set() and run["status"] == RUN_RUNNING:
+        run = await BackfillRunner.pause(db, run["_id"]) or run
+        print(f"Backfill {run['_id']} paused, continue with: python backfill.py resume {run['_id']}")
+    print_json(await BackfillRunner.progress(db, run))
+
+
+async def start(db, args):
+    if args.dry_run:
+        print_json(await BackfillRunner.dry_run(db, args.task, args.overwrite))
+        return
+    run = await BackfillRunner.create(
+        db, args.task, batch_size=args.batch_size, max_in_flight=args.max_in_flight,
+        rate_per_minute=args.rate, overwrite=args.overwrite
+    )
+    print(f"Created backfill {run['_id']} for {run['total']} documents")
+    await run_until_stopped(db, await BackfillRunner.claim(db, run["_id"]))
+
+
+async def resume(db, args):
+    run = await BackfillRunner.get(db, args.run_id)
+    if run is None:
+        print(f"Backfill {args.run_id} not found")
+        return
+    claimed = await BackfillRunner.claim(db, run["_id"])
+    if claimed is None:
+        print(f"Backfill {args.run_id} is {run['status']}" + (" in another runner" if run["status"] == RUN_RUNNING else ""))
+        return
+    await run_until_stopped(db, claimed)
+
+
+async def pause(db, args):
+    run = await BackfillRunner.get(db, args.run_id)
+    if run is None:
+        print(f"Backfill {args.run_id} not found")
+        return
+    paused = await BackfillRunner.pause(db, run["_id"])
+    if paused is None:
+        print(f"Backfill {args.run_id} is not running ({run['status']})")
+        return
+    print_json(await BackfillRunner.progress(db, paused))
+
+
+async def status(db, args):
+    run = await BackfillRunner.get(db, args.run_id) if args.run_id else await BackfillRunner.latest(db)
+    if run is None:
+        print("No backfill found")
+        return
+    print_json(await BackfillRunner.progress(db, run))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Re-process documents after a pipeline change")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    start_parser = commands.add_parser("start", help="Start a backfill of one pipeline stage")
+    start_parser.add_argument("task", choices=BACKFILL_TASKS)
+    start_parser.add_argument("--batch-size", type=int, default=50, help="Documents enqueued per batch")
+    start_parser.add_argument("--max-in-flight", type=int, default=100,
+                              help="Maximum number of this run's jobs waiting or running in the queue")
+    start_parser.add_argument("--rate", type=float, default=0, help="Maximum documents enqueued per minute, 0 for no limit")
+    start_parser.add_argument("--overwrite", action="store_true",
+                              help="Also replace summaries and tags without a pipeline version "
+                                   "(written by the uploader or before versions were recorded)")
+    start_parser.add_argument("--dry-run", action="store_true", help="Only report what would be processed")
+    start_parser.set_defaults(handler=start)
+
+    for name, handler, help_text in (
+        ("resume", resume, "Continue a paused or interrupted backfill"),
+        ("pause", pause, "Pause a running backfill and take its waiting jobs off the queue"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("run_id")
+        command.set_defaults(handler=handler)
+
+    status_parser = commands.add_parser("status", help="Progress and ETA of a backfill, the latest one by default")
+    status_parser.add_argument("run_id", nargs="?")
+    status_parser.set_defaults(handler=status)
+
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    try:
+        await args.handler(await get_database(), args)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,237 @@
+"""
+Throughput benchmark of the enrichment pipeline: upload, extraction, summary
+and tags for many documents at a chosen concurrency.
+
+Start the mock LLM server, then run the benchmark from the backend directory
+against it:
+
+    python mock_llm_server.py --latency 0.8 --tokens-per-second 80 &
+    OPENAI_BASE_URL=http://localhost:8089/v1 LLM_CACHE_ENABLED=false \
+        python benchmark_enrichment.py --documents 200 --concurrency 16
+
+Documents are generated DOCX files of ``--words`` words, or the files of a
+``--files`` directory. Each one is written to disk like an upload, extracted
+in the extraction pool, then summarized and tagged concurrently the way the
+worker does it. The report gives documents per second, p50/p95/p99 latency
+per stage and the LLM client and scheduler statistics; ``--json`` also saves
+it for comparing runs.
+
+The benchmark refuses to run against a non-local OPENAI_BASE_URL unless
+``--allow-remote`` is given, so it never spends API credit by accident. It
+measures one process, so the Mongo-backed shared LLM budget is off unless
+``--shared-budget`` is given; without a running Mongo it would stall every
+refresh on server selection and skew the latencies.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from urllib.parse import urlparse
+
+import aiofiles
+import docx
+
+from services.ai_service import AIService
+from services.extraction import processing_type
+from services.extraction_pool import ExtractionPool
+from services.llm_client import LLMClient, OPENAI_BASE_URL
+from services.llm_cache import LLMCache
+import services.llm_scheduler as llm_scheduler
+from services.llm_scheduler import LLMScheduler
+from services.tag_classifier import TagClassifier
+from services.text_store import content_hash
+
+STAGES = ["upload", "extract", "summarize", "tag", "total"]
+PERCENTILES = [0.5, 0.95, 0.99]
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", "0.0.0.0"}
+
+SAMPLE_WORDS = [
+    "ngân hàng", "khách hàng", "tín dụng", "quy trình", "hệ thống", "giao dịch", "ATM", "sự cố",
+    "core banking", "doanh nghiệp", "quy định", "onboarding", "báo cáo", "phê duyệt", "hồ sơ", "thẻ",
+    "chi nhánh", "bảo mật", "tài khoản", "hạn mức", "lãi suất", "kiểm soát", "vận hành", "dịch vụ",
+]
+
+
+def generate_docx(number: int, words: int) -> bytes:
+    """A DOCX file of made-up paragraphs, different for every document number"""
+    document_rng = random.Random(number)
+    document = docx.Document()
+    document.add_heading(f"Tài liệu thử nghiệm {number}", level=1)
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, document_rng.randint(40, 120))
+        document.add_paragraph(" ".join(document_rng.choice(SAMPLE_WORDS) for _ in range(length)) + ".")
+        remaining -= length
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def load_documents(args) -> list:
+    """(file name, file type, content) of every document to run through the pipeline"""
+    if args.files:
+        documents = []
+        for name in sorted(os.listdir(args.files)):
+            file_type = processing_type(name.rsplit(".", 1)[-1].lower())
+            if file_type != "unknown":
+                with open(os.path.join(args.files, name), "rb") as f:
+                    documents.append((name, file_type, f.read()))
+        # Repeat the files up to the requested count
+        return [documents[i % len(documents)] for i in range(max(args.documents, len(documents)))] if documents else []
+    return [(f"document-{number}.docx", "docx", generate_docx(number, args.words)) for number in range(args.documents)]
+
+
+def percentile(values: list, share: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(share * len(ordered)) - 1))]
+
+
+async def timed(timings: dict, stage: str, awaitable):
+    started = time.monotonic()
+    try:
+        return await awaitable
+    finally:
+        timings[stage] = time.monotonic() - started
+
+
+async def process_document(upload_dir: str, number: int, document: tuple, semaphore: asyncio.Semaphore,
+                           results: list):
+    """Upload, extract, summarize and tag one document, recording the time of each stage"""
+    name, file_type, content = document
+    timings, outcome = {}, {"name": name, "error": None}
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            async def upload():
+                file_path = os.path.join(upload_dir, f"{number}-{name}")
+                async with aiofiles.open(file_path, "wb") as f:
+                    await f.write(content)
+                return file_path, content_hash(content)
+
+            file_path, _ = await timed(timings, "upload", upload())
+            structured = await timed(timings, "extract", AIService.extract_structured(file_path, file_type))
+            summary, tags = await asyncio.gather(
+                timed(timings, "summarize", AIService.generate_summary(structured.text)),
+                timed(timings, "tag", AIService.generate_tags(structured.text, name))
+            )
+            # Both generators return an empty result instead of raising
+            if structured.text and not summary:
+                outcome["error"] = "empty summary"
+            elif structured.text and not tags:
+                outcome["error"] = "no tags"
+        except Exception as e:
+            outcome["error"] = f"{e.__class__.__name__}: {e}"
+        timings["total"] = time.monotonic() - started
+    outcome["timings"] = timings
+    results.append(outcome)
+
+
+async def run_benchmark(args) -> dict:
+    documents = load_documents(args)
+    if not documents:
+        raise SystemExit("No documents to process")
+
+    upload_dir = tempfile.mkdtemp(prefix="enrichment-benchmark-")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*[
+            process_document(upload_dir, number, document, semaphore, results)
+            for number, document in enumerate(documents)
+        ])
+    finally:
+        elapsed = time.monotonic() - started
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    succeeded = [result for result in results if not result["error"]]
+    errors = {}
+    for result in results:
+        if result["error"]:
+            errors[result["error"]] = errors.get(result["error"], 0) + 1
+
+    stages = {}
+    for stage in STAGES:
+        values = [result["timings"][stage] for result in succeeded if stage in result["timings"]]
+        stages[stage] = {
+            f"p{int(share * 100)}": round(percentile(values, share), 4) if values else None
+            for share in PERCENTILES
+        }
+        stages[stage]["mean"] = round(sum(values) / len(values), 4) if values else None
+
+    return {
+        "documents": len(documents),
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "documents_per_second": round(len(succeeded) / elapsed, 3) if elapsed else None,
+        "stages": stages,
+        "llm": LLMClient.stats(),
+        "llm_scheduler": LLMScheduler.stats(),
+        "llm_cache": LLMCache.stats(),
+        "tag_classifier": TagClassifier.stats(),
+        "extraction_pool": ExtractionPool.stats(),
+    }
+
+
+def print_report(report: dict):
+    print(f"\n{report['succeeded']}/{report['documents']} documents in {report['elapsed_seconds']}s "
+          f"at concurrency {report['concurrency']}: {report['documents_per_second']} documents/s")
+    print(f"\n{'stage':<10} {'p50':>9} {'p95':>9} {'p99':>9} {'mean':>9}")
+    for stage, values in report["stages"].items():
+        cells = [f"{values[key]:.3f}" if values[key] is not None else "-" for key in ("p50", "p95", "p99", "mean")]
+        print(f"{stage:<10} " + " ".join(f"{cell:>9}" for cell in cells))
+    if report["errors"]:
+        print("\nErrors:")
+        for error, count in report["errors"].items():
+            print(f"  {count} x {error}")
+    llm = report["llm"]
+    print(f"\nLLM: {llm['requests']} requests, {llm['retries']} retries, {llm['failed']} failed, "
+          f"{report['llm_scheduler']['rate_limited']} rate limited, "
+          f"{llm['prompt_tokens'] + llm['completion_tokens']} tokens")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the upload, extract, summarize and tag pipeline")
+    parser.add_argument("--documents", type=int, default=100, help="Number of documents to process")
+    parser.add_argument("--concurrency", type=int, default=8, help="Documents in the pipeline at once")
+    parser.add_argument("--words", type=int, default=1500, help="Words per generated document")
+    parser.add_argument("--files", help="Directory of real documents to use instead of generated ones")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-local OPENAI_BASE_URL")
+    parser.add_argument("--shared-budget", action="store_true",
+                        help="Keep the Mongo-backed LLM budget shared by processes (needs Mongo)")
+    args = parser.parse_args()
+
+    if not args.shared_budget:
+        llm_scheduler.LLM_SHARED_BUDGET = False
+
+    if urlparse(OPENAI_BASE_URL).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        raise SystemExit(f"OPENAI_BASE_URL is {OPENAI_BASE_URL}; point it at mock_llm_server.py or pass --allow-remote")
+
+    try:
+        report = await run_benchmark(args)
+    finally:
+        ExtractionPool.shutdown()
+        await LLMClient.close()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,6 +3,8 @@ from pymongo.server_api import ServerApi
 import os
 from typing import Optional
 
+from services.llm_cache import LLM_CACHE_TTL_DAYS
+
 class Database:
     client: Optional[AsyncIOMotorClient] = None
     database = None
@@ -47,5 +49,42 @@ async def create_indexes():
     await db.database.documents.create_index("created_at")
     await db.database.documents.create_index("owner_id")
     await db.database.documents.create_index("visibility")
+    await db.database.documents.create_index([("storage_tier", 1), ("last_accessed_at", 1)])
+    await db.database.documents.create_index("content_hash")
+    # Source paths of bulk-imported files, so an interrupted import never inserts one twice
+    await db.database.documents.create_index("import_source", unique=True, sparse=True)
+    
+    # Extracted text store, keyed by content hash
+    await db.database.extracted_texts.create_index([("search_text", "text")], default_language="none")
+    # LSH band keys of the near-duplicate signatures
+    await db.database.extracted_texts.create_index("minhash_bands")
+    
+    # Passages for question answering, keyed by content hash
+    await db.database.passages.create_index([("text", "text")], default_language="none")
+    await db.database.passages.create_index("content_hash")
+    
+    # Document versions
+    await db.database.document_versions.create_index([("document_id", 1), ("version", -1)], unique=True)
+    
+    # OCR results by page hash
+    await db.database.ocr_cache.create_index("created_at")
+    
+    # Background job queue
+    await db.database.jobs.create_index([("status", 1), ("run_at", 1)])
+    await db.database.jobs.create_index([("status", 1), ("lease_until", 1)])
+    # Jobs of a backfill run
+    await db.database.jobs.create_index("payload.run_id", sparse=True)
+    
+    # Cached LLM responses expire after LLM_CACHE_TTL_DAYS
+    await db.database.llm_cache.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL_DAYS * 24 * 3600)
+    
+    # Shared LLM budget windows, only the current one matters
+    await db.database.llm_budget.create_index("created_at", expireAfterSeconds=3600)
+    
+    # Results of near-duplicate scans, the latest one is shown
+    await db.database.near_duplicate_reports.create_index("created_at")
+    
+    # Staged uploads expire on their own
+    await db.database.staged_uploads.create_index("expires_at", expireAfterSeconds=0)
     
     print("Database indexes created successfully!")
@@ -11,8 +11,17 @@ from passlib.context import CryptContext
 
 from database import connect_to_mongo, close_mongo_connection, create_indexes, get_database
 from models import User, Document, DocumentCreate, UserCreate, UserLogin, DocumentResponse
-from auth import create_access_token, verify_token, get_current_user
-from routes import auth, documents, ratings, ai
+from auth import create_access_token, verify_token, get_current_user, get_current_admin, UserCache
+from routes import auth, documents, ratings, ai, admin
+from services.extraction_pool import ExtractionPool
+from services.ocr import OcrPipeline
+from services.job_queue import JobQueue
+from services.llm_client import LLMClient
+from services.llm_cache import LLMCache
+from services.llm_scheduler import LLMScheduler
+from services.tag_classifier import TagClassifier
+from services.question_answering import QuestionAnswering
+from services.single_flight import SingleFlight
 
 app = FastAPI(title="Knowledge Management System", version="1.0.0")
 
@@ -37,9 +46,12 @@ security = HTTPBearer()
 async def startup_event():
     await connect_to_mongo()
     await create_indexes()
+    ExtractionPool.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    ExtractionPool.shutdown()
+    await LLMClient.close()
     await close_mongo_connection()
 
 # Include routers
@@ -47,6 +59,7 @@ app.include_router(auth.router)
 app.include_router(documents.router)
 app.include_router(ratings.router)
 app.include_router(ai.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def root():
@@ -56,5 +69,22 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/metrics")
+async def metrics(current_user: User = Depends(get_current_admin)):
+    """Runtime metrics of this API worker, for administrators"""
+    db = await get_database()
+    return {
+        "extraction_pool": ExtractionPool.stats(),
+        "ocr": OcrPipeline.stats(),
+        "jobs": await JobQueue.stats(db),
+        "llm": LLMClient.stats(),
+        "llm_scheduler": LLMScheduler.stats(),
+        "question_answering": QuestionAnswering.stats(),
+        "single_flight": SingleFlight.stats(),
+        "llm_cache": LLMCache.stats(),
+        "tag_classifier": TagClassifier.stats(),
+        "user_cache": UserCache.stats(),
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
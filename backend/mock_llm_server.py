@@ -0,0 +1,210 @@
+"""
+Local stand-in for the OpenAI chat completions API, for benchmarks and for
+running the AI path without an API key.
+
+Run it from the backend directory:
+
+    python mock_llm_server.py --port 8089 --latency 0.8 --latency-distribution lognormal \
+        --tokens-per-second 80 --error-rate 0.01 --rate-limit-rate 0.02
+
+and point the backend, the worker or the llm service at it with
+``OPENAI_BASE_URL=http://localhost:8089/v1``.
+
+Answers depend only on the request, so runs are repeatable: summaries are
+made-up Vietnamese text of the requested length, classification prompts get
+tags from their own allowed list (JSON for packed prompts). Latency, output
+speed, server errors and 429s are drawn from a seeded random generator.
+``GET /stats`` shows what was served.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import deque
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ["fixed", "uniform", "exponential", "lognormal"]
+CHARS_PER_TOKEN = 3
+DEFAULT_ANSWER_WORDS = 100
+
+WORDS = [
+    "tài liệu", "quy trình", "khách hàng", "ngân hàng", "hệ thống", "dịch vụ", "tín dụng", "giao dịch",
+    "báo cáo", "quy định", "nhân viên", "phê duyệt", "hồ sơ", "kiểm tra", "thông tin", "rủi ro",
+    "hợp đồng", "thanh toán", "tài khoản", "bảo mật", "triển khai", "đánh giá", "chi nhánh", "sự cố",
+]
+
+app = FastAPI(title="Mock LLM API")
+settings = argparse.Namespace()
+rng = random.Random(0)
+_recent_requests = deque()
+_stats = {
+    "requests": 0,
+    "streamed": 0,
+    "errors_injected": 0,
+    "rate_limited": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+}
+
+
+def sample_latency() -> float:
+    """Seconds before the first token, drawn from the configured distribution"""
+    mean = settings.latency
+    if mean <= 0 or settings.latency_distribution == "fixed":
+        return max(0.0, mean)
+    if settings.latency_distribution == "uniform":
+        return rng.uniform(0, 2 * mean)
+    if settings.latency_distribution == "exponential":
+        return rng.expovariate(1 / mean)
+    # Log-normal with the given mean, a long tail like real APIs
+    sigma = settings.latency_sigma
+    return rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+
+def count_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def answer_for(body: dict) -> str:
+    """Deterministic answer to a chat completion request"""
+    messages = body.get("messages") or []
+    prompt = messages[-1].get("content", "") if messages else ""
+    answer_rng = random.Random(hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest())
+
+    allowed = re.search(r"Danh sách tag cho phép: (.+)", prompt)
+    if allowed:
+        tags = [tag.strip() for tag in allowed.group(1).split(",") if tag.strip()]
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            documents = len(re.findall(r"^### Văn bản \d+", prompt, flags=re.MULTILINE))
+            return json.dumps(
+                {str(number): answer_rng.sample(tags, min(2, len(tags))) for number in range(1, documents + 1)},
+                ensure_ascii=False
+            )
+        return ", ".join(answer_rng.sample(tags, min(3, len(tags))))
+
+    length = re.search(r"khoảng (\d+) từ", prompt)
+    words = int(length.group(1)) if length else DEFAULT_ANSWER_WORDS
+    if body.get("max_tokens"):
+        words = min(words, body["max_tokens"] // 2)
+    return " ".join(answer_rng.choice(WORDS) for _ in range(max(1, words)))
+
+
+def injected_failure():
+    """A 429 or 5xx response when the request is picked for one, else None"""
+    now = time.monotonic()
+    _recent_requests.append(now)
+    while _recent_requests and _recent_requests[0] < now - 60:
+        _recent_requests.popleft()
+
+    if (settings.rpm and len(_recent_requests) > settings.rpm) or rng.random() < settings.rate_limit_rate:
+        _stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests"}},
+            headers={"retry-after": str(settings.retry_after)}
+        )
+    if rng.random() < settings.error_rate:
+        _stats["errors_injected"] += 1
+        return JSONResponse(status_code=503, content={"error": {"message": "Injected server error"}})
+    return None
+
+
+def completion_chunks(answer: str):
+    """Split an answer into pieces of about one token"""
+    return re.findall(r"\S+\s*|\s+", answer)
+
+
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    _stats["requests"] += 1
+    failure = injected_failure()
+    if failure is not None:
+        return failure
+
+    answer = answer_for(body)
+    prompt_tokens = sum(count_tokens(message.get("content") or "") for message in body.get("messages") or [])
+    completion_tokens = count_tokens(answer)
+    _stats["prompt_tokens"] += prompt_tokens
+    _stats["completion_tokens"] += completion_tokens
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    model = body.get("model", "mock")
+    token_delay = 1 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+
+    if not body.get("stream"):
+        await asyncio.sleep(sample_latency() + completion_tokens * token_delay)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    _stats["streamed"] += 1
+
+    async def events():
+        await asyncio.sleep(sample_latency())
+        pieces = completion_chunks(answer)
+        for piece in pieces:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(token_delay * completion_tokens / max(1, len(pieces)))
+        final = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(final)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({'id': completion_id, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return {"settings": vars(settings), **_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds before the first token")
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.6, help="Spread of the log-normal distribution")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="Output speed, 0 for instant")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=0, help="Answer 429 above this many requests per minute")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of 429 responses")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vars(settings).update({key: value for key, value in vars(args).items() if key not in ("host", "port")})
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,8 @@ class User(UserBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
+    # Access to the /admin endpoints, only set in Mongo (or by another admin), never at registration
+    is_admin: bool = False
 
     class Config:
         allow_population_by_field_name = True
@@ -64,6 +66,13 @@ class UserResponse(BaseModel):
     group: Optional[str]
     # created_at: datetime
 
+class UserAdminUpdate(BaseModel):
+    full_name: Optional[str] = Field(None, min_length=1, max_length=100)
+    department: Optional[str] = None
+    group: Optional[str] = None
+    is_active: Optional[bool] = None
+    is_admin: Optional[bool] = None
+
 # Document Models
 class DocumentBase(BaseModel):
     title: str = Field(..., min_length=1, max_length=200)
@@ -106,6 +115,7 @@ class DocumentResponse(BaseModel):
     updated_at: datetime
     average_rating: float
     rating_count: int
+    enrichment_job_id: Optional[str] = None
 
 # Rating Model
 class Rating(BaseModel):
@@ -141,3 +151,4 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[str] = None
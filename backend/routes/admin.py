@@ -0,0 +1,104 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from database import get_database
+from models import User, UserAdminUpdate, UserResponse
+from auth import get_current_admin, UserCache
+from services.job_queue import JobQueue, NEAR_DUPLICATE_SCAN
+from services.near_duplicates import NEAR_DUPLICATE_THRESHOLD
+from services.text_store import TextStore
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+@router.post("/near-duplicates/backfill")
+async def backfill_near_duplicate_signatures(
+    limit: int = Query(500, ge=1, le=5000),
+    current_user: User = Depends(get_current_admin)
+):
+    """Compute near-duplicate signatures for stored texts that do not have one yet.
+
+    Call repeatedly until ``remaining`` is 0 before looking for duplicates in
+    documents uploaded before near-duplicate detection existed.
+    """
+    db = await get_database()
+    return await TextStore.backfill_signatures(db, limit)
+
+@router.post("/passages/backfill")
+async def backfill_passages(
+    limit: int = Query(200, ge=1, le=2000),
+    current_user: User = Depends(get_current_admin)
+):
+    """Index the passages of stored texts for /ai/ask; call repeatedly until ``remaining`` is 0"""
+    db = await get_database()
+    return await TextStore.backfill_passages(db, limit)
+
+async def enqueue_scan(db, threshold: float, flag: bool, current_user: User) -> dict:
+    job_id = await JobQueue.enqueue(
+        db, NEAR_DUPLICATE_SCAN, {"threshold": threshold, "flag": flag}, owner_id=current_user.id
+    )
+    return {"job_id": job_id, "threshold": threshold, "flag": flag}
+
+@router.post("/near-duplicates/scan")
+async def scan_near_duplicates(
+    threshold: float = Query(NEAR_DUPLICATE_THRESHOLD, ge=0.5, le=1.0),
+    current_user: User = Depends(get_current_admin)
+):
+    """Group the near-duplicate documents of the whole corpus in a background job.
+
+    Poll ``/ai/jobs/{job_id}``; ``GET /admin/near-duplicates`` then returns the groups.
+    """
+    db = await get_database()
+    return await enqueue_scan(db, threshold, False, current_user)
+
+@router.get("/near-duplicates")
+async def list_near_duplicates(current_user: User = Depends(get_current_admin)):
+    """The groups found by the latest near-duplicate scan, with their estimated similarity to the oldest document"""
+    db = await get_database()
+    report = await db.near_duplicate_reports.find_one({}, sort=[("created_at", -1)])
+    if not report:
+        raise HTTPException(status_code=404, detail="No near-duplicate scan yet, start one with POST /admin/near-duplicates/scan")
+    return {
+        "threshold": report["threshold"],
+        "scanned_at": report["created_at"],
+        "group_count": len(report["groups"]),
+        "groups": report["groups"],
+    }
+
+@router.post("/near-duplicates/flag")
+async def flag_near_duplicates(
+    threshold: float = Query(NEAR_DUPLICATE_THRESHOLD, ge=0.5, le=1.0),
+    current_user: User = Depends(get_current_admin)
+):
+    """Scan in a background job and mark every document of a group as a near-duplicate of its oldest document"""
+    db = await get_database()
+    return await enqueue_scan(db, threshold, True, current_user)
+
+@router.patch("/users/{username}", response_model=UserResponse)
+async def update_user(
+    username: str,
+    update: UserAdminUpdate,
+    current_user: User = Depends(get_current_admin)
+):
+    """Change a user's profile, group, active or admin flag; department and group can be cleared with null.
+
+    Takes effect at once on this API worker and within USER_CACHE_TTL_SECONDS
+    on the others.
+    """
+    db = await get_database()
+    changes = update.dict(exclude_unset=True)
+    required = [field for field in ("full_name", "is_active", "is_admin") if field in changes and changes[field] is None]
+    if required:
+        raise HTTPException(status_code=422, detail=f"{', '.join(required)} cannot be null")
+    if changes:
+        await db.users.update_one({"username": username}, {"$set": changes})
+    user = await db.users.find_one({"username": username})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    UserCache.invalidate(username)
+    return UserResponse(
+        id=str(user["_id"]),
+        username=user["username"],
+        email=user["email"],
+        full_name=user["full_name"],
+        department=user.get("department"),
+        group=user.get("group")
+    )
@@ -1,22 +1,114 @@
+import json
+import asyncio
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File
+from fastapi.responses import StreamingResponse
 from typing import Optional
-import tempfile
-import os
 
 from database import get_database
 from models import User
 from auth import get_current_user
 from services.ai_service import AIService
+from services.extraction import build_document
+from services.staging import StagingArea
+from services.text_store import TextStore
+from services.extraction_pool import ExtractionError, ExtractionUnavailable
+from services.job_queue import JobQueue, ANALYZE_STAGED, JOB_QUEUED
+from services.llm_client import LLMError
+from services.question_answering import QuestionAnswering
+from routes.documents import MAX_FILE_SIZE
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    """Send (event, data) pairs as server-sent events; a failure becomes a final ``error`` event"""
+    async def body():
+        try:
+            async for event, data in events:
+                yield sse_event(event, data)
+        except ExtractionUnavailable as e:
+            yield sse_event("error", {"status_code": status.HTTP_503_SERVICE_UNAVAILABLE, "detail": str(e)})
+        except ExtractionError as e:
+            yield sse_event("error", {"status_code": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                      "detail": f"Failed to extract text: {str(e)}"})
+        except Exception as e:
+            print(f"Streamed AI request failed: {e}")
+            yield sse_event("error", {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": str(e)})
+
+    return StreamingResponse(
+        body(), media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def stream_analysis(db, staged: dict, file_type: str, title: str):
+    """Events of a streamed file analysis; the result is saved with the staged file at the end"""
+    yield "staged", {"staging_id": staged["_id"], "expires_at": staged["expires_at"]}
+
+    structured = await TextStore.get_structured(db, staged["content_hash"])
+    if structured is None and file_type == "pdf":
+        # Report PDF pages as they are extracted
+        pages = []
+        async for number, blocks, page_count in AIService.iter_file_pages(staged["file_path"], file_type):
+            pages.append((number, blocks))
+            yield "progress", {"stage": "extracting", "page": number, "page_count": page_count}
+        structured = build_document(file_type, pages)
+        await TextStore.put(db, staged["content_hash"], structured)
+    elif structured is None:
+        yield "progress", {"stage": "extracting"}
+        structured = await TextStore.get_or_extract(db, staged["content_hash"], staged["file_path"], file_type)
+    text = structured.text
+    yield "progress", {
+        "stage": "extracted",
+        "characters": len(text),
+        "extracted_text_preview": text[:500] + "..." if len(text) > 500 else text,
+        "has_content": bool(text)
+    }
+
+    summary, tags = "", []
+    if text:
+        tags_task = asyncio.ensure_future(AIService.generate_tags(text, title))
+        try:
+            async for event, data in AIService.stream_summary(text):
+                if event == "summary":
+                    summary = data["summary"]
+                else:
+                    yield event, data
+                if tags_task is not None and tags_task.done():
+                    tags, tags_task = tags_task.result(), None
+                    yield "tags", {"tags": tags}
+            if tags_task is not None:
+                tags, tags_task = await tags_task, None
+                yield "tags", {"tags": tags}
+        finally:
+            if tags_task is not None:
+                tags_task.cancel()
+
+    await StagingArea.save_analysis(db, staged["_id"], summary, tags)
+    yield "summary", {"staging_id": staged["_id"], "summary": summary, "tags": tags}
+
 @router.post("/analyze-file")
 async def analyze_file(
     file: UploadFile = File(...),
     title: str = "",
+    background: bool = False,
+    stream: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Analyze uploaded file and generate summary and tags"""
+    """Analyze uploaded file and generate summary and tags.
+
+    The file is kept in the staging area; pass the returned ``staging_id`` to
+    ``/documents/upload`` instead of sending the file a second time.
+
+    With ``background=true`` the analysis runs in a worker and the response
+    only carries the ``job_id``; poll ``/ai/jobs/{job_id}`` for the result.
+    With ``stream=true`` the response is a server-sent event stream of
+    extraction progress, the summary as it is generated, the tags, and a
+    final ``summary`` event with the complete result.
+    """
+    db = await get_database()
     
     # Validate file type
     allowed_extensions = ['pdf', 'doc', 'docx', 'png', 'jpg', 'jpeg', 'gif']
@@ -28,12 +120,26 @@ async def analyze_file(
             detail="File type not supported for AI analysis"
         )
 
+    content = await file.read()
+    if len(content) > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE // (1024*1024)}MB"
+        )
+
     try:
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Keep the file in the staging area for the follow-up upload
+        staged = await StagingArea.stage_file(db, current_user.id, file.filename, content)
+        
+        if background:
+            job_id = await JobQueue.enqueue(
+                db, ANALYZE_STAGED, {"staging_id": staged["_id"], "title": title}, owner_id=current_user.id
+            )
+            return {
+                "staging_id": staged["_id"],
+                "expires_at": staged["expires_at"],
+                "job_id": job_id
+            }
 
         # Determine file type for processing
         if file_extension == 'pdf':
@@ -45,26 +151,36 @@ async def analyze_file(
         else:
             file_type = 'unknown'
 
+        if stream:
+            return sse_response(stream_analysis(db, staged, file_type, title))
+
+        # Extract once into the text store, the upload reuses it by content hash
+        structured = await TextStore.get_or_extract(db, staged["content_hash"], staged["file_path"], file_type)
+        text = structured.text
+
         # Analyze file with AI
         analysis_result = await AIService.enhance_document_metadata(
-            temp_file_path, file_type, title
+            staged["file_path"], file_type, title, text=text
         )
 
-        # Clean up temporary file
-        os.unlink(temp_file_path)
+        await StagingArea.save_analysis(
+            db, staged["_id"], analysis_result["summary"], analysis_result["tags"]
+        )
 
         return {
+            "staging_id": staged["_id"],
+            "expires_at": staged["expires_at"],
             "summary": analysis_result["summary"],
             "tags": analysis_result["tags"],
             "extracted_text_preview": analysis_result["extracted_text"][:500] + "..." if len(analysis_result["extracted_text"]) > 500 else analysis_result["extracted_text"],
             "has_content": bool(analysis_result["extracted_text"])
         }
 
+    except ExtractionUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except ExtractionError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Failed to extract text: {str(e)}")
     except Exception as e:
-        # Clean up temporary file if it exists
-        if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"AI analysis failed: {str(e)}"
@@ -74,9 +190,15 @@ async def analyze_file(
 async def generate_summary(
     text: str,
     max_words: int = 500,
+    stream: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Generate summary from provided text"""
+    """Generate summary from provided text.
+
+    With ``stream=true`` the summary is sent as server-sent events: progress
+    for long text, ``token`` events as it is generated and a final
+    ``summary`` event with the complete summary.
+    """
     
     if not text or len(text.strip()) < 20:
         raise HTTPException(
@@ -84,6 +206,9 @@ async def generate_summary(
             detail="Text is too short for summary generation"
         )
 
+    if stream:
+        return sse_response(AIService.stream_summary(text, max_words))
+
     try:
         summary = await AIService.generate_summary(text, max_words)
         return {"summary": summary}
@@ -115,3 +240,54 @@ async def generate_tags(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Tag generation failed: {str(e)}"
         )
+
+@router.post("/ask")
+async def ask_question(
+    question: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Answer a question from the documents the user may open, with citations to documents and pages"""
+    question = question.strip()
+    if len(question) < 5 or len(question) > 1000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Question must be between 5 and 1000 characters"
+        )
+
+    db = await get_database()
+    try:
+        return await QuestionAnswering.ask(db, current_user, question)
+    except LLMError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Answer generation failed: {str(e)}")
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Question answering failed: {str(e)}"
+        )
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Status, progress and result of a background AI job"""
+    db = await get_database()
+    
+    job = await JobQueue.get(db, job_id)
+    if not job or job.get("owner_id") != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    
+    return {
+        "id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "next_attempt_at": job["run_at"] if job["status"] == JOB_QUEUED else None,
+        "last_error": job["last_error"],
+        "result": job["result"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "finished_at": job.get("finished_at")
+    }
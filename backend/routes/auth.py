@@ -3,7 +3,10 @@ from fastapi.security import HTTPAuthorizationCredentials
 from datetime import timedelta
 from database import get_database
 from models import UserCreate, UserLogin, User, Token, UserResponse
-from auth import get_password_hash, authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from auth import (
+    get_password_hash, authenticate_user, create_access_token, token_claims, ACCESS_TOKEN_EXPIRE_MINUTES,
+    get_current_user
+)
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
@@ -29,6 +32,7 @@ async def register(user: UserCreate):
     hashed_password = get_password_hash(user.password)
     user_dict = user.dict()
     user_dict["password"] = hashed_password
+    user_dict["is_admin"] = False
     
     result = await db.users.insert_one(user_dict)
     created_user = await db.users.find_one({"_id": result.inserted_id})
@@ -54,7 +58,7 @@ async def login(user_credentials: UserLogin):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, **token_claims(user)}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
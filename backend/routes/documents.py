@@ -1,15 +1,27 @@
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from typing import Optional, List
 import os
+import json
 import uuid
-from datetime import datetime
+from urllib.parse import quote
+from datetime import datetime, timedelta
 import aiofiles
 from bson import ObjectId
 
 from database import get_database
 from models import Document, DocumentCreate, DocumentResponse, User, VisibilityLevel, DocumentType
 from auth import get_current_user
+from services.storage import DocumentStorage, HOT_TIER, COLD_TIER
+from services.staging import StagingArea
+from services.versioning import DocumentVersioning, VersionConflict
+from services.chunk_store import ChunkStore
+from services.text_store import TextStore, content_hash, EXTRACTION_FAILED
+from services.single_flight import SingleFlight
+from services.ai_service import AIService
+from services.extraction_pool import ExtractionError, ExtractionUnavailable
+from services.job_queue import JobQueue, ENRICH_DOCUMENT
+from services.extraction import build_document, page_blocks_text
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
@@ -25,8 +37,8 @@ ALLOWED_EXTENSIONS = {
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
-async def save_uploaded_file(file: UploadFile) -> tuple[str, DocumentType, int]:
-    """Save uploaded file and return file path, type, and size"""
+async def save_uploaded_file(file: UploadFile) -> tuple[str, DocumentType, int, str]:
+    """Save uploaded file and return file path, type, size, and content hash"""
     # Validate file extension
     file_extension = file.filename.split('.')[-1].lower()
     if file_extension not in ALLOWED_EXTENSIONS:
@@ -54,7 +66,35 @@ async def save_uploaded_file(file: UploadFile) -> tuple[str, DocumentType, int]:
     async with aiofiles.open(file_path, 'wb') as f:
         await f.write(content)
     
-    return file_path, ALLOWED_EXTENSIONS[file_extension], file_size
+    return file_path, ALLOWED_EXTENSIONS[file_extension], file_size, content_hash(content)
+
+ACCESS_TOUCH_INTERVAL = timedelta(hours=1)
+
+async def promote_staged_file(staged: dict) -> tuple[str, DocumentType, int]:
+    """Move a staged file into the uploads directory and return file path, type, and size"""
+    file_extension = staged["file_extension"]
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Supported types: {', '.join(ALLOWED_EXTENSIONS.keys())}"
+        )
+    
+    file_path = os.path.join("uploads", f"{uuid.uuid4()}.{file_extension}")
+    os.replace(staged["file_path"], file_path)
+    
+    return file_path, ALLOWED_EXTENSIONS[file_extension], staged["file_size"]
+
+async def touch_document(db, document: dict):
+    """Record an access so the tiering job keeps frequently read documents hot"""
+    now = datetime.utcnow()
+    last_accessed = document.get("last_accessed_at")
+    # Only write when the stored timestamp is stale, reads should not all become writes
+    if last_accessed and now - last_accessed < ACCESS_TOUCH_INTERVAL:
+        return
+    await db.documents.update_one(
+        {"_id": document["_id"]},
+        {"$set": {"last_accessed_at": now}}
+    )
 
 @router.post("/upload", response_model=DocumentResponse)
 async def upload_document(
@@ -62,18 +102,45 @@ async def upload_document(
     summary: Optional[str] = Form(None),
     tags: str = Form(""),
     visibility: VisibilityLevel = Form(VisibilityLevel.PRIVATE),
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    staging_id: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload a new document"""
+    """Upload a new document.
+
+    Either send the file, or the ``staging_id`` returned by ``/ai/analyze-file``
+    to reuse the already uploaded file together with its extracted text and
+    AI-generated summary and tags.
+
+    Text extraction and missing summary/tags are left to a background job, its
+    id is returned as ``enrichment_job_id`` for ``/ai/jobs/{id}``.
+    """
     db = await get_database()
     
-    # Save uploaded file
-    file_path, file_type, file_size = await save_uploaded_file(file)
-    
     # Parse tags
     tag_list = [tag.strip() for tag in tags.split(',') if tag.strip()] if tags else []
     
+    if staging_id:
+        staged = await StagingArea.claim(db, staging_id, current_user.id)
+        if not staged:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Staged upload not found or expired, please upload the file again"
+            )
+        file_path, file_type, file_size = await promote_staged_file(staged)
+        file_hash = staged["content_hash"]
+        # Values typed in the form win over the generated ones
+        summary = summary or staged.get("summary")
+        tag_list = tag_list or staged.get("tags", [])
+    elif file:
+        # Save uploaded file
+        file_path, file_type, file_size, file_hash = await save_uploaded_file(file)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either a file or a staging_id is required"
+        )
+    
     # Create document
     document_data = {
         "title": title,
@@ -84,8 +151,11 @@ async def upload_document(
         "file_path": file_path,
         "file_type": file_type,
         "file_size": file_size,
+        "content_hash": file_hash,
+        "storage_tier": HOT_TIER,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
+        "last_accessed_at": datetime.utcnow(),
         "rating_sum": 0,
         "rating_count": 0,
         "average_rating": 0.0
@@ -94,6 +164,13 @@ async def upload_document(
     result = await db.documents.insert_one(document_data)
     created_document = await db.documents.find_one({"_id": result.inserted_id})
     
+    # Extraction and AI enrichment run in the worker, the upload returns right away
+    enrichment_job_id = None
+    if not (summary and tag_list) or not await TextStore.exists(db, file_hash):
+        enrichment_job_id = await JobQueue.enqueue(
+            db, ENRICH_DOCUMENT, {"document_id": str(result.inserted_id)}, owner_id=current_user.id
+        )
+    
     # Get owner information
     owner = await db.users.find_one({"_id": current_user.id})
     
@@ -111,7 +188,8 @@ async def upload_document(
         created_at=created_document["created_at"],
         updated_at=created_document["updated_at"],
         average_rating=created_document["average_rating"],
-        rating_count=created_document["rating_count"]
+        rating_count=created_document["rating_count"],
+        enrichment_job_id=enrichment_job_id
     )
 
 @router.get("/search", response_model=List[DocumentResponse])
@@ -152,12 +230,13 @@ async def search_documents(
     # Build search filters
     search_filters = []
     
-    # Text search in title and summary
+    # Text search in title, summary and extracted content
     if query:
         search_filters.append({
             "$or": [
                 {"title": {"$regex": query, "$options": "i"}},
-                {"summary": {"$regex": query, "$options": "i"}}
+                {"summary": {"$regex": query, "$options": "i"}},
+                {"content_hash": {"$in": await TextStore.find_matching_hashes(db, query)}}
             ]
         })
     
@@ -281,7 +360,8 @@ async def get_search_count(
         search_filters.append({
             "$or": [
                 {"title": {"$regex": query, "$options": "i"}},
-                {"summary": {"$regex": query, "$options": "i"}}
+                {"summary": {"$regex": query, "$options": "i"}},
+                {"content_hash": {"$in": await TextStore.find_matching_hashes(db, query)}}
             ]
         })
     
@@ -567,21 +647,93 @@ async def download_document(
         document["owner_id"] != current_user.id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     
-    if not document["file_path"] or not os.path.exists(document["file_path"]):
+    if not DocumentStorage.exists(document):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
     
+    await touch_document(db, document)
+    filename = f"{document['title']}.{document['file_path'].split('.')[-1]}"
+    
+    if DocumentStorage.get_tier(document) == COLD_TIER:
+        # Decompress while streaming instead of restoring the file to the hot tier
+        return StreamingResponse(
+            DocumentStorage.iter_content(document),
+            media_type='application/octet-stream',
+            headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
+        )
+    
     return FileResponse(
         path=document["file_path"],
-        filename=f"{document['title']}.{document['file_path'].split('.')[-1]}",
+        filename=filename,
         media_type='application/octet-stream'
     )
 
+def parse_page_range(page: Optional[int], page_range: Optional[str]) -> Optional[tuple[int, Optional[int]]]:
+    """Turn the page/page_range query parameters into (first, last); last None means to the end"""
+    if page is not None:
+        if page < 1:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page number")
+        return page, page
+    if page_range:
+        try:
+            first, _, last = page_range.partition('-')
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page_range format, use e.g. 3-7")
+        if first < 1 or (last is not None and last < first):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page_range")
+        return first, last
+    return None
+
+async def stream_document_pages(db, document: dict, file_extension: str, first: int, last: Optional[int]):
+    """Emit NDJSON lines, one per page, as soon as each page is available"""
+    stored = await TextStore.get_pages(db, document.get("content_hash"), first, last)
+    if stored is not None:
+        page_count, pages = stored
+        for number, text in pages:
+            yield json.dumps({"page": number, "text": text}, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "page_count": page_count}) + "\n"
+        return
+    
+    # Not in the text store yet: extract page by page, then keep the full result
+    collected, page_count = [], 0
+    try:
+        async with DocumentStorage.local_copy(document) as path:
+            async for number, blocks, page_count in AIService.iter_file_pages(path, file_extension, first, last):
+                collected.append((number, blocks))
+                yield json.dumps({"page": number, "text": page_blocks_text(blocks)}, ensure_ascii=False) + "\n"
+            if not collected:
+                # The range starts after the last page, the document itself is not empty
+                page_count = await AIService.count_file_pages(path, file_extension)
+    except ExtractionUnavailable as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+        return
+    except ExtractionError as e:
+        await TextStore.mark_extraction(db, document["_id"], e)
+        yield json.dumps({"error": str(e)}) + "\n"
+        return
+    
+    if first == 1 and last is None:
+        file_hash = await DocumentStorage.content_hash(document)
+        await TextStore.put(db, file_hash, build_document(file_extension, collected))
+        await db.documents.update_one({"_id": document["_id"]}, {"$set": {"content_hash": file_hash}})
+        await TextStore.mark_extraction(db, document["_id"])
+    
+    yield json.dumps({"done": True, "page_count": page_count}) + "\n"
+
 @router.get("/{document_id}/text")
 async def get_document_text(
     document_id: str,
+    page: Optional[int] = None,
+    page_range: Optional[str] = None,
+    stream: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Extract and return text content from document"""
+    """Extract and return text content from document.
+
+    ``page`` or ``page_range`` (e.g. ``3-7``, ``10-``) return only those pages.
+    ``stream=true`` returns NDJSON, one line per page as it becomes available.
+    """
     db = await get_database()
     
     if not ObjectId.is_valid(document_id):
@@ -596,31 +748,87 @@ async def get_document_text(
         document["owner_id"] != current_user.id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
     
-    if not document["file_path"] or not os.path.exists(document["file_path"]):
+    if not DocumentStorage.exists(document):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
     
+    await touch_document(db, document)
+    
+    if document.get("extraction_status") == EXTRACTION_FAILED:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Text extraction failed for this file: {document.get('extraction_error', 'unknown reason')}"
+        )
+    
+    file_extension = document["file_path"].split('.')[-1].lower()
+    extractable = file_extension in ["txt", "pdf", "doc", "docx"]
+    requested_pages = parse_page_range(page, page_range)
+    
+    if stream:
+        if not extractable:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Text extraction not supported for {file_extension.upper()} files.")
+        first, last = requested_pages or (1, None)
+        return StreamingResponse(
+            stream_document_pages(db, document, file_extension, first, last),
+            media_type="application/x-ndjson"
+        )
+    
+    if requested_pages:
+        first, last = requested_pages
+        stored = await TextStore.get_pages(db, document.get("content_hash"), first, last)
+        if stored is not None:
+            page_count, pages = stored
+        else:
+            async def extract_pages():
+                async with DocumentStorage.local_copy(document) as path:
+                    extracted = [
+                        (number, page_blocks_text(blocks), count)
+                        async for number, blocks, count in AIService.iter_file_pages(path, file_extension, first, last)
+                    ]
+                    # A range starting after the last page still reports the real page count
+                    count = extracted[0][2] if extracted else await AIService.count_file_pages(path, file_extension)
+                    return count, [(number, text) for number, text, _ in extracted]
+
+            try:
+                # Readers opening the same pages at once share one extraction
+                page_count, pages = await SingleFlight.run(
+                    "extract_pages", document.get("content_hash") or document_id,
+                    {"first": first, "last": last, "file_type": file_extension}, extract_pages
+                )
+            except ExtractionUnavailable as e:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+            except ExtractionError as e:
+                await TextStore.mark_extraction(db, document["_id"], e)
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Failed to extract text: {str(e)}")
+        return {
+            "pages": [{"page": number, "text": text} for number, text in pages],
+            "page_count": page_count,
+            "file_type": file_extension,
+            "extractable": extractable
+        }
+    
+    # Text is extracted once at upload and read back from the text store
+    stored_text = await TextStore.get(db, document.get("content_hash"))
+    if stored_text is not None:
+        return {
+            "text": stored_text,
+            "file_type": file_extension,
+            "extractable": extractable
+        }
+    
     try:
-        # Extract text based on file type
-        file_extension = document["file_path"].split('.')[-1].lower()
-        text_content = ""
-        
-        if file_extension == "txt":
-            # Read plain text files
-            async with aiofiles.open(document["file_path"], 'r', encoding='utf-8') as f:
-                text_content = await f.read()
-        elif file_extension == "pdf":
-            # Extract text from PDF using PyPDF2
-            import PyPDF2
-            with open(document["file_path"], 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                text_content = ""
-                for page in pdf_reader.pages:
-                    text_content += page.extract_text() + "\n"
-        elif file_extension in ["doc", "docx"]:
-            # Extract text from Word documents using python-docx
-            from docx import Document as DocxDocument
-            doc = DocxDocument(document["file_path"])
-            text_content = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        # Documents uploaded before the text store are extracted once and backfilled
+        if extractable:
+            async def extract_document():
+                async with DocumentStorage.local_copy(document) as path:
+                    structured = await AIService.extract_structured(path, file_extension)
+                file_hash = await DocumentStorage.content_hash(document)
+                await TextStore.put(db, file_hash, structured)
+                await db.documents.update_one({"_id": document["_id"]}, {"$set": {"content_hash": file_hash}})
+                await TextStore.mark_extraction(db, document["_id"])
+                return structured.text
+            
+            # Concurrent readers of the same document share one extraction
+            text_content = await SingleFlight.run("extract_document", document_id, None, extract_document)
         else:
             # For other file types, return a message
             text_content = f"Text extraction not supported for {file_extension.upper()} files."
@@ -628,15 +836,144 @@ async def get_document_text(
         return {
             "text": text_content,
             "file_type": file_extension,
-            "extractable": file_extension in ["txt", "pdf", "doc", "docx"]
+            "extractable": extractable
         }
         
+    except ExtractionUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except ExtractionError as e:
+        await TextStore.mark_extraction(db, document["_id"], e)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Failed to extract text: {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to extract text: {str(e)}"
         )
 
+@router.post("/{document_id}/versions")
+async def upload_document_version(
+    document_id: str,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Replace the file of a document with a new version.
+
+    Ratings are kept; summary and tags are refreshed from the sections that changed.
+    """
+    db = await get_database()
+    
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid document ID")
+    
+    document = await db.documents.find_one({"_id": ObjectId(document_id)})
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+    
+    # Check ownership
+    if document["owner_id"] != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only document owner can upload a new version")
+    
+    file_extension = file.filename.split('.')[-1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Supported types: {', '.join(ALLOWED_EXTENSIONS.keys())}"
+        )
+    
+    content = await file.read()
+    if len(content) > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File size exceeds maximum limit of {MAX_FILE_SIZE // (1024*1024)}MB"
+        )
+    
+    try:
+        result = await DocumentVersioning.add_version(
+            db, document, content, file_extension, ALLOWED_EXTENSIONS[file_extension], current_user.id
+        )
+    except VersionConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ExtractionUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except ExtractionError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Failed to extract text: {str(e)}")
+    return result
+
+@router.get("/{document_id}/versions")
+async def get_document_versions(
+    document_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """List the file versions of a document"""
+    db = await get_database()
+    
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid document ID")
+    
+    document = await db.documents.find_one({"_id": ObjectId(document_id)})
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+    
+    # Check permissions
+    if (document["visibility"] == VisibilityLevel.PRIVATE and 
+        document["owner_id"] != current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    
+    versions = await db.document_versions.find(
+        {"document_id": document["_id"]},
+        {"chunks": 0, "sections": 0}
+    ).sort("version", -1).to_list(length=None)
+    
+    return {
+        "current_version": document.get("current_version", 1),
+        "versions": [
+            {
+                "version": version["version"],
+                "file_extension": version["file_extension"],
+                "file_size": version["file_size"],
+                "new_chunk_count": version["new_chunk_count"],
+                "created_by": str(version["created_by"]),
+                "created_at": version["created_at"],
+            }
+            for version in versions
+        ]
+    }
+
+@router.get("/{document_id}/versions/{version}/download")
+async def download_document_version(
+    document_id: str,
+    version: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Download a specific version of a document, reassembled from its chunks"""
+    db = await get_database()
+    
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid document ID")
+    
+    document = await db.documents.find_one({"_id": ObjectId(document_id)})
+    if not document:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+    
+    # Check permissions
+    if (document["visibility"] == VisibilityLevel.PRIVATE and 
+        document["owner_id"] != current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    
+    version_record = await db.document_versions.find_one({"document_id": document["_id"], "version": version})
+    if not version_record:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Version not found")
+    
+    filename = f"{document['title']} (v{version}).{version_record['file_extension']}"
+    return StreamingResponse(
+        ChunkStore.iter_chunks(version_record["chunks"]),
+        media_type='application/octet-stream',
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"}
+    )
+
 @router.get("/{document_id}", response_model=DocumentResponse)
 async def get_document(
     document_id: str,
@@ -755,11 +1092,12 @@ async def delete_document(
     if document["owner_id"] != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only document owner can delete")
     
-    # Delete file
-    if document["file_path"] and os.path.exists(document["file_path"]):
-        os.remove(document["file_path"])
+    # Delete file from whichever tier holds it
+    DocumentStorage.remove(document)
     
     # Delete document from database
     await db.documents.delete_one({"_id": ObjectId(document_id)})
+    await TextStore.release(db, document.get("content_hash"))
+    await DocumentVersioning.delete_versions(db, ObjectId(document_id))
     
     return {"message": "Document deleted successfully"}
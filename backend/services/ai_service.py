@@ -1,126 +1,396 @@
-import openai
 import os
-from typing import List, Optional
-import PyPDF2
-import docx
-from PIL import Image
-import pytesseract
-import io
+import asyncio
+from typing import List, Optional, Tuple
 import re
+import hashlib
 from dotenv import load_dotenv
+
+from services.extraction import (
+    PARAGRAPH, StructuredDocument, build_document, extract_structured, extract_pages, count_pages
+)
+from services.extraction_pool import ExtractionPool, ExtractionError
+from services.ocr import OcrPipeline
+from services.llm_client import LLMClient, LLM_MODEL
+from services.llm_cache import LLMCache, make_key
+from services.llm_scheduler import use_lane, BACKGROUND
+from services.single_flight import SingleFlight
+from services.tag_classifier import TagClassifier, ALLOWED_TAGS, TAG_CONFIDENCE_THRESHOLD
 load_dotenv()
-# Configure OpenAI (you can also use other AI services)
-openai.api_key = os.getenv("API_KEY")
+
+# Bump when a prompt changes so cached responses of the old prompt are not reused
+SUMMARY_PROMPT_VERSION = "2"
+TAGS_PROMPT_VERSION = "1"
+# Shorter texts get no summary or tags at all
+SUMMARY_MIN_CHARS = 50
+TAGS_MIN_CHARS = 20
+
+# Map-reduce summarization: text above the chunk budget is summarized in chunks first
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+CHUNK_SUMMARY_WORDS = 150
+SUMMARY_MAX_LEVELS = 3
+# Rough estimate, Vietnamese text averages about 3 characters per token
+CHARS_PER_TOKEN = 3
+
+# Fire-and-forget tasks, referenced until they finish
+_background_tasks = set()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
 
 class AIService:
     @staticmethod
-    async def extract_text_from_file(file_path: str, file_type: str) -> str:
-        """Extract text content from uploaded files"""
+    async def extract_structured(file_path: str, file_type: str) -> StructuredDocument:
+        """Parse a file once into text with page and block offsets, in the extraction process pool.
+
+        Pool saturation and timeouts raise ``ExtractionError`` so callers do not
+        mistake them for a file without text. Images and the PDF pages that have
+        no text layer (scanned pages) go through the OCR pipeline.
+        """
         try:
+            if file_type == "image":
+                text = await OcrPipeline.ocr_image(file_path)
+                return build_document(file_type, [(1, [(PARAGRAPH, text)] if text else [])])
+
+            structured = await ExtractionPool.run(
+                extract_structured, file_path, file_type, profile=(file_type, os.path.getsize(file_path))
+            )
             if file_type == "pdf":
-                return AIService._extract_text_from_pdf(file_path)
-            elif file_type in ["doc", "docx"]:
-                return AIService._extract_text_from_docx(file_path)
-            elif file_type == "image":
-                return AIService._extract_text_from_image(file_path)
-            else:
-                return ""
+                structured = await AIService._ocr_empty_pages(file_path, structured)
+            return structured
+        except ExtractionError:
+            raise
         except Exception as e:
             print(f"Error extracting text from {file_path}: {e}")
-            return ""
+            return StructuredDocument(file_type=file_type, text="")
 
     @staticmethod
-    def _extract_text_from_pdf(file_path: str) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-        except Exception as e:
-            print(f"Error reading PDF: {e}")
-        return text.strip()
+    async def _ocr_empty_pages(file_path: str, structured: StructuredDocument) -> StructuredDocument:
+        """Fill PDF pages without a text layer with their OCR text"""
+        empty_pages = [page.number for page in structured.pages if not page.blocks]
+        if not empty_pages:
+            return structured
+
+        ocr_texts = await OcrPipeline.ocr_pdf_pages(file_path, empty_pages)
+        if not any(ocr_texts.values()):
+            return structured
+        pages = [
+            (number, [(PARAGRAPH, ocr_texts[number])] if ocr_texts.get(number) else blocks)
+            for number, blocks in structured.page_blocks()
+        ]
+        return build_document(structured.file_type, pages)
 
     @staticmethod
-    def _extract_text_from_docx(file_path: str) -> str:
-        """Extract text from DOCX file"""
-        try:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text.strip()
-        except Exception as e:
-            print(f"Error reading DOCX: {e}")
-            return ""
+    async def extract_text_from_file(file_path: str, file_type: str) -> str:
+        """Extract text content from uploaded files"""
+        structured = await AIService.extract_structured(file_path, file_type)
+        return structured.text
 
     @staticmethod
-    def _extract_text_from_image(file_path: str) -> str:
-        """Extract text from image using OCR"""
+    async def iter_file_pages(file_path: str, file_type: str, first: int = 1, last: Optional[int] = None,
+                              batch_pages: int = 4):
+        """Yield (page_number, blocks, page_count) as pages are extracted.
+
+        PDF pages are extracted in small batches with the next batch already
+        running while the current one is consumed, so the first page arrives
+        after one batch no matter how long the document is.
+        """
+        if file_type != "pdf":
+            pages = await ExtractionPool.run(extract_pages, file_path, file_type, None)
+            for number, blocks in pages:
+                if number >= first and (last is None or number <= last):
+                    yield number, blocks, len(pages)
+            return
+
+        page_count = await AIService.count_file_pages(file_path, file_type)
+        last = min(last or page_count, page_count)
+        batches = [list(range(start, min(start + batch_pages, last + 1))) for start in range(first, last + 1, batch_pages)]
+        if not batches:
+            return
+
+        pending = asyncio.ensure_future(ExtractionPool.run(extract_pages, file_path, file_type, batches[0]))
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
-            return text.strip()
-        except Exception as e:
-            print(f"Error performing OCR: {e}")
-            return ""
+            for index in range(len(batches)):
+                pages = await pending
+                if index + 1 < len(batches):
+                    pending = asyncio.ensure_future(ExtractionPool.run(extract_pages, file_path, file_type, batches[index + 1]))
+                empty_pages = [number for number, blocks in pages if not blocks]
+                ocr_texts = await OcrPipeline.ocr_pdf_pages(file_path, empty_pages) if empty_pages else {}
+                for number, blocks in pages:
+                    if ocr_texts.get(number):
+                        blocks = [(PARAGRAPH, ocr_texts[number])]
+                    yield number, blocks, page_count
+        finally:
+            # The consumer may stop early, the batch extracted ahead for it is not needed then
+            if not pending.done():
+                pending.cancel()
+            elif not pending.cancelled():
+                pending.exception()
 
     @staticmethod
-    async def generate_summary(text: str, max_words: int = 500) -> str:
-        """Generate AI summary of the document content"""
-        if not text or len(text.strip()) < 50:
-            return ""
+    async def count_file_pages(file_path: str, file_type: str) -> int:
+        """Number of pages of a file, counted in the extraction pool"""
+        return await ExtractionPool.run(count_pages, file_path, file_type)
 
-        try:
-            # Clean and truncate text if too long
-            cleaned_text = re.sub(r'\s+', ' ', text.strip())
-            if len(cleaned_text) > 4000:  # Limit input to avoid token limits
-                cleaned_text = cleaned_text[:4000] + "..."
+    @staticmethod
+    def sections_from_structured(structured: StructuredDocument) -> List[str]:
+        """Split a parsed document into sections: pages for PDF, paragraph groups otherwise"""
+        if structured.file_type == "pdf":
+            return [structured.page_text(page.number).strip() for page in structured.pages]
+        return AIService._group_paragraphs(structured.block_texts())
 
-            prompt = (
-            f"Tóm tắt văn bản sau thành khoảng 500 từ. "
-            "Yêu cầu: viết rõ ràng, dễ hiểu, bằng tiếng Việt, và trình bày dưới dạng markdown "
+    @staticmethod
+    def _group_paragraphs(paragraphs: List[str], target_chars: int = 3000) -> List[str]:
+        """Group paragraphs into sections with content-defined boundaries.
+
+        A section ends after a paragraph whose hash hits the boundary condition
+        (or when it grows too large), so inserting text in one place does not
+        shift the boundaries of every following section.
+        """
+        sections, current, size = [], [], 0
+        for paragraph in paragraphs:
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            current.append(paragraph)
+            size += len(paragraph)
+            digest = hashlib.sha1(paragraph.encode('utf-8')).digest()
+            if (size >= target_chars // 4 and digest[0] % 8 == 0) or size >= target_chars * 2:
+                sections.append("\n".join(current))
+                current, size = [], 0
+        if current:
+            sections.append("\n".join(current))
+        return sections
+
+    @staticmethod
+    def split_into_chunks(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[str]:
+        """Pack the text's blocks into chunks of at most ``max_tokens`` (estimated).
+
+        Blocks are kept whole where possible; a block larger than a chunk is
+        cut on sentence boundaries, and as a last resort on the character budget.
+        """
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        pieces = []
+        for block in text.split("\n"):
+            block = block.strip()
+            if not block:
+                continue
+            if len(block) <= max_chars:
+                pieces.append(block)
+                continue
+            sentence_run = ""
+            for sentence in re.split(r'(?<=[.!?])\s+', block):
+                while len(sentence) > max_chars:
+                    pieces.append(sentence[:max_chars])
+                    sentence = sentence[max_chars:]
+                if sentence_run and len(sentence_run) + len(sentence) + 1 > max_chars:
+                    pieces.append(sentence_run)
+                    sentence_run = ""
+                sentence_run = f"{sentence_run} {sentence}".strip()
+            if sentence_run:
+                pieces.append(sentence_run)
+
+        chunks, current, size = [], [], 0
+        for piece in pieces:
+            if current and size + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+
+    @staticmethod
+    def _summary_request(text: str, max_words: int, template: str) -> Tuple[str, List[dict], int]:
+        """Cache key, messages and token limit of a summarization call; ``template`` picks the prompt"""
+        max_tokens = max_words * 2 + 100
+        cache_key = make_key(LLM_MODEL, template, SUMMARY_PROMPT_VERSION,
+                             {"max_tokens": max_tokens, "temperature": 0.3, "max_words": max_words}, text)
+
+        if template == "summary_reduce":
+            instruction = (
+                f"Dưới đây là bản tóm tắt từng phần của một tài liệu dài, theo đúng thứ tự. "
+                f"Hãy tổng hợp chúng thành một bản tóm tắt chung khoảng {max_words} từ. "
+            )
+        elif template == "summary_chunk":
+            instruction = (
+                f"Đây là một phần của một tài liệu dài. Tóm tắt các ý chính của phần này trong khoảng {max_words} từ, "
+                "giữ lại số liệu, tên riêng và kết luận quan trọng. "
+            )
+        else:
+            instruction = f"Tóm tắt văn bản sau thành khoảng {max_words} từ. "
+        prompt = (
+            instruction
+            + "Yêu cầu: viết rõ ràng, dễ hiểu, bằng tiếng Việt, và trình bày dưới dạng markdown "
             "(sử dụng tiêu đề, gạch đầu dòng nếu phù hợp).\n\n"
             f"Văn bản:\n{text}"
         )
+        messages = [
+            {"role": "system", "content": "Bạn là một trợ lý AI hữu ích, chuyên tóm tắt văn bản."},
+            {"role": "user", "content": prompt},
+        ]
+        return cache_key, messages, max_tokens
 
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                {"role": "system", "content": "Bạn là một trợ lý AI hữu ích, chuyên tóm tắt văn bản."},
-                {"role": "user", "content": prompt},
-            ],
-                max_tokens=600,
-                temperature=0.3
-            )
+    @staticmethod
+    def _limit_words(summary: str, max_words: int) -> str:
+        words = summary.split()
+        if len(words) > max_words:
+            summary = ' '.join(words[:max_words]) + "..."
+        return summary
+
+    @staticmethod
+    async def _summarize(text: str, max_words: int, template: str) -> str:
+        """One cached summarization call, shared by concurrent identical requests"""
+        cache_key, messages, max_tokens = AIService._summary_request(text, max_words, template)
+
+        async def summarize():
+            cached = await LLMCache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            summary = await LLMClient.chat(messages=messages, max_tokens=max_tokens, temperature=0.3)
 
-            summary = response.choices[0].message.content.strip()
-            
             # Ensure summary doesn't exceed word limit
-            words = summary.split()
-            if len(words) > max_words:
-                summary = ' '.join(words[:max_words]) + "..."
+            summary = AIService._limit_words(summary, max_words)
 
+            if summary:
+                await LLMCache.put(cache_key, summary, template)
             return summary
 
+        return await SingleFlight.run(template, cache_key, None, summarize)
+
+    @staticmethod
+    async def generate_summary(text: str, max_words: int = 500) -> str:
+        """Generate AI summary of the document content.
+
+        Text over the chunk budget is summarized map-reduce style: the chunks
+        are summarized in parallel (bounded by the LLM client's concurrency
+        limit), then the chunk summaries are combined, repeatedly if they are
+        still too long. Chunk summaries do not depend on ``max_words`` and are
+        cached, so asking for another length only redoes the final step.
+        """
+        if not text or len(text.strip()) < SUMMARY_MIN_CHARS:
+            return ""
+
+        try:
+            level = 0
+            while estimate_tokens(text) > SUMMARY_CHUNK_TOKENS and level < SUMMARY_MAX_LEVELS:
+                chunks = AIService.split_into_chunks(text)
+                partials = await asyncio.gather(*[
+                    AIService._summarize(chunk, CHUNK_SUMMARY_WORDS, "summary_chunk") for chunk in chunks
+                ])
+                text = "\n\n".join(partial for partial in partials if partial)
+                level += 1
+
+            return await AIService._summarize(text, max_words, "summary_reduce" if level else "summary")
+
         except Exception as e:
             print(f"Error generating summary: {e}")
             return ""
 
+    @staticmethod
+    async def stream_summary(text: str, max_words: int = 500):
+        """Summarize like ``generate_summary``, yielding (event, data) pairs on the way.
+
+        ``progress`` events report the chunks of long text as they are
+        condensed, ``token`` events carry the final summary as the LLM
+        generates it, and the last ``summary`` event has the complete summary,
+        which is cached like a non-streamed one. Errors are raised.
+        """
+        if not text or len(text.strip()) < SUMMARY_MIN_CHARS:
+            yield "summary", {"summary": "", "cached": False}
+            return
+
+        level = 0
+        while estimate_tokens(text) > SUMMARY_CHUNK_TOKENS and level < SUMMARY_MAX_LEVELS:
+            chunks = AIService.split_into_chunks(text)
+            tasks = [
+                asyncio.ensure_future(AIService._summarize(chunk, CHUNK_SUMMARY_WORDS, "summary_chunk"))
+                for chunk in chunks
+            ]
+            try:
+                for done, finished in enumerate(asyncio.as_completed(tasks), 1):
+                    await finished
+                    yield "progress", {"stage": "summarizing_chunks", "level": level + 1, "done": done, "total": len(tasks)}
+            finally:
+                for task in tasks:
+                    task.cancel()
+            text = "\n\n".join(task.result() for task in tasks if task.result())
+            level += 1
+
+        template = "summary_reduce" if level else "summary"
+        cache_key, messages, max_tokens = AIService._summary_request(text, max_words, template)
+        cached = await LLMCache.get(cache_key)
+        if cached is not None:
+            yield "token", {"text": cached}
+            yield "summary", {"summary": cached, "cached": True}
+            return
+
+        yield "progress", {"stage": "generating"}
+        pieces = []
+        async for piece in LLMClient.chat_stream(messages=messages, max_tokens=max_tokens, temperature=0.3):
+            pieces.append(piece)
+            yield "token", {"text": piece}
+
+        summary = AIService._limit_words("".join(pieces).strip(), max_words)
+        if summary:
+            await LLMCache.put(cache_key, summary, template)
+        yield "summary", {"summary": summary, "cached": False}
+
     @staticmethod
     async def generate_tags(text: str, title: str = "") -> List[str]:
-        """Generate relevant tags for the document"""
-        if not text or len(text.strip()) < 20:
+        """Generate relevant tags for the document.
+
+        The local classifier answers when it is confident enough; otherwise,
+        or when no model has been trained yet, the LLM picks the tags.
+        """
+        if not text or len(text.strip()) < TAGS_MIN_CHARS:
             return []
 
+        classified = TagClassifier.classify(text)
+        predicted = [tag.lower() for tag in classified[0]] if classified else None
+        if classified and classified[1] >= TAG_CONFIDENCE_THRESHOLD:
+            TagClassifier.record(used_classifier=True)
+            if TagClassifier.should_shadow_check():
+                task = asyncio.create_task(AIService._shadow_check_tags(text, predicted))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            return predicted
+
+        tags = await AIService._generate_tags_llm(text)
+        TagClassifier.record(used_classifier=False, predicted=predicted, llm_tags=tags if tags else None)
+        return tags
+
+    @staticmethod
+    async def _shadow_check_tags(text: str, predicted: List[str]):
+        """Ask the LLM about a confident prediction too, to measure agreement"""
+        with use_lane(BACKGROUND):
+            tags = await AIService._generate_tags_llm(text)
+        if tags:
+            TagClassifier.record(used_classifier=True, predicted=predicted, llm_tags=tags, shadow=True)
+
+    @staticmethod
+    async def _generate_tags_llm(text: str) -> List[str]:
+        cache_key = make_key(LLM_MODEL, "tags", TAGS_PROMPT_VERSION,
+                             {"max_tokens": 100, "temperature": 0.3, "tags": ALLOWED_TAGS}, text)
+        # Concurrent identical requests share one LLM call
+        return await SingleFlight.run("tags", cache_key, None, lambda: AIService._request_tags(text, cache_key))
+
+    @staticmethod
+    async def _request_tags(text: str, cache_key: str) -> List[str]:
+        list_tags = ALLOWED_TAGS
+        cached = await LLMCache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             # Clean and truncate text
             cleaned_text = re.sub(r'\s+', ' ', text.strip())
             if len(cleaned_text) > 3000:
                 cleaned_text = cleaned_text[:3000] + "..."
 
-            list_tags = ["ATM", "dịch vụ khách hàng", "sự cố", "tín dụng", "doanh nghiệp", "quy định","onboarding", "IT", "quy trình", "core banking"]
             prompt = (
             "Bạn là một hệ thống phân loại văn bản.\n\n"
             f"Danh sách tag cho phép: {', '.join(list_tags)}\n\n"
@@ -129,8 +399,7 @@ class AIService:
             f"Văn bản:\n{text}"
         )
 
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+            tags_text = await LLMClient.chat(
                 messages=[
                 {"role": "system", "content": "Bạn là một trợ lý AI chuyên phân loại văn bản."},
                 {"role": "user", "content": prompt},
@@ -138,8 +407,6 @@ class AIService:
                 max_tokens=100,
                 temperature=0.3
             )
-
-            tags_text = response.choices[0].message.content.strip()
             
             # Parse and clean tags
             tags = [tag.strip().lower() for tag in tags_text.split(',') if tag.strip()]
@@ -152,6 +419,8 @@ class AIService:
                 if len(unique_tags) >= 8:
                     break
 
+            if unique_tags:
+                await LLMCache.put(cache_key, unique_tags, "tags")
             return unique_tags
 
         except Exception as e:
@@ -159,16 +428,19 @@ class AIService:
             return []
 
     @staticmethod
-    async def enhance_document_metadata(file_path: str, file_type: str, title: str) -> dict:
-        """Extract text and generate both summary and tags"""
-        text = await AIService.extract_text_from_file(file_path, file_type)
+    async def enhance_document_metadata(file_path: str, file_type: str, title: str, text: Optional[str] = None) -> dict:
+        """Extract text (unless already extracted) and generate both summary and tags"""
+        if text is None:
+            text = await AIService.extract_text_from_file(file_path, file_type)
         
         if not text:
             return {"summary": "", "tags": [], "extracted_text": ""}
 
         # Generate summary and tags concurrently
-        summary = await AIService.generate_summary(text)
-        tags = await AIService.generate_tags(text, title)
+        summary, tags = await asyncio.gather(
+            AIService.generate_summary(text),
+            AIService.generate_tags(text, title)
+        )
 
         return {
             "summary": summary,
@@ -0,0 +1,296 @@
+"""
+Corpus backfills: bring every document up to the current pipeline version of
+one stage after the extractor, the summary prompt or the tag list changed.
+
+Each stage has a target version, recorded per document under
+``pipeline_versions`` when the stage runs. A backfill run walks ``documents``
+in ``_id`` order and enqueues a ``backfill_document`` job for each document
+that is not at the target version yet; the workers do the actual work. The
+run is stored in ``backfill_runs`` and checkpoints the last enqueued ``_id``
+after every batch, so a paused or interrupted run resumes where it stopped.
+The number of jobs a run keeps in the queue is bounded, which throttles it to
+the speed of the workers, and an optional rate limit slows it down further.
+
+Summaries and tags the uploader wrote themselves carry no pipeline version
+and are left alone unless the run overwrites them. Documents enriched before
+pipeline versions were recorded look the same; run with ``overwrite`` once to
+bring them in.
+"""
+
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from services.ai_service import SUMMARY_PROMPT_VERSION, TAGS_PROMPT_VERSION
+from services.job_queue import JobQueue, BACKFILL_DOCUMENT, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_DEAD
+from services.tag_classifier import ALLOWED_TAGS
+from services.text_store import TEXT_PIPELINE_VERSION, TEXT_INDEX_VERSION
+
+EXTRACT = "extract"
+SUMMARY = "summary"
+TAGS = "tags"
+INDEX = "index"
+BACKFILL_TASKS = [EXTRACT, SUMMARY, TAGS, INDEX]
+
+RUN_RUNNING = "running"
+RUN_PAUSED = "paused"
+RUN_DONE = "done"
+
+# A running run whose runner has not checkpointed for this long is considered abandoned and may be resumed
+RUN_STALE_SECONDS = 120
+# How often a runner waiting for its jobs to drain checks the queue and the run status
+RUN_POLL_SECONDS = 5
+# Window of finished jobs the processing rate and the ETA are computed from
+RATE_WINDOW_MINUTES = 10
+
+
+def target_version(task: str) -> str:
+    """The version a document is at once the stage has run with the current code and settings"""
+    if task == EXTRACT:
+        return TEXT_PIPELINE_VERSION
+    if task == SUMMARY:
+        return SUMMARY_PROMPT_VERSION
+    if task == TAGS:
+        # The tag list is part of the prompt, changing it makes older tags outdated
+        tags_hash = hashlib.sha256(json.dumps(ALLOWED_TAGS, ensure_ascii=False).encode("utf-8")).hexdigest()[:8]
+        return f"{TAGS_PROMPT_VERSION}.{tags_hash}"
+    if task == INDEX:
+        return TEXT_INDEX_VERSION
+    raise ValueError(f"Unknown backfill task: {task}")
+
+
+def version_update(*tasks: str) -> dict:
+    """``$set`` fields recording that the given stages ran with the current versions"""
+    return {f"pipeline_versions.{task}": target_version(task) for task in tasks}
+
+
+def pending_query(task: str, overwrite: bool = False, after_id=None) -> dict:
+    """Documents a run of ``task`` still has to process, after ``after_id`` if given"""
+    field = f"pipeline_versions.{task}"
+    query = {field: {"$ne": target_version(task)}}
+    if task in (SUMMARY, TAGS) and not overwrite:
+        # Empty values are filled in; values without a version were written by the uploader
+        empty = {"summary": {"$in": [None, ""]}} if task == SUMMARY else {"tags": {"$in": [None, []]}}
+        query["$or"] = [empty, {field: {"$exists": True}}]
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+    return query
+
+
+class BackfillRunner:
+    @staticmethod
+    async def create(db, task: str, batch_size: int = 50, max_in_flight: int = 100,
+                     rate_per_minute: float = 0, overwrite: bool = False) -> dict:
+        if task not in BACKFILL_TASKS:
+            raise ValueError(f"Unknown backfill task: {task}")
+        now = datetime.utcnow()
+        run = {
+            "task": task,
+            "target_version": target_version(task),
+            "status": RUN_PAUSED,
+            "batch_size": batch_size,
+            "max_in_flight": max_in_flight,
+            "rate_per_minute": rate_per_minute,
+            "overwrite": overwrite,
+            "last_id": None,
+            "enqueued": 0,
+            "total": await db.documents.count_documents(pending_query(task, overwrite)),
+            "heartbeat_at": None,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+        }
+        result = await db.backfill_runs.insert_one(run)
+        run["_id"] = result.inserted_id
+        return run
+
+    @staticmethod
+    async def get(db, run_id: str) -> Optional[dict]:
+        if not ObjectId.is_valid(run_id):
+            return None
+        return await db.backfill_runs.find_one({"_id": ObjectId(run_id)})
+
+    @staticmethod
+    async def latest(db) -> Optional[dict]:
+        return await db.backfill_runs.find_one({}, sort=[("_id", -1)])
+
+    @staticmethod
+    async def dry_run(db, task: str, overwrite: bool = False, sample_size: int = 10) -> dict:
+        """What a run would do, without enqueuing anything"""
+        query = pending_query(task, overwrite)
+        by_version = {}
+        async for row in db.documents.aggregate([
+            {"$match": query},
+            {"$group": {"_id": f"$pipeline_versions.{task}", "count": {"$sum": 1}}},
+        ]):
+            by_version[row["_id"] or "none"] = row["count"]
+        sample = await db.documents.find(query, {"title": 1}).sort("_id", 1).limit(sample_size).to_list(length=sample_size)
+        return {
+            "task": task,
+            "target_version": target_version(task),
+            "overwrite": overwrite,
+            "pending": sum(by_version.values()),
+            "pending_by_version": by_version,
+            "total_documents": await db.documents.count_documents({}),
+            "sample": [{"id": str(document["_id"]), "title": document.get("title")} for document in sample],
+        }
+
+    @staticmethod
+    async def claim(db, run_id) -> Optional[dict]:
+        """Mark a paused or abandoned run as running. Returns None if another runner has it."""
+        now = datetime.utcnow()
+        return await db.backfill_runs.find_one_and_update(
+            {
+                "_id": run_id,
+                "$or": [
+                    {"status": RUN_PAUSED},
+                    {"status": RUN_RUNNING, "heartbeat_at": {"$lt": now - timedelta(seconds=RUN_STALE_SECONDS)}},
+                ]
+            },
+            {"$set": {"status": RUN_RUNNING, "heartbeat_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    async def pause(db, run_id) -> Optional[dict]:
+        """Stop a run after its current batch and take its not yet started jobs off the queue.
+
+        The checkpoint moves back before the first document whose job was
+        removed, so resuming enqueues those documents again.
+        """
+        run = await db.backfill_runs.find_one_and_update(
+            {"_id": run_id, "status": RUN_RUNNING},
+            {"$set": {"status": RUN_PAUSED, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if run is None:
+            return None
+
+        queued = {"type": BACKFILL_DOCUMENT, "payload.run_id": str(run_id), "status": JOB_QUEUED}
+        document_ids = [ObjectId(job["payload"]["document_id"]) async for job in db.jobs.find(queued, {"payload": 1})]
+        if document_ids:
+            removed = await db.jobs.delete_many(
+                {**queued, "payload.document_id": {"$in": [str(i) for i in document_ids]}}
+            )
+            previous = await db.documents.find_one(
+                {"_id": {"$lt": min(document_ids)}}, {"_id": 1}, sort=[("_id", -1)]
+            )
+            run = await db.backfill_runs.find_one_and_update(
+                {"_id": run_id},
+                {
+                    "$set": {"last_id": previous["_id"] if previous else None},
+                    "$inc": {"enqueued": -removed.deleted_count},
+                },
+                return_document=ReturnDocument.AFTER
+            )
+        return run
+
+    @staticmethod
+    async def job_counts(db, run_id) -> dict:
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_DEAD: 0}
+        async for row in db.jobs.aggregate([
+            {"$match": {"type": BACKFILL_DOCUMENT, "payload.run_id": str(run_id)}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+    @staticmethod
+    async def progress(db, run: dict) -> dict:
+        """Where a run stands: jobs per status, documents left, processing rate and ETA"""
+        counts = await BackfillRunner.job_counts(db, run["_id"])
+        not_enqueued = 0
+        if run["status"] != RUN_DONE:
+            not_enqueued = await db.documents.count_documents(
+                pending_query(run["task"], run["overwrite"], run["last_id"])
+            )
+        since = datetime.utcnow() - timedelta(minutes=RATE_WINDOW_MINUTES)
+        recent = await db.jobs.count_documents({
+            "type": BACKFILL_DOCUMENT, "payload.run_id": str(run["_id"]),
+            "status": {"$in": [JOB_DONE, JOB_DEAD]}, "finished_at": {"$gte": since},
+        })
+        rate = recent / RATE_WINDOW_MINUTES
+        remaining = not_enqueued + counts[JOB_QUEUED] + counts[JOB_RUNNING]
+        return {
+            "run_id": str(run["_id"]),
+            "task": run["task"],
+            "target_version": run["target_version"],
+            "status": run["status"],
+            "total": run["total"],
+            "enqueued": run["enqueued"],
+            "jobs": counts,
+            "remaining": remaining,
+            "documents_per_minute": round(rate, 1),
+            "eta_minutes": round(remaining / rate, 1) if rate else None,
+            "last_id": str(run["last_id"]) if run["last_id"] else None,
+        }
+
+    @staticmethod
+    async def _checkpoint(db, run_id, **fields) -> Optional[dict]:
+        """Save progress and return the run, or None when it was paused in the meantime"""
+        now = datetime.utcnow()
+        update = {"$set": {"heartbeat_at": now, "updated_at": now}}
+        enqueued = fields.pop("enqueued", 0)
+        update["$set"].update(fields)
+        if enqueued:
+            update["$inc"] = {"enqueued": enqueued}
+        return await db.backfill_runs.find_one_and_update(
+            {"_id": run_id, "status": RUN_RUNNING}, update, return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    async def run(db, run: dict, stopping: Optional[asyncio.Event] = None) -> dict:
+        """Enqueue the run's remaining documents batch by batch until done, paused or stopped.
+
+        The run must have been claimed. Returns the run as last saved.
+        """
+        run_id = run["_id"]
+        stopping = stopping or asyncio.Event()
+        while not stopping.is_set():
+            # Throttle to the workers: wait until the run's jobs in the queue drop below the bound
+            while True:
+                counts = await BackfillRunner.job_counts(db, run_id)
+                in_flight = counts[JOB_QUEUED] + counts[JOB_RUNNING]
+                if in_flight + run["batch_size"] <= max(run["max_in_flight"], run["batch_size"]):
+                    break
+                run = await BackfillRunner._checkpoint(db, run_id)
+                if run is None or stopping.is_set():
+                    return await db.backfill_runs.find_one({"_id": run_id})
+                await asyncio.sleep(RUN_POLL_SECONDS)
+
+            batch = await db.documents.find(
+                pending_query(run["task"], run["overwrite"], run["last_id"]), {"_id": 1}
+            ).sort("_id", 1).limit(run["batch_size"]).to_list(length=run["batch_size"])
+            if not batch:
+                now = datetime.utcnow()
+                await db.backfill_runs.update_one(
+                    {"_id": run_id, "status": RUN_RUNNING},
+                    {"$set": {"status": RUN_DONE, "finished_at": now, "updated_at": now}}
+                )
+                print(f"Backfill {run_id} ({run['task']}): every document enqueued")
+                return await db.backfill_runs.find_one({"_id": run_id})
+
+            for document in batch:
+                await JobQueue.enqueue(db, BACKFILL_DOCUMENT, {
+                    "document_id": str(document["_id"]),
+                    "task": run["task"],
+                    "run_id": str(run_id),
+                    "overwrite": run["overwrite"],
+                })
+            run = await BackfillRunner._checkpoint(db, run_id, last_id=batch[-1]["_id"], enqueued=len(batch))
+            if run is None:
+                break
+            print(f"Backfill {run_id} ({run['task']}): {run['enqueued']}/{run['total']} documents enqueued")
+
+            if run["rate_per_minute"]:
+                try:
+                    await asyncio.wait_for(stopping.wait(), len(batch) * 60 / run["rate_per_minute"])
+                except asyncio.TimeoutError:
+                    pass
+
+        return await db.backfill_runs.find_one({"_id": run_id})
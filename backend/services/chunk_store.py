@@ -0,0 +1,158 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+import zstandard
+from pymongo import ReturnDocument
+
+CHUNK_STORAGE_DIR = os.getenv("CHUNK_STORAGE_DIR", os.path.join("uploads", "chunks"))
+
+# A chunk file being deleted is marked on its record; writers wait for the
+# deletion to finish, or take over once the mark is this old
+CHUNK_DELETE_STALE_SECONDS = 60
+CHUNK_DELETE_POLL_SECONDS = 0.1
+
+# Content-defined chunking parameters (FastCDC style normalized chunking)
+MIN_CHUNK_SIZE = 2 * 1024
+AVG_CHUNK_SIZE = 8 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+
+# Stricter mask before the average size, looser after it, keeps chunk sizes close to the average
+_MASK_SMALL = (1 << 15) - 1
+_MASK_LARGE = (1 << 11) - 1
+_HASH_MASK = (1 << 64) - 1
+
+# Fixed seed so chunk boundaries are identical across processes and restarts
+_GEAR = [random.Random(0x6B6D73 + i).getrandbits(64) for i in range(256)]
+
+
+def _find_boundary(data: bytes, start: int, end: int) -> int:
+    """Return the end offset of the chunk starting at ``start``"""
+    length = end - start
+    if length <= MIN_CHUNK_SIZE:
+        return end
+
+    normal = start + min(AVG_CHUNK_SIZE, length)
+    limit = start + min(MAX_CHUNK_SIZE, length)
+    gear = _GEAR
+    h = 0
+    i = start + MIN_CHUNK_SIZE
+
+    while i < normal:
+        h = ((h << 1) + gear[data[i]]) & _HASH_MASK
+        if not h & _MASK_SMALL:
+            return i + 1
+        i += 1
+    while i < limit:
+        h = ((h << 1) + gear[data[i]]) & _HASH_MASK
+        if not h & _MASK_LARGE:
+            return i + 1
+        i += 1
+    return limit
+
+
+class ChunkStore:
+    @staticmethod
+    def split(data: bytes) -> List[Tuple[str, bytes]]:
+        """Split data into content-defined chunks and return (sha256, bytes) pairs.
+
+        Boundaries depend on the content only, so an edit in one region of a
+        file leaves the chunks of the other regions unchanged.
+        """
+        chunks = []
+        start = 0
+        while start < len(data):
+            end = _find_boundary(data, start, len(data))
+            piece = data[start:end]
+            chunks.append((hashlib.sha256(piece).hexdigest(), piece))
+            start = end
+        return chunks
+
+    @staticmethod
+    def chunk_path(chunk_hash: str) -> str:
+        return os.path.join(CHUNK_STORAGE_DIR, chunk_hash[:2], chunk_hash)
+
+    @staticmethod
+    def write_chunks(chunks: List[Tuple[str, bytes]]) -> List[str]:
+        """Write chunks that are not stored yet. Returns the hashes that were new.
+
+        Call it only after ``add_references``, a referenced chunk is never deleted.
+        """
+        compressor = zstandard.ZstdCompressor()
+        written = []
+        for chunk_hash, piece in chunks:
+            path = ChunkStore.chunk_path(chunk_hash)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique per writer, two versions may store the same new chunk at once
+            part_path = f"{path}.{uuid.uuid4().hex}.part"
+            with open(part_path, "wb") as f:
+                f.write(compressor.compress(piece))
+            os.replace(part_path, path)
+            written.append(chunk_hash)
+        return written
+
+    @staticmethod
+    def iter_chunks(chunk_hashes: List[str]) -> Iterator[bytes]:
+        """Yield the bytes of a stored version chunk by chunk"""
+        decompressor = zstandard.ZstdDecompressor()
+        for chunk_hash in chunk_hashes:
+            with open(ChunkStore.chunk_path(chunk_hash), "rb") as f:
+                yield decompressor.decompress(f.read())
+
+    @staticmethod
+    async def add_references(db, chunks: List[Tuple[str, bytes]]):
+        """Count one more version referencing each chunk.
+
+        Returns once no deletion of these chunks is in progress, so files
+        checked by ``write_chunks`` afterwards stay in place.
+        """
+        for chunk_hash, piece in chunks:
+            chunk = await db.chunks.find_one_and_update(
+                {"_id": chunk_hash},
+                {"$inc": {"ref_count": 1}, "$setOnInsert": {"size": len(piece)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            while chunk and chunk.get("deleting_at"):
+                if chunk["deleting_at"] < datetime.utcnow() - timedelta(seconds=CHUNK_DELETE_STALE_SECONDS):
+                    # The deleting process died, its file may or may not be gone
+                    await db.chunks.update_one({"_id": chunk_hash}, {"$unset": {"deleting_at": ""}})
+                    break
+                await asyncio.sleep(CHUNK_DELETE_POLL_SECONDS)
+                chunk = await db.chunks.find_one({"_id": chunk_hash}, {"deleting_at": 1})
+
+    @staticmethod
+    async def release_references(db, chunk_hashes: List[str]):
+        """Drop one reference per chunk and delete chunks no version uses anymore.
+
+        The file is removed only while the record is marked as deleting with
+        no references; a version adding the chunk meanwhile waits for the mark
+        to go and then writes the file again.
+        """
+        for chunk_hash in chunk_hashes:
+            chunk = await db.chunks.find_one_and_update(
+                {"_id": chunk_hash},
+                {"$inc": {"ref_count": -1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if not chunk or chunk["ref_count"] > 0:
+                continue
+            claimed = await db.chunks.find_one_and_update(
+                {"_id": chunk_hash, "ref_count": {"$lte": 0}, "deleting_at": {"$exists": False}},
+                {"$set": {"deleting_at": datetime.utcnow()}}
+            )
+            if not claimed:
+                continue
+            path = ChunkStore.chunk_path(chunk_hash)
+            if os.path.exists(path):
+                await asyncio.to_thread(os.remove, path)
+            result = await db.chunks.delete_one({"_id": chunk_hash, "ref_count": {"$lte": 0}})
+            if not result.deleted_count:
+                # Referenced again while the file was removed, the new version rewrites it
+                await db.chunks.update_one({"_id": chunk_hash}, {"$unset": {"deleting_at": ""}})
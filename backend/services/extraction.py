@@ -0,0 +1,228 @@
+"""
+Structured text extraction shared by the backend and the llm service.
+
+Each file is parsed once into a ``StructuredDocument``: the full text plus
+the character offsets of its pages and blocks (paragraphs and tables).
+Consumers slice ``text`` with those offsets instead of re-parsing the file.
+
+Parser libraries are imported lazily so a service only needs the ones for
+the formats it actually handles.
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+PARAGRAPH = "paragraph"
+TABLE = "table"
+
+BLOCK_SEPARATOR = "\n"
+
+# Bump when a parser change alters the extracted text, backfill.py then re-extracts stored documents
+EXTRACTION_VERSION = "1"
+
+
+@dataclass
+class Block:
+    kind: str
+    start: int
+    end: int
+
+
+@dataclass
+class Page:
+    number: int
+    start: int
+    end: int
+    blocks: List[Block] = field(default_factory=list)
+
+
+@dataclass
+class StructuredDocument:
+    file_type: str
+    text: str
+    pages: List[Page] = field(default_factory=list)
+
+    def page_text(self, number: int) -> str:
+        page = self.pages[number - 1]
+        return self.text[page.start:page.end]
+
+    def block_texts(self, kind: Optional[str] = None) -> List[str]:
+        return [
+            self.text[block.start:block.end]
+            for page in self.pages
+            for block in page.blocks
+            if kind is None or block.kind == kind
+        ]
+
+    def page_blocks(self) -> List[Tuple[int, List[Tuple[str, str]]]]:
+        """Pages back as (page_number, [(kind, text), ...]), the input of ``build_document``"""
+        return [
+            (page.number, [(block.kind, self.text[block.start:block.end]) for block in page.blocks])
+            for page in self.pages
+        ]
+
+    def to_layout(self) -> list:
+        """Compact offsets-only representation, stored next to the text"""
+        return [
+            [page.number, page.start, page.end, [[block.kind, block.start, block.end] for block in page.blocks]]
+            for page in self.pages
+        ]
+
+    @classmethod
+    def from_layout(cls, file_type: str, text: str, layout: list) -> "StructuredDocument":
+        pages = [
+            Page(number, start, end, [Block(kind, b_start, b_end) for kind, b_start, b_end in blocks])
+            for number, start, end, blocks in layout
+        ]
+        return cls(file_type=file_type, text=text, pages=pages)
+
+
+# Page iterators: each yields (page_number, [(kind, text), ...]) in document order
+
+def iter_pdf_pages(source, page_numbers: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, List[Tuple[str, str]]]]:
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(source)
+    numbers = page_numbers if page_numbers is not None else range(1, len(reader.pages) + 1)
+    for number in numbers:
+        if number < 1 or number > len(reader.pages):
+            continue
+        page_text = reader.pages[number - 1].extract_text() or ""
+        paragraphs = [part.strip() for part in page_text.split("\n\n")]
+        yield number, [(PARAGRAPH, paragraph) for paragraph in paragraphs if paragraph]
+
+
+def iter_docx_pages(source) -> Iterator[Tuple[int, List[Tuple[str, str]]]]:
+    """Walk the DOCX body once, keeping paragraphs and tables in document order.
+
+    Pages are split on explicit page breaks and on the page breaks Word
+    recorded the last time it rendered the document.
+    """
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    document = docx.Document(source)
+    number, blocks = 1, []
+
+    for element in document.element.body.iterchildren():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            starts_new_page = bool(
+                element.xpath('.//w:br[@w:type="page"]') or element.xpath('.//w:lastRenderedPageBreak')
+            )
+            if starts_new_page and blocks:
+                yield number, blocks
+                number, blocks = number + 1, []
+            text = Paragraph(element, document).text.strip()
+            if text:
+                blocks.append((PARAGRAPH, text))
+        elif tag == 'tbl':
+            rows = [
+                "| " + " | ".join(cell.text.strip() for cell in row.cells) + " |"
+                for row in Table(element, document).rows
+            ]
+            if rows:
+                blocks.append((TABLE, "\n".join(rows)))
+
+    if blocks or number == 1:
+        yield number, blocks
+
+
+def iter_image_pages(source) -> Iterator[Tuple[int, List[Tuple[str, str]]]]:
+    import pytesseract
+    from PIL import Image
+    from services.ocr import OCR_LANGUAGES, preprocess_image
+
+    with Image.open(source) as image:
+        prepared = preprocess_image(image)
+    text = pytesseract.image_to_string(prepared, lang=OCR_LANGUAGES).strip()
+    yield 1, [(PARAGRAPH, text)] if text else []
+
+
+def iter_text_pages(source) -> Iterator[Tuple[int, List[Tuple[str, str]]]]:
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8') as f:
+            content = f.read()
+    else:
+        content = source.read().decode('utf-8')
+    paragraphs = [part.strip() for part in content.split("\n\n")]
+    yield 1, [(PARAGRAPH, paragraph) for paragraph in paragraphs if paragraph]
+
+
+def iter_pages(source, file_type: str) -> Iterator[Tuple[int, List[Tuple[str, str]]]]:
+    """Dispatch to the page iterator for a file type (path or binary stream)"""
+    if file_type == "pdf":
+        return iter_pdf_pages(source)
+    if file_type in ["doc", "docx"]:
+        return iter_docx_pages(source)
+    if file_type == "image":
+        return iter_image_pages(source)
+    if file_type == "txt":
+        return iter_text_pages(source)
+    return iter([])
+
+
+def processing_type(file_extension: str) -> str:
+    """Map a file extension to the file type the extractors understand"""
+    if file_extension == "pdf":
+        return "pdf"
+    if file_extension in ["doc", "docx"]:
+        return "docx"
+    if file_extension in ["png", "jpg", "jpeg", "gif"]:
+        return "image"
+    return "unknown"
+
+
+def count_pages(source, file_type: str) -> int:
+    """Number of pages without extracting any text where the format allows it"""
+    if file_type == "pdf":
+        import PyPDF2
+        return len(PyPDF2.PdfReader(source).pages)
+    return len(list(iter_pages(source, file_type)))
+
+
+def extract_pages(source, file_type: str, page_numbers: Optional[List[int]] = None) -> List[Tuple[int, List[Tuple[str, str]]]]:
+    """Extract only the given pages. PDF pages are parsed individually, other
+    formats have no independent pages and are parsed whole, then filtered."""
+    if file_type == "pdf":
+        return list(iter_pdf_pages(source, page_numbers))
+    pages = list(iter_pages(source, file_type))
+    if page_numbers is None:
+        return pages
+    wanted = set(page_numbers)
+    return [page for page in pages if page[0] in wanted]
+
+
+def page_blocks_text(blocks: List[Tuple[str, str]]) -> str:
+    return BLOCK_SEPARATOR.join(text for _, text in blocks)
+
+
+def build_document(file_type: str, pages: Iterable[Tuple[int, List[Tuple[str, str]]]]) -> StructuredDocument:
+    """Assemble page blocks into one text with offsets, using a single join"""
+    parts: List[str] = []
+    structured_pages: List[Page] = []
+    offset = 0
+
+    for number, blocks in pages:
+        page = Page(number=number, start=offset, end=offset)
+        for kind, text in blocks:
+            if parts:
+                parts.append(BLOCK_SEPARATOR)
+                offset += len(BLOCK_SEPARATOR)
+            page.blocks.append(Block(kind, offset, offset + len(text)))
+            parts.append(text)
+            offset += len(text)
+        if page.blocks:
+            page.start = page.blocks[0].start
+        else:
+            page.start = offset
+        page.end = offset
+        structured_pages.append(page)
+
+    return StructuredDocument(file_type=file_type, text="".join(parts), pages=structured_pages)
+
+
+def extract_structured(source, file_type: str) -> StructuredDocument:
+    """Parse a file once into its structured representation"""
+    return build_document(file_type, iter_pages(source, file_type))
@@ -0,0 +1,272 @@
+import os
+import time
+import signal
+import asyncio
+import resource
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 2)))
+# Jobs allowed to wait for a free worker before new ones are rejected
+EXTRACTION_QUEUE_SIZE = int(os.getenv("EXTRACTION_QUEUE_SIZE", str(EXTRACTION_WORKERS * 4)))
+EXTRACTION_TIMEOUT_SECONDS = float(os.getenv("EXTRACTION_TIMEOUT_SECONDS", "120"))
+# Address space limit of each worker process, 0 disables it
+EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv("EXTRACTION_MEMORY_LIMIT_MB", "2048"))
+# Peak memory tracing slows parsing down, it can be turned off once the budgets are tuned
+EXTRACTION_TRACE_MEMORY = os.getenv("EXTRACTION_TRACE_MEMORY", "true").lower() == "true"
+# Extra time the API waits after a job's own time limit before killing the worker
+TIMEOUT_GRACE_SECONDS = 10
+
+SIZE_BUCKETS = [(1, "<1MB"), (10, "1-10MB"), (50, "10-50MB")]
+
+
+class ExtractionError(Exception):
+    """Base class for extraction pool failures"""
+
+
+class ExtractionUnavailable(ExtractionError):
+    """Transient failure that says nothing about the file; the caller should retry later"""
+
+
+class ExtractionQueueFull(ExtractionUnavailable):
+    """Raised when every worker is busy and the waiting queue is full"""
+
+
+class ExtractionInterrupted(ExtractionUnavailable):
+    """Raised when a job was killed by a pool restart caused by another job"""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when a job exceeds its time limit"""
+
+
+class ExtractionLimitExceeded(ExtractionError):
+    """Raised when a job exceeds the worker memory limit"""
+
+
+def size_bucket(size: int) -> str:
+    megabytes = size / (1024 * 1024)
+    for limit, label in SIZE_BUCKETS:
+        if megabytes < limit:
+            return label
+    return f">{SIZE_BUCKETS[-1][0]}MB"
+
+
+def _init_worker():
+    """Cap the memory of a worker process so a runaway parser fails with MemoryError"""
+    if EXTRACTION_MEMORY_LIMIT_MB > 0:
+        limit = EXTRACTION_MEMORY_LIMIT_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _on_job_alarm(signum, frame):
+    raise ExtractionTimeout("time limit exceeded")
+
+
+def _run_limited(func: Callable, args: tuple, timeout: float) -> Tuple[Any, float, int]:
+    """Run a job inside a worker under its time limit.
+
+    Returns (result, seconds, peak_bytes). The alarm interrupts pure Python
+    parsers where they are, so the worker survives and can take the next job.
+    """
+    signal.signal(signal.SIGALRM, _on_job_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    if EXTRACTION_TRACE_MEMORY:
+        tracemalloc.start()
+    started = time.monotonic()
+    try:
+        result = func(*args)
+    except ExtractionTimeout:
+        raise ExtractionTimeout(f"Extraction exceeded {timeout:.0f}s")
+    except MemoryError:
+        raise ExtractionLimitExceeded(f"Extraction exceeded the {EXTRACTION_MEMORY_LIMIT_MB}MB memory limit")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        tracemalloc.stop()
+    return result, time.monotonic() - started, peak
+
+
+class ExtractionPool:
+    """Process pool running CPU-heavy text extraction off the event loop.
+
+    The number of jobs running or waiting is bounded; beyond that new jobs are
+    rejected with ``ExtractionQueueFull`` instead of piling up. A job that runs
+    past its timeout cannot be interrupted inside its process, so the whole
+    pool is replaced and the stuck workers are terminated. The other jobs
+    killed with it are retried once and otherwise fail with the transient
+    ``ExtractionInterrupted``, never as a failure of their file.
+
+    Each worker runs under a memory limit (``RLIMIT_AS``) and each job under a
+    time limit enforced inside the worker. Duration and tracemalloc peak memory
+    are recorded per file type and size bucket when the caller passes a profile.
+    """
+    _executor: Optional[ProcessPoolExecutor] = None
+    _in_flight = 0
+    _stats = {
+        "submitted": 0,
+        "completed": 0,
+        "failed": 0,
+        "timed_out": 0,
+        "rejected": 0,
+        "memory_exceeded": 0,
+        "pool_restarts": 0,
+        "interrupted": 0,
+        "total_seconds": 0.0,
+    }
+    _profiles: dict = {}
+
+    @classmethod
+    def start(cls):
+        if cls._executor is None:
+            cls._executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, initializer=_init_worker)
+
+    @classmethod
+    def shutdown(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+
+    @classmethod
+    def _restart(cls):
+        """Replace the pool, killing workers that are stuck on a timed out job"""
+        old_executor = cls._executor
+        cls._executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, initializer=_init_worker)
+        cls._stats["pool_restarts"] += 1
+        if old_executor is not None:
+            processes = list(getattr(old_executor, "_processes", {}).values())
+            old_executor.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+    @classmethod
+    def _record_profile(cls, profile: Optional[tuple], seconds: float, peak_bytes: int, failed: bool):
+        if profile is None:
+            return
+        file_type, file_size = profile
+        key = f"{file_type}:{size_bucket(file_size)}"
+        entry = cls._profiles.setdefault(key, {
+            "jobs": 0, "failed": 0, "total_seconds": 0.0, "max_seconds": 0.0, "total_peak_mb": 0.0, "max_peak_mb": 0.0,
+        })
+        entry["jobs"] += 1
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        if failed:
+            entry["failed"] += 1
+            return
+        peak_mb = peak_bytes / (1024 * 1024)
+        entry["total_peak_mb"] += peak_mb
+        entry["max_peak_mb"] = max(entry["max_peak_mb"], peak_mb)
+
+    @classmethod
+    async def run(cls, func: Callable, *args, timeout: Optional[float] = None, profile: Optional[tuple] = None) -> Any:
+        """Run ``func(*args)`` in a worker process and await its result.
+
+        ``profile`` is an optional (file_type, file_size) pair the job's
+        duration and peak memory are recorded under.
+        """
+        if cls._in_flight >= EXTRACTION_WORKERS + EXTRACTION_QUEUE_SIZE:
+            cls._stats["rejected"] += 1
+            raise ExtractionQueueFull("Extraction queue is full, please retry later")
+
+        timeout = timeout or EXTRACTION_TIMEOUT_SECONDS
+        cls._in_flight += 1
+        cls._stats["submitted"] += 1
+        started = time.monotonic()
+        try:
+            # A job killed by a restart it did not cause gets one more try
+            for attempt in range(2):
+                cls.start()
+                executor = cls._executor
+                try:
+                    return await cls._run_once(executor, func, args, timeout, profile, started)
+                except BrokenProcessPool:
+                    cls._stats["interrupted"] += 1
+                    replaced = cls._executor is not executor
+                    if not replaced:
+                        # A worker of the current pool died, possibly on this very job
+                        cls._restart()
+                    if attempt == 0:
+                        continue
+                    cls._stats["failed"] += 1
+                    cls._record_profile(profile, time.monotonic() - started, 0, failed=True)
+                    if replaced:
+                        # The pool was replaced after another job's timeout, twice
+                        raise ExtractionInterrupted("Extraction was interrupted by a worker restart, please retry")
+                    raise ExtractionError("Extraction worker crashed")
+        finally:
+            cls._in_flight -= 1
+            cls._stats["total_seconds"] += time.monotonic() - started
+
+    @classmethod
+    async def _run_once(cls, executor: ProcessPoolExecutor, func: Callable, args: tuple, timeout: float,
+                        profile: Optional[tuple], started: float) -> Any:
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, _run_limited, func, args, timeout)
+            # The worker enforces the limit itself, this only catches jobs stuck in native code
+            result, seconds, peak_bytes = await asyncio.wait_for(future, timeout + TIMEOUT_GRACE_SECONDS)
+            cls._stats["completed"] += 1
+            cls._record_profile(profile, seconds, peak_bytes, failed=False)
+            return result
+        except asyncio.TimeoutError:
+            cls._stats["timed_out"] += 1
+            cls._record_profile(profile, time.monotonic() - started, 0, failed=True)
+            if cls._executor is executor:
+                cls._restart()
+            raise ExtractionTimeout(f"Extraction exceeded {timeout:.0f}s")
+        except ExtractionTimeout:
+            cls._stats["timed_out"] += 1
+            cls._record_profile(profile, time.monotonic() - started, 0, failed=True)
+            raise
+        except BrokenProcessPool:
+            raise
+        except ExtractionLimitExceeded:
+            cls._stats["memory_exceeded"] += 1
+            cls._stats["failed"] += 1
+            cls._record_profile(profile, time.monotonic() - started, 0, failed=True)
+            raise
+        except Exception:
+            cls._stats["failed"] += 1
+            cls._record_profile(profile, time.monotonic() - started, 0, failed=True)
+            raise
+
+    @classmethod
+    def free_slots(cls) -> int:
+        """Jobs that can still be submitted before ``run`` rejects new ones"""
+        return max(0, EXTRACTION_WORKERS + EXTRACTION_QUEUE_SIZE - cls._in_flight)
+
+    @classmethod
+    def stats(cls) -> dict:
+        finished = cls._stats["completed"] + cls._stats["failed"] + cls._stats["timed_out"]
+        return {
+            "workers": EXTRACTION_WORKERS,
+            "queue_size": EXTRACTION_QUEUE_SIZE,
+            "in_flight": cls._in_flight,
+            "running": min(cls._in_flight, EXTRACTION_WORKERS),
+            "queued": max(0, cls._in_flight - EXTRACTION_WORKERS),
+            "saturation": round(cls._in_flight / (EXTRACTION_WORKERS + EXTRACTION_QUEUE_SIZE), 3),
+            "submitted": cls._stats["submitted"],
+            "completed": cls._stats["completed"],
+            "failed": cls._stats["failed"],
+            "timed_out": cls._stats["timed_out"],
+            "rejected": cls._stats["rejected"],
+            "memory_exceeded": cls._stats["memory_exceeded"],
+            "pool_restarts": cls._stats["pool_restarts"],
+            "interrupted": cls._stats["interrupted"],
+            "avg_job_seconds": round(cls._stats["total_seconds"] / finished, 3) if finished else 0.0,
+            "memory_limit_mb": EXTRACTION_MEMORY_LIMIT_MB,
+            "profiles": {
+                key: {
+                    "jobs": entry["jobs"],
+                    "failed": entry["failed"],
+                    "avg_seconds": round(entry["total_seconds"] / entry["jobs"], 3),
+                    "max_seconds": round(entry["max_seconds"], 3),
+                    "avg_peak_mb": round(entry["total_peak_mb"] / max(1, entry["jobs"] - entry["failed"]), 1),
+                    "max_peak_mb": round(entry["max_peak_mb"], 1),
+                }
+                for key, entry in cls._profiles.items()
+            },
+        }
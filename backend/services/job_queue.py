@@ -0,0 +1,151 @@
+"""
+Durable background job queue stored in the ``jobs`` collection.
+
+A worker leases a job for ``JOB_LEASE_SECONDS`` and keeps extending the lease
+while it runs. A job whose lease ran out (the worker crashed or was killed) is
+picked up again by another worker. Failed jobs are retried with exponential
+backoff and end up dead-lettered after ``JOB_MAX_ATTEMPTS`` attempts.
+"""
+
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# Job types, handled by worker.py
+ENRICH_DOCUMENT = "enrich_document"
+ANALYZE_STAGED = "analyze_staged"
+BACKFILL_DOCUMENT = "backfill_document"
+NEAR_DUPLICATE_SCAN = "near_duplicate_scan"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_DEAD = "dead_letter"
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "10"))
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "900"))
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying cannot help; the job is dead-lettered at once"""
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter after the given number of attempts"""
+    delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    @staticmethod
+    async def enqueue(db, job_type: str, payload: dict, owner_id=None, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """Add a job and return its id"""
+        now = datetime.utcnow()
+        result = await db.jobs.insert_one({
+            "type": job_type,
+            "payload": payload,
+            "owner_id": owner_id,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_at": now,
+            "lease_until": None,
+            "worker_id": None,
+            "progress": {"stage": "queued", "percent": 0},
+            "result": None,
+            "last_error": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def lease(db, worker_id: str, job_types: Optional[List[str]] = None) -> Optional[dict]:
+        """Take the next due job, or one whose previous worker lost its lease"""
+        now = datetime.utcnow()
+        query = {
+            "$or": [
+                {"status": JOB_QUEUED, "run_at": {"$lte": now}},
+                {"status": JOB_RUNNING, "lease_until": {"$lt": now}},
+            ]
+        }
+        if job_types:
+            query["type"] = {"$in": job_types}
+
+        return await db.jobs.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "worker_id": worker_id,
+                    "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "started_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    async def heartbeat(db, job: dict, progress: Optional[dict] = None) -> bool:
+        """Extend the lease of a running job. Returns False if the job was lost to another worker."""
+        now = datetime.utcnow()
+        update = {"lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS), "updated_at": now}
+        if progress is not None:
+            update["progress"] = progress
+        result = await db.jobs.update_one(
+            {"_id": job["_id"], "worker_id": job["worker_id"], "status": JOB_RUNNING},
+            {"$set": update}
+        )
+        return result.matched_count == 1
+
+    @staticmethod
+    async def complete(db, job: dict, result: Optional[dict] = None):
+        now = datetime.utcnow()
+        await db.jobs.update_one(
+            {"_id": job["_id"], "worker_id": job["worker_id"]},
+            {"$set": {
+                "status": JOB_DONE,
+                "result": result,
+                "progress": {"stage": "done", "percent": 100},
+                "lease_until": None,
+                "finished_at": now,
+                "updated_at": now,
+            }}
+        )
+
+    @staticmethod
+    async def fail(db, job: dict, error: Exception) -> str:
+        """Schedule a retry with backoff, or dead-letter the job. Returns the new status."""
+        now = datetime.utcnow()
+        permanent = isinstance(error, PermanentJobError)
+        if permanent or job["attempts"] >= job["max_attempts"]:
+            update = {"status": JOB_DEAD, "finished_at": now}
+        else:
+            update = {"status": JOB_QUEUED, "run_at": now + timedelta(seconds=backoff_seconds(job["attempts"]))}
+        update.update({"last_error": str(error), "lease_until": None, "updated_at": now})
+
+        await db.jobs.update_one({"_id": job["_id"], "worker_id": job["worker_id"]}, {"$set": update})
+        return update["status"]
+
+    @staticmethod
+    async def get(db, job_id: str) -> Optional[dict]:
+        if not ObjectId.is_valid(job_id):
+            return None
+        return await db.jobs.find_one({"_id": ObjectId(job_id)})
+
+    @staticmethod
+    async def stats(db) -> dict:
+        """Number of jobs per status"""
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_DEAD: 0}
+        async for row in db.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return counts
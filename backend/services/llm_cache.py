@@ -0,0 +1,161 @@
+"""
+Cache of LLM responses, shared by the backend and the llm service.
+
+Entries are keyed by a hash of the model, the prompt template and its
+version, the call parameters and the normalized input text, so any change to
+the prompt or parameters misses the cache instead of returning stale output.
+A bounded in-process LRU sits in front of the ``llm_cache`` Mongo collection,
+whose entries expire after ``LLM_CACHE_TTL_DAYS``.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+
+LLM_CACHE_TTL_DAYS = int(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+LLM_CACHE_LRU_SIZE = int(os.getenv("LLM_CACHE_LRU_SIZE", "1024"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace and unicode differences should not defeat the cache"""
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+def make_key(model: str, template: str, template_version: str, params: dict, text: str) -> str:
+    material = json.dumps(
+        [model, template, template_version, params, normalize_text(text)],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    _lru: "OrderedDict[str, Any]" = OrderedDict()
+    _lock = threading.Lock()
+    _sync_collection = None
+    _stats = {
+        "memory_hits": 0,
+        "mongo_hits": 0,
+        "misses": 0,
+        "stores": 0,
+    }
+
+    @classmethod
+    def _get_local(cls, key: str) -> Optional[Any]:
+        with cls._lock:
+            if key not in cls._lru:
+                return None
+            cls._lru.move_to_end(key)
+            return cls._lru[key]
+
+    @classmethod
+    def _put_local(cls, key: str, value: Any):
+        with cls._lock:
+            cls._lru[key] = value
+            cls._lru.move_to_end(key)
+            while len(cls._lru) > LLM_CACHE_LRU_SIZE:
+                cls._lru.popitem(last=False)
+
+    @staticmethod
+    def _record(key: str, value: Any, template: str) -> dict:
+        return {"_id": key, "value": value, "template": template, "created_at": datetime.utcnow()}
+
+    # Async interface, used by the backend (Motor)
+
+    @staticmethod
+    async def _collection():
+        from database import get_database
+
+        db = await get_database()
+        return db.llm_cache if db is not None else None
+
+    @classmethod
+    async def get(cls, key: str) -> Optional[Any]:
+        if not LLM_CACHE_ENABLED:
+            return None
+        value = cls._get_local(key)
+        if value is not None:
+            cls._stats["memory_hits"] += 1
+            return value
+
+        collection = await cls._collection()
+        record = await collection.find_one({"_id": key}) if collection is not None else None
+        if record is None:
+            cls._stats["misses"] += 1
+            return None
+        cls._stats["mongo_hits"] += 1
+        cls._put_local(key, record["value"])
+        return record["value"]
+
+    @classmethod
+    async def put(cls, key: str, value: Any, template: str = ""):
+        if not LLM_CACHE_ENABLED:
+            return
+        cls._put_local(key, value)
+        cls._stats["stores"] += 1
+        collection = await cls._collection()
+        if collection is not None:
+            record = cls._record(key, value, template)
+            await collection.replace_one({"_id": key}, record, upsert=True)
+
+    # Sync interface, used by the llm service (PyMongo, only when MONGODB_URL is set)
+
+    @classmethod
+    def _get_sync_collection(cls):
+        if cls._sync_collection is None and os.getenv("MONGODB_URL"):
+            from pymongo import MongoClient
+
+            client = MongoClient(os.getenv("MONGODB_URL"))
+            cls._sync_collection = client[os.getenv("DATABASE_NAME", "knowledge_management")].llm_cache
+        return cls._sync_collection
+
+    @classmethod
+    def get_sync(cls, key: str) -> Optional[Any]:
+        if not LLM_CACHE_ENABLED:
+            return None
+        value = cls._get_local(key)
+        if value is not None:
+            cls._stats["memory_hits"] += 1
+            return value
+
+        collection = cls._get_sync_collection()
+        record = collection.find_one({"_id": key}) if collection is not None else None
+        if record is None:
+            cls._stats["misses"] += 1
+            return None
+        cls._stats["mongo_hits"] += 1
+        cls._put_local(key, record["value"])
+        return record["value"]
+
+    @classmethod
+    def put_sync(cls, key: str, value: Any, template: str = ""):
+        if not LLM_CACHE_ENABLED:
+            return
+        cls._put_local(key, value)
+        cls._stats["stores"] += 1
+        collection = cls._get_sync_collection()
+        if collection is not None:
+            collection.replace_one({"_id": key}, cls._record(key, value, template), upsert=True)
+
+    @classmethod
+    def stats(cls) -> dict:
+        stats = cls._stats
+        lookups = stats["memory_hits"] + stats["mongo_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["mongo_hits"]
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "lru_entries": len(cls._lru),
+            "lru_size": LLM_CACHE_LRU_SIZE,
+            "lookups": lookups,
+            "memory_hits": stats["memory_hits"],
+            "mongo_hits": stats["mongo_hits"],
+            "misses": stats["misses"],
+            "stores": stats["stores"],
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import random
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from services.llm_scheduler import LLMScheduler, estimate_tokens
+
+load_dotenv()
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# Requests in flight at once from this process, further calls wait their turn
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+
+class LLMError(Exception):
+    """Raised when a chat completion fails after all retries"""
+
+
+class LLMClient:
+    """Async OpenAI-compatible chat client sharing one HTTP connection pool.
+
+    Calls go through the ``LLMScheduler`` and are limited to
+    ``LLM_MAX_CONCURRENCY`` at a time; timeouts and server errors are retried
+    with exponential backoff, rate limits through the scheduler's backoff.
+    """
+    _client: Optional[httpx.AsyncClient] = None
+    _semaphore: Optional[asyncio.Semaphore] = None
+    _in_flight = 0
+    _stats = {
+        "requests": 0,
+        "retries": 0,
+        "failed": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_seconds": 0.0,
+    }
+
+    @classmethod
+    def _get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(
+                base_url=OPENAI_BASE_URL,
+                headers={"Authorization": f"Bearer {os.getenv('API_KEY', '')}"},
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_CONCURRENCY
+                ),
+            )
+            cls._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        return cls._client
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+            cls._semaphore = None
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        try:
+            return min(RETRY_MAX_SECONDS, float(response.headers["retry-after"]))
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def _retry_delay(attempt: int) -> float:
+        return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    @classmethod
+    async def chat(cls, messages: List[dict], model: Optional[str] = None, max_tokens: Optional[int] = None,
+                   temperature: float = 0.3) -> str:
+        """Return the content of the first choice of a chat completion.
+
+        Every attempt first waits for the scheduler, which orders calls by
+        lane and keeps them under the per-minute request and token limits.
+        """
+        client = cls._get_client()
+        payload = {"model": model or LLM_MODEL, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        estimated_tokens = estimate_tokens(messages, max_tokens)
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            ticket = await LLMScheduler.acquire(estimated_tokens)
+            response = None
+            async with cls._semaphore:
+                cls._in_flight += 1
+                started = time.monotonic()
+                try:
+                    response = await client.post("/chat/completions", json=payload)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        response.raise_for_status()
+                        data = response.json()
+                        usage = data.get("usage") or {}
+                        LLMScheduler.settle(ticket, usage.get("total_tokens"))
+                        cls._stats["requests"] += 1
+                        cls._stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                        cls._stats["completion_tokens"] += usage.get("completion_tokens", 0)
+                        return data["choices"][0]["message"]["content"].strip()
+                    error = LLMError(f"LLM request failed with status {response.status_code}")
+                except httpx.HTTPStatusError as e:
+                    # Other 4xx errors will not get better by retrying
+                    cls._stats["failed"] += 1
+                    raise LLMError(f"LLM request failed with status {e.response.status_code}: {e.response.text[:200]}")
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    error = LLMError(f"LLM request failed: {e.__class__.__name__}")
+                finally:
+                    cls._in_flight -= 1
+                    cls._stats["total_seconds"] += time.monotonic() - started
+
+            if response is not None and response.status_code == 429:
+                # The scheduler pauses every caller, not just this one
+                LLMScheduler.report_rate_limited(cls._retry_after(response))
+            elif attempt < LLM_MAX_RETRIES:
+                await asyncio.sleep(cls._retry_delay(attempt))
+            if attempt < LLM_MAX_RETRIES:
+                cls._stats["retries"] += 1
+
+        cls._stats["failed"] += 1
+        raise error
+
+    @classmethod
+    async def chat_stream(cls, messages: List[dict], model: Optional[str] = None, max_tokens: Optional[int] = None,
+                          temperature: float = 0.3) -> AsyncIterator[str]:
+        """Yield the content of a chat completion piece by piece as it is generated.
+
+        Failures before the first piece are retried like in ``chat``. Once
+        output was yielded a failure raises ``LLMError``, the caller has
+        already passed part of the answer on.
+
+        The completion is read by a separate task into a queue, so a slow
+        reader of this iterator does not hold a concurrency slot and a pooled
+        connection for longer than the generation itself takes.
+        """
+        payload = {
+            "model": model or LLM_MODEL, "messages": messages, "temperature": temperature,
+            "stream": True, "stream_options": {"include_usage": True}
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+
+        # Unbounded on purpose: the completion is capped by max_tokens and the
+        # producer must never wait for the reader while holding its slot
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(
+            cls._stream_to_queue(payload, estimate_tokens(messages, max_tokens), queue)
+        )
+        producer.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (piece := await queue.get()) is not None:
+                yield piece
+            producer.result()
+        finally:
+            # Stops the generation and frees its slot when the reader went away early
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    @classmethod
+    async def _stream_to_queue(cls, payload: dict, estimated_tokens: int, queue: asyncio.Queue):
+        """Put the pieces of a streamed completion into ``queue``, retrying until the first one"""
+        client = cls._get_client()
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            ticket = await LLMScheduler.acquire(estimated_tokens)
+            status_code = None
+            retry_after = None
+            yielded = False
+            async with cls._semaphore:
+                cls._in_flight += 1
+                started = time.monotonic()
+                try:
+                    async with client.stream("POST", "/chat/completions", json=payload) as response:
+                        status_code = response.status_code
+                        if status_code in RETRY_STATUS_CODES:
+                            retry_after = cls._retry_after(response)
+                            error = LLMError(f"LLM request failed with status {status_code}")
+                        elif response.is_error:
+                            await response.aread()
+                            cls._stats["failed"] += 1
+                            raise LLMError(f"LLM request failed with status {status_code}: {response.text[:200]}")
+                        else:
+                            usage = {}
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    break
+                                chunk = json.loads(data)
+                                usage = chunk.get("usage") or usage
+                                for choice in chunk.get("choices") or []:
+                                    piece = (choice.get("delta") or {}).get("content")
+                                    if piece:
+                                        yielded = True
+                                        queue.put_nowait(piece)
+                            LLMScheduler.settle(ticket, usage.get("total_tokens"))
+                            cls._stats["requests"] += 1
+                            cls._stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                            cls._stats["completion_tokens"] += usage.get("completion_tokens", 0)
+                            return
+                except (httpx.TimeoutException, httpx.TransportError, ValueError) as e:
+                    error = LLMError(f"LLM stream failed: {e.__class__.__name__}")
+                    if yielded:
+                        cls._stats["failed"] += 1
+                        raise error
+                finally:
+                    cls._in_flight -= 1
+                    cls._stats["total_seconds"] += time.monotonic() - started
+
+            if status_code == 429:
+                LLMScheduler.report_rate_limited(retry_after)
+            elif attempt < LLM_MAX_RETRIES:
+                await asyncio.sleep(cls._retry_delay(attempt))
+            if attempt < LLM_MAX_RETRIES:
+                cls._stats["retries"] += 1
+
+        cls._stats["failed"] += 1
+        raise error
+
+    @classmethod
+    def stats(cls) -> dict:
+        finished = cls._stats["requests"] + cls._stats["failed"]
+        return {
+            "base_url": OPENAI_BASE_URL,
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "in_flight": cls._in_flight,
+            "requests": cls._stats["requests"],
+            "retries": cls._stats["retries"],
+            "failed": cls._stats["failed"],
+            "prompt_tokens": cls._stats["prompt_tokens"],
+            "completion_tokens": cls._stats["completion_tokens"],
+            "avg_request_seconds": round(cls._stats["total_seconds"] / finished, 3) if finished else 0.0,
+        }
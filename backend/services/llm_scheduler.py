@@ -0,0 +1,410 @@
+"""
+Central scheduler for outgoing LLM calls, shared by the backend and the llm
+service.
+
+Calls take requests and tokens from two token buckets sized by the
+provider's per-minute limits (``LLM_RPM_LIMIT``, ``LLM_TPM_LIMIT``). Waiting
+calls queue in priority lanes: interactive calls always go before background
+ones, and calls in the same lane go in arrival order. The lane comes from a
+context variable, so request handlers are interactive by default and
+background jobs set ``use_lane(BACKGROUND)`` once.
+
+A rate-limit response pauses all lanes for the ``Retry-After`` period and
+lowers the bucket refill rate; successful calls restore it gradually.
+
+The API, the job workers and the llm service are separate processes calling
+the same provider, so the budget itself lives in Mongo (``llm_budget``): each
+window of ``LLM_BUDGET_WINDOW_SECONDS`` has a request and a token counter
+that every process draws from, background calls may only use the share left
+after ``LLM_INTERACTIVE_RESERVE``, and they back off entirely while any
+process has interactive calls waiting. Rate-limit pauses are shared the same
+way. Lanes order the calls within a process; only the head call of a process
+talks to Mongo. Without Mongo the limits apply per process.
+
+The scheduler works for async callers (``acquire``) and threads
+(``acquire_sync``) alike, the state is guarded by a thread lock.
+"""
+
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Tuple
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = [INTERACTIVE, BACKGROUND]
+
+LLM_RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "200000"))
+
+# Poll interval of calls waiting behind others
+QUEUE_POLL_SECONDS = 0.05
+MIN_RATE_FACTOR = 0.25
+RATE_FACTOR_RECOVERY = 0.05
+DEFAULT_RATE_LIMIT_PAUSE = 5.0
+
+LLM_SHARED_BUDGET = os.getenv("LLM_SHARED_BUDGET", "true").lower() == "true"
+LLM_BUDGET_WINDOW_SECONDS = int(os.getenv("LLM_BUDGET_WINDOW_SECONDS", "10"))
+# Share of every window background calls leave to interactive ones
+LLM_INTERACTIVE_RESERVE = float(os.getenv("LLM_INTERACTIVE_RESERVE", "0.2"))
+# How long background calls stand back after an interactive call had to wait
+INTERACTIVE_WAITING_SECONDS = 2.0
+# How often the shared rate-limit pause is read, and how long Mongo is left alone after an error
+SHARED_PAUSE_REFRESH_SECONDS = 1.0
+SHARED_RETRY_SECONDS = 30.0
+
+_current_lane: contextvars.ContextVar = contextvars.ContextVar("llm_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def use_lane(lane: str):
+    """Run the enclosed LLM calls in the given lane"""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int]) -> int:
+    """Prompt tokens (about 3 characters each) plus the completion budget"""
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 3 + (max_tokens or 500)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, rate_factor: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60 * rate_factor)
+        self.updated = now
+
+    def seconds_until(self, amount: float, rate_factor: float) -> float:
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / (self.capacity * rate_factor))
+
+
+class Ticket:
+    __slots__ = ("lane", "tokens", "enqueued_at", "window", "charged")
+
+    def __init__(self, lane: str, tokens: int):
+        self.lane = lane
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        # Shared budget window the ticket was granted in, and the tokens taken from it
+        self.window = None
+        self.charged = 0
+
+
+class SharedBudget:
+    """Request and token counters per time window in the ``llm_budget`` collection, shared by every process.
+
+    Uses PyMongo in both the backend and the llm service; async callers run
+    ``take`` in a thread.
+    """
+    _collection = None
+    _lock = threading.Lock()
+    _unavailable_until = 0.0
+    _pause_until = 0.0
+    _pause_read_at = 0.0
+    _pause_to_publish = 0.0
+    # Token corrections of settled calls, applied with the next grant
+    _corrections: dict = {}
+    _stats = {"granted": 0, "refused": 0, "errors": 0}
+
+    @classmethod
+    def _get_collection(cls):
+        if cls._collection is None:
+            from pymongo import MongoClient
+
+            client = MongoClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"), serverSelectionTimeoutMS=2000)
+            cls._collection = client[os.getenv("DATABASE_NAME", "knowledge_management")].llm_budget
+        return cls._collection
+
+    @classmethod
+    def available(cls) -> bool:
+        return LLM_SHARED_BUDGET and time.monotonic() >= cls._unavailable_until
+
+    @staticmethod
+    def _limits(lane: str, rate_factor: float) -> Tuple[float, float]:
+        share = LLM_BUDGET_WINDOW_SECONDS / 60 * rate_factor
+        if lane == BACKGROUND:
+            share *= 1 - LLM_INTERACTIVE_RESERVE
+        return max(1.0, LLM_RPM_LIMIT * share), LLM_TPM_LIMIT * share
+
+    @classmethod
+    def report_pause(cls, pause: float):
+        """Publish a rate-limit pause to the other processes with the next grant"""
+        with cls._lock:
+            cls._pause_to_publish = max(cls._pause_to_publish, time.time() + pause)
+
+    @classmethod
+    def correct(cls, window: Optional[str], delta: int):
+        if window is None or not delta:
+            return
+        with cls._lock:
+            cls._corrections[window] = cls._corrections.get(window, 0) + delta
+
+    @classmethod
+    def _sync_pause(cls, collection, now: float) -> float:
+        with cls._lock:
+            publish, cls._pause_to_publish = cls._pause_to_publish, 0.0
+        if publish > now:
+            collection.update_one({"_id": "pause"}, {"$max": {"until": publish}}, upsert=True)
+            cls._pause_until = max(cls._pause_until, publish)
+        if now - cls._pause_read_at >= SHARED_PAUSE_REFRESH_SECONDS:
+            record = collection.find_one({"_id": "pause"})
+            cls._pause_until = record["until"] if record else 0.0
+            cls._pause_read_at = now
+        return cls._pause_until
+
+    @classmethod
+    def _apply_corrections(cls, collection, current: str):
+        with cls._lock:
+            corrections, cls._corrections = cls._corrections, {}
+        # Windows that are over no longer matter
+        if corrections.get(current):
+            collection.update_one({"_id": current}, {"$inc": {"tokens": corrections[current]}})
+
+    @staticmethod
+    def _open_window(collection, window: str) -> bool:
+        """Create a window's counters. Returns False if they already existed."""
+        from pymongo.errors import DuplicateKeyError
+
+        try:
+            result = collection.update_one(
+                {"_id": window},
+                {"$setOnInsert": {"requests": 0, "tokens": 0, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another process created it at the same moment
+            return False
+        return result.upserted_id is not None
+
+    @classmethod
+    def take(cls, lane: str, tokens: int, rate_factor: float) -> Optional[Tuple[float, Optional[str], int]]:
+        """Take one request and ``tokens`` tokens from the current window.
+
+        Returns (0, window, charged tokens) when granted, (seconds to wait,
+        None, 0) when not, and None when Mongo is unavailable. Blocking.
+        """
+        try:
+            collection = cls._get_collection()
+            now = time.time()
+            pause_until = cls._sync_pause(collection, now)
+            if pause_until > now:
+                return min(pause_until - now, 1.0), None, 0
+
+            start = int(now // LLM_BUDGET_WINDOW_SECONDS) * LLM_BUDGET_WINDOW_SECONDS
+            window, next_window = f"window:{start}", f"window:{start + LLM_BUDGET_WINDOW_SECONDS}"
+            cls._apply_corrections(collection, window)
+
+            request_limit, token_limit = cls._limits(lane, rate_factor)
+            # A call larger than a whole window still goes, alone
+            charged = int(min(tokens, token_limit))
+            query = {"_id": window, "requests": {"$lte": request_limit - 1}, "tokens": {"$lte": token_limit - charged}}
+            if lane == BACKGROUND:
+                query["interactive_waiting_until"] = {"$not": {"$gt": now}}
+            grant = {"$inc": {"requests": 1, "tokens": charged}}
+
+            granted = collection.update_one(query, grant).modified_count
+            if not granted and cls._open_window(collection, window):
+                granted = collection.update_one(query, grant).modified_count
+            if granted:
+                cls._stats["granted"] += 1
+                return 0.0, window, charged
+
+            cls._stats["refused"] += 1
+            if lane == INTERACTIVE:
+                # Background calls of every process stand back, in this window and the next
+                for key in (window, next_window):
+                    cls._open_window(collection, key)
+                    collection.update_one(
+                        {"_id": key}, {"$max": {"interactive_waiting_until": now + INTERACTIVE_WAITING_SECONDS}}
+                    )
+            return min(max(start + LLM_BUDGET_WINDOW_SECONDS - now, 0.01), 1.0), None, 0
+        except Exception as e:
+            cls._stats["errors"] += 1
+            cls._unavailable_until = time.monotonic() + SHARED_RETRY_SECONDS
+            print(f"Shared LLM budget unavailable, limiting this process alone for {SHARED_RETRY_SECONDS:.0f}s: {e}")
+            return None
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "enabled": LLM_SHARED_BUDGET,
+            "available": cls.available(),
+            "window_seconds": LLM_BUDGET_WINDOW_SECONDS,
+            "interactive_reserve": LLM_INTERACTIVE_RESERVE,
+            **cls._stats,
+        }
+
+
+class LLMScheduler:
+    _lock = threading.Lock()
+    _requests = TokenBucket(LLM_RPM_LIMIT)
+    _tokens = TokenBucket(LLM_TPM_LIMIT)
+    _queues = {lane: deque() for lane in LANES}
+    _paused_until = 0.0
+    _rate_factor = 1.0
+    _stats = {lane: {"granted": 0, "total_wait": 0.0, "max_wait": 0.0} for lane in LANES}
+    _rate_limited = 0
+
+    @classmethod
+    def _enqueue(cls, tokens: int) -> Ticket:
+        ticket = Ticket(current_lane(), tokens)
+        with cls._lock:
+            cls._queues[ticket.lane].append(ticket)
+        return ticket
+
+    @classmethod
+    def _check_head(cls, ticket: Ticket) -> float:
+        """0 when the ticket is next in this process and may ask the budget, else seconds to wait"""
+        with cls._lock:
+            now = time.monotonic()
+            if now < cls._paused_until:
+                return min(cls._paused_until - now, 1.0)
+
+            # Only the head of the highest priority non-empty lane may go
+            head = next(cls._queues[lane][0] for lane in LANES if cls._queues[lane])
+            return 0.0 if head is ticket else QUEUE_POLL_SECONDS
+
+    @classmethod
+    def _grant(cls, ticket: Ticket, now: float):
+        cls._queues[ticket.lane].popleft()
+        waited = now - ticket.enqueued_at
+        stats = cls._stats[ticket.lane]
+        stats["granted"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+    @classmethod
+    def _take_local(cls, ticket: Ticket) -> float:
+        with cls._lock:
+            now = time.monotonic()
+            cls._requests.refill(now, cls._rate_factor)
+            cls._tokens.refill(now, cls._rate_factor)
+            wait = max(
+                cls._requests.seconds_until(1, cls._rate_factor),
+                cls._tokens.seconds_until(ticket.tokens, cls._rate_factor)
+            )
+            if wait > 0:
+                return min(max(wait, 0.01), 1.0)
+
+            cls._requests.level -= 1
+            cls._tokens.level -= ticket.tokens
+            cls._grant(ticket, now)
+            return 0.0
+
+    @classmethod
+    def _take(cls, ticket: Ticket) -> float:
+        """Take the head ticket's budget, shared if possible. Returns 0 when granted, else seconds to wait."""
+        if SharedBudget.available():
+            taken = SharedBudget.take(ticket.lane, ticket.tokens, cls._rate_factor)
+            if taken is not None:
+                wait, ticket.window, ticket.charged = taken
+                if wait > 0:
+                    return wait
+                with cls._lock:
+                    cls._grant(ticket, time.monotonic())
+                return 0.0
+        return cls._take_local(ticket)
+
+    @classmethod
+    def _abandon(cls, ticket: Ticket):
+        with cls._lock:
+            if ticket in cls._queues[ticket.lane]:
+                cls._queues[ticket.lane].remove(ticket)
+
+    @classmethod
+    async def acquire(cls, tokens: int) -> Ticket:
+        """Wait until a call estimated at ``tokens`` tokens may be sent"""
+        ticket = cls._enqueue(tokens)
+        try:
+            while True:
+                wait = cls._check_head(ticket)
+                if wait == 0:
+                    if SharedBudget.available():
+                        wait = await asyncio.to_thread(cls._take, ticket)
+                    else:
+                        wait = cls._take_local(ticket)
+                if wait == 0:
+                    return ticket
+                await asyncio.sleep(wait)
+        except BaseException:
+            cls._abandon(ticket)
+            raise
+
+    @classmethod
+    def acquire_sync(cls, tokens: int) -> Ticket:
+        """Blocking variant of ``acquire`` for threaded callers"""
+        ticket = cls._enqueue(tokens)
+        try:
+            while True:
+                wait = cls._check_head(ticket)
+                if wait == 0:
+                    wait = cls._take(ticket)
+                if wait == 0:
+                    return ticket
+                time.sleep(wait)
+        except BaseException:
+            cls._abandon(ticket)
+            raise
+
+    @classmethod
+    def settle(cls, ticket: Ticket, actual_tokens: Optional[int]):
+        """Correct the token bucket once the real usage of a call is known"""
+        if actual_tokens is not None and ticket.window is not None:
+            SharedBudget.correct(ticket.window, actual_tokens - ticket.charged)
+        with cls._lock:
+            if actual_tokens is not None and ticket.window is None:
+                cls._tokens.level += ticket.tokens - actual_tokens
+            cls._rate_factor = min(1.0, cls._rate_factor + RATE_FACTOR_RECOVERY)
+
+    @classmethod
+    def report_rate_limited(cls, retry_after: Optional[float] = None):
+        """Back off after a 429: pause every lane and slow the refill down"""
+        with cls._lock:
+            cls._rate_limited += 1
+            pause = retry_after if retry_after else DEFAULT_RATE_LIMIT_PAUSE / cls._rate_factor
+            cls._paused_until = max(cls._paused_until, time.monotonic() + pause)
+            cls._rate_factor = max(MIN_RATE_FACTOR, cls._rate_factor / 2)
+        SharedBudget.report_pause(pause)
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            now = time.monotonic()
+            lanes = {}
+            for lane in LANES:
+                stats = cls._stats[lane]
+                queue = cls._queues[lane]
+                lanes[lane] = {
+                    "queue_depth": len(queue),
+                    "oldest_wait_seconds": round(now - queue[0].enqueued_at, 3) if queue else 0.0,
+                    "granted": stats["granted"],
+                    "avg_wait_seconds": round(stats["total_wait"] / stats["granted"], 3) if stats["granted"] else 0.0,
+                    "max_wait_seconds": round(stats["max_wait"], 3),
+                }
+            return {
+                "rpm_limit": LLM_RPM_LIMIT,
+                "tpm_limit": LLM_TPM_LIMIT,
+                "rate_factor": round(cls._rate_factor, 3),
+                "paused_seconds": round(max(0.0, cls._paused_until - now), 3),
+                "rate_limited": cls._rate_limited,
+                "lanes": lanes,
+                "shared_budget": SharedBudget.stats(),
+            }
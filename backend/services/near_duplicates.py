@@ -0,0 +1,238 @@
+"""
+Near-duplicate detection for extracted texts with MinHash and locality-
+sensitive hashing.
+
+A text is cut into overlapping word shingles. Its signature keeps, for each of
+``MINHASH_PERMUTATIONS`` hash functions, the smallest hash of any shingle; the
+share of equal positions in two signatures estimates the Jaccard similarity of
+the shingle sets. The signature is split into ``LSH_BANDS`` bands and every
+band is hashed to a key stored on the text store record under a multikey
+index. Texts sharing a band key are candidates, which is likely only for
+near-identical texts (about 99% at 0.85 similarity, 6% at 0.5), so a lookup is
+one indexed query whatever the size of the corpus. Candidates are then checked
+against ``NEAR_DUPLICATE_THRESHOLD`` with their signatures.
+
+Grouping the whole corpus takes one lookup per stored text, so it runs as a
+background job (``near_duplicate_scan``) that saves its result in
+``near_duplicate_reports``.
+"""
+
+import os
+import re
+import zlib
+import hashlib
+import unicodedata
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from models import VisibilityLevel
+
+# Bump when a parameter below changes, older signatures are then recomputed by the backfill
+MINHASH_VERSION = 1
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+SHINGLE_WORDS = 5
+# Shorter texts are not compared, a few words say nothing about the document
+MIN_SHINGLES = 20
+
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+# Candidates checked per lookup, band keys of boilerplate text can be shared widely
+MAX_CANDIDATES = 200
+
+_PRIME = (1 << 31) - 1
+_CHUNK_SHINGLES = 4096
+# Fixed seed: signatures must be comparable across processes and restarts
+_coefficients = np.random.default_rng(20240601).integers(1, _PRIME, size=(2, MINHASH_PERMUTATIONS), dtype=np.uint64)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Distinct 32-bit hashes of the lowercased word shingles of a text"""
+    words = re.findall(r"\w+", unicodedata.normalize("NFC", text.lower()))
+    if len(words) < SHINGLE_WORDS:
+        return np.array([], dtype=np.uint64)
+    hashes = [
+        zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    ]
+    return np.unique(np.array(hashes, dtype=np.uint64))
+
+
+def minhash_signature(text: str) -> Optional[List[int]]:
+    """MinHash signature of a text, None when it is too short to compare"""
+    shingles = shingle_hashes(text) % _PRIME
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    a, b = _coefficients[0][:, None], _coefficients[1][:, None]
+    signature = np.full(MINHASH_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    # In chunks, the full permutation matrix of a long document would not fit in memory
+    for start in range(0, len(shingles), _CHUNK_SHINGLES):
+        chunk = shingles[start:start + _CHUNK_SHINGLES][None, :]
+        signature = np.minimum(signature, ((a * chunk + b) % _PRIME).min(axis=1))
+    return [int(value) for value in signature]
+
+
+def band_keys(signature: List[int]) -> List[str]:
+    values = np.array(signature, dtype=np.uint32)
+    return [
+        f"{MINHASH_VERSION}:{band}:"
+        + hashlib.blake2b(values[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(), digest_size=8).hexdigest()
+        for band in range(LSH_BANDS)
+    ]
+
+
+def estimate_similarity(first: List[int], second: List[int]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    if not first or not second or len(first) != len(second):
+        return 0.0
+    return float(np.mean(np.array(first) == np.array(second)))
+
+
+class NearDuplicateIndex:
+    @staticmethod
+    def signature_fields(text: str) -> dict:
+        """Fields stored on a text store record to make it findable; short texts only get the version"""
+        signature = minhash_signature(text)
+        if signature is None:
+            return {"minhash_version": MINHASH_VERSION}
+        return {"minhash": signature, "minhash_bands": band_keys(signature), "minhash_version": MINHASH_VERSION}
+
+    @staticmethod
+    async def find(db, signature: List[int], exclude_hash: Optional[str] = None,
+                   threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[Tuple[str, float]]:
+        """Content hashes of texts similar to a signature, most similar first"""
+        query = {"minhash_bands": {"$in": band_keys(signature)}}
+        if exclude_hash:
+            query["_id"] = {"$ne": exclude_hash}
+        cursor = db.extracted_texts.find(query, {"minhash": 1}).limit(MAX_CANDIDATES)
+        matches = []
+        async for record in cursor:
+            similarity = estimate_similarity(signature, record.get("minhash"))
+            if similarity >= threshold:
+                matches.append((record["_id"], similarity))
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    @staticmethod
+    async def find_for_hash(db, file_hash: str, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[Tuple[str, float]]:
+        """Near-duplicates of an already stored text"""
+        record = await db.extracted_texts.find_one({"_id": file_hash}, {"minhash": 1, "minhash_version": 1})
+        if not record or not record.get("minhash") or record.get("minhash_version") != MINHASH_VERSION:
+            return []
+        return await NearDuplicateIndex.find(db, record["minhash"], exclude_hash=file_hash, threshold=threshold)
+
+    @staticmethod
+    async def find_enriched_match(db, document: dict, owner_group: Optional[str]) -> Optional[Tuple[dict, float]]:
+        """The oldest document with a summary and tags whose text nearly matches, with the similarity.
+
+        Only documents the owner of ``document`` may open are considered, the
+        summary of a text can reveal what the uploader's copy does not contain.
+        """
+        visible = [{"owner_id": document["owner_id"]}, {"visibility": VisibilityLevel.PUBLIC}]
+        if owner_group:
+            visible.append({"visibility": VisibilityLevel.GROUP, "group": owner_group})
+        for match_hash, similarity in await NearDuplicateIndex.find_for_hash(db, document["content_hash"]):
+            query = {
+                "content_hash": match_hash, "summary": {"$nin": [None, ""]}, "tags.0": {"$exists": True},
+                "_id": {"$ne": document["_id"]}, "$or": visible,
+            }
+            match = await db.documents.find_one(
+                query, {"summary": 1, "tags": 1, "title": 1}, sort=[("created_at", 1)]
+            )
+            if match:
+                return match, similarity
+        return None
+
+    @staticmethod
+    async def clusters(db, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[Dict[str, List[int]]]:
+        """Groups of near-duplicate texts in the whole store, as {content_hash: signature} maps.
+
+        Every text is looked up once through the band index, the pairs found
+        are then joined into groups. Only the signatures of grouped texts are
+        loaded for the result.
+        """
+        parent = {}
+
+        def root(file_hash):
+            while parent.get(file_hash, file_hash) != file_hash:
+                file_hash = parent[file_hash]
+            return file_hash
+
+        cursor = db.extracted_texts.find(
+            {"minhash_version": MINHASH_VERSION, "minhash": {"$exists": True}}, {"minhash": 1}
+        ).batch_size(500)
+        async for record in cursor:
+            for match_hash, _ in await NearDuplicateIndex.find(db, record["minhash"], record["_id"], threshold):
+                first, second = root(record["_id"]), root(match_hash)
+                if first != second:
+                    parent[max(first, second)] = min(first, second)
+
+        groups = {}
+        for file_hash in parent:
+            groups.setdefault(root(file_hash), {root(file_hash)}).add(file_hash)
+        grouped = [file_hash for members in groups.values() for file_hash in members]
+        signatures = {}
+        for start in range(0, len(grouped), 1000):
+            async for record in db.extracted_texts.find({"_id": {"$in": grouped[start:start + 1000]}}, {"minhash": 1}):
+                signatures[record["_id"]] = record["minhash"]
+        return [
+            {file_hash: signatures[file_hash] for file_hash in sorted(members) if file_hash in signatures}
+            for members in groups.values()
+        ]
+
+
+async def near_duplicate_groups(db, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> list:
+    """Groups of documents with near-identical text, oldest document first"""
+    groups = []
+    for cluster in await NearDuplicateIndex.clusters(db, threshold):
+        cursor = db.documents.find(
+            {"content_hash": {"$in": list(cluster)}},
+            {"title": 1, "owner_id": 1, "content_hash": 1, "created_at": 1, "summary": 1, "tags": 1,
+             "near_duplicate_of": 1}
+        ).sort("created_at", 1)
+        documents = await cursor.to_list(length=None)
+        if len(documents) < 2:
+            continue
+        original = documents[0]
+        groups.append({
+            "original_id": str(original["_id"]),
+            "documents": [
+                {
+                    "id": str(document["_id"]),
+                    "title": document["title"],
+                    "owner_id": str(document["owner_id"]),
+                    "created_at": document["created_at"],
+                    "has_summary": bool(document.get("summary")),
+                    "has_tags": bool(document.get("tags")),
+                    "similarity": round(estimate_similarity(
+                        cluster[original["content_hash"]], cluster[document["content_hash"]]
+                    ), 3),
+                    "near_duplicate_of": str(document["near_duplicate_of"]["document_id"])
+                    if document.get("near_duplicate_of") else None
+                }
+                for document in documents
+            ]
+        })
+    return groups
+
+
+async def flag_near_duplicate_groups(db, groups: list) -> int:
+    """Mark every document of a group as a near-duplicate of the group's oldest document"""
+    flagged = 0
+    for group in groups:
+        original_id = group["original_id"]
+        for document in group["documents"][1:]:
+            if document["near_duplicate_of"] == original_id:
+                continue
+            await db.documents.update_one(
+                {"_id": ObjectId(document["id"])},
+                {"$set": {"near_duplicate_of": {
+                    "document_id": ObjectId(original_id),
+                    "similarity": document["similarity"],
+                    "flagged_at": datetime.utcnow()
+                }}}
+            )
+            flagged += 1
+    return flagged
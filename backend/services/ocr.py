@@ -0,0 +1,237 @@
+"""
+OCR pipeline for images and scanned (image-only) PDF pages.
+
+Pages are rasterized, preprocessed (grayscale, deskew, binarization) and
+recognized with Tesseract, one extraction-pool job per page so a scanned
+document uses every core. Results are cached in Mongo by a hash of the
+rasterized page, so a page is only recognized once.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "vie+eng")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Maximum number of pages OCR'd per document, the rest are left without text
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "50"))
+
+# Bump when preprocessing changes so cached results are not reused
+OCR_PIPELINE_VERSION = "1"
+
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+DESKEW_SAMPLE_WIDTH = 800
+
+
+def _otsu_threshold(pixels) -> int:
+    import numpy as np
+
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_background = np.cumsum(histogram)
+    weight_foreground = pixels.size - weight_background
+    sum_background = np.cumsum(levels * histogram)
+    total_sum = sum_background[-1]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_background = sum_background / weight_background
+        mean_foreground = (total_sum - sum_background) / weight_foreground
+        between_variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    return int(np.nanargmax(between_variance))
+
+
+def _estimate_skew(gray) -> float:
+    """Angle that makes text lines horizontal, by maximizing row projection variance"""
+    import numpy as np
+    from PIL import Image
+
+    scale = min(1.0, DESKEW_SAMPLE_WIDTH / gray.width)
+    sample = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))))
+    pixels = np.asarray(sample)
+    ink = Image.fromarray(((pixels < _otsu_threshold(pixels)) * 255).astype(np.uint8))
+
+    best_angle, best_score = 0.0, -1.0
+    angle = -DESKEW_MAX_ANGLE
+    while angle <= DESKEW_MAX_ANGLE:
+        rows = np.asarray(ink.rotate(angle, fillcolor=0)).sum(axis=1, dtype=np.float64)
+        score = rows.var()
+        if score > best_score:
+            best_angle, best_score = angle, score
+        angle += DESKEW_STEP
+    return best_angle
+
+
+def preprocess_image(image):
+    """Grayscale, deskew and binarize an image for Tesseract"""
+    import numpy as np
+    from PIL import Image
+
+    gray = image.convert("L")
+    angle = _estimate_skew(gray)
+    if angle:
+        gray = gray.rotate(angle, expand=True, fillcolor=255)
+    pixels = np.asarray(gray)
+    return Image.fromarray(((pixels > _otsu_threshold(pixels)) * 255).astype(np.uint8))
+
+
+def rasterize_pdf_page(pdf_path: str, page_number: int, output_dir: str, dpi: int = OCR_DPI) -> Optional[dict]:
+    """Render a PDF page to PNG. Returns None for pages without images (blank pages)."""
+    import fitz
+
+    started = time.perf_counter()
+    with fitz.open(pdf_path) as pdf:
+        page = pdf[page_number - 1]
+        if not page.get_images(full=False):
+            return None
+        png = page.get_pixmap(dpi=dpi).tobytes("png")
+
+    image_path = os.path.join(output_dir, f"page-{page_number}.png")
+    with open(image_path, "wb") as f:
+        f.write(png)
+    return {
+        "page": page_number,
+        "image_path": image_path,
+        "page_hash": hashlib.sha256(png).hexdigest(),
+        "rasterize_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def recognize_image(image_path: str, languages: str = OCR_LANGUAGES) -> dict:
+    """Preprocess and OCR one image file, with per-stage timings"""
+    import pytesseract
+    from PIL import Image
+
+    started = time.perf_counter()
+    with Image.open(image_path) as image:
+        prepared = preprocess_image(image)
+    preprocessed = time.perf_counter()
+    text = pytesseract.image_to_string(prepared, lang=languages).strip()
+    return {
+        "text": text,
+        "preprocess_ms": round((preprocessed - started) * 1000, 1),
+        "ocr_ms": round((time.perf_counter() - preprocessed) * 1000, 1),
+    }
+
+
+def _cache_key(page_hash: str) -> str:
+    return f"{page_hash}:{OCR_LANGUAGES}:{OCR_PIPELINE_VERSION}"
+
+
+class OcrPipeline:
+    _stats = {
+        "pages_ocr": 0,
+        "cache_hits": 0,
+        "pages_over_budget": 0,
+        "rasterize_ms": 0.0,
+        "preprocess_ms": 0.0,
+        "ocr_ms": 0.0,
+    }
+
+    @staticmethod
+    async def _cache_collection():
+        from database import get_database
+
+        db = await get_database()
+        return db.ocr_cache if db is not None else None
+
+    @staticmethod
+    async def _recognize_cached(cache, page_hash: str, image_path: str, timings: dict) -> str:
+        from services.extraction_pool import ExtractionPool
+
+        key = _cache_key(page_hash)
+        if cache is not None:
+            cached = await cache.find_one({"_id": key}, {"text": 1})
+            if cached:
+                OcrPipeline._stats["cache_hits"] += 1
+                timings["cached"] = True
+                return cached["text"]
+
+        result = await ExtractionPool.run(recognize_image, image_path, OCR_LANGUAGES)
+        OcrPipeline._stats["pages_ocr"] += 1
+        OcrPipeline._stats["preprocess_ms"] += result["preprocess_ms"]
+        OcrPipeline._stats["ocr_ms"] += result["ocr_ms"]
+        timings.update(preprocess_ms=result["preprocess_ms"], ocr_ms=result["ocr_ms"], cached=False)
+
+        if cache is not None:
+            await cache.update_one(
+                {"_id": key},
+                {"$setOnInsert": {"text": result["text"], "timings": timings, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+        return result["text"]
+
+    @staticmethod
+    async def ocr_pdf_pages(pdf_path: str, page_numbers: List[int]) -> Dict[int, str]:
+        """OCR image-only PDF pages in parallel. Returns {page_number: text}.
+
+        Pages go through the extraction pool a few at a time, no more than
+        it has room for, so a long scanned document does not fill its queue.
+        """
+        from services.extraction_pool import ExtractionPool, EXTRACTION_WORKERS
+
+        if len(page_numbers) > OCR_MAX_PAGES:
+            OcrPipeline._stats["pages_over_budget"] += len(page_numbers) - OCR_MAX_PAGES
+            page_numbers = page_numbers[:OCR_MAX_PAGES]
+
+        cache = await OcrPipeline._cache_collection()
+        semaphore = asyncio.Semaphore(max(1, min(EXTRACTION_WORKERS, ExtractionPool.free_slots())))
+        errors = []
+
+        async def ocr_page(number: int, output_dir: str) -> Optional[tuple]:
+            async with semaphore:
+                # Pages still waiting are not started once one has failed
+                if errors:
+                    return None
+                try:
+                    page = await ExtractionPool.run(rasterize_pdf_page, pdf_path, number, output_dir)
+                    if not page:
+                        return None
+                    OcrPipeline._stats["rasterize_ms"] += page["rasterize_ms"]
+                    timings = {"page": page["page"], "rasterize_ms": page["rasterize_ms"]}
+                    text = await OcrPipeline._recognize_cached(cache, page["page_hash"], page["image_path"], timings)
+                    return page["page"], text
+                except Exception as e:
+                    errors.append(e)
+                    raise
+
+        with tempfile.TemporaryDirectory(prefix="ocr-") as output_dir:
+            tasks = [asyncio.ensure_future(ocr_page(number, output_dir)) for number in page_numbers]
+            try:
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                # Every page is finished or cancelled before its images are deleted
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        if errors:
+            raise errors[0]
+        return dict(result for result in results if result)
+
+    @staticmethod
+    async def ocr_image(image_path: str) -> str:
+        """OCR a single image file, cached by its content hash"""
+        with open(image_path, "rb") as f:
+            page_hash = hashlib.sha256(f.read()).hexdigest()
+        cache = await OcrPipeline._cache_collection()
+        return await OcrPipeline._recognize_cached(cache, page_hash, image_path, {"page": 1})
+
+    @staticmethod
+    def stats() -> dict:
+        stats = OcrPipeline._stats
+        recognized = stats["pages_ocr"] or 1
+        return {
+            "languages": OCR_LANGUAGES,
+            "page_budget": OCR_MAX_PAGES,
+            "pages_ocr": stats["pages_ocr"],
+            "cache_hits": stats["cache_hits"],
+            "pages_over_budget": stats["pages_over_budget"],
+            "avg_rasterize_ms": round(stats["rasterize_ms"] / recognized, 1),
+            "avg_preprocess_ms": round(stats["preprocess_ms"] / recognized, 1),
+            "avg_ocr_ms": round(stats["ocr_ms"] / recognized, 1),
+        }
@@ -0,0 +1,92 @@
+"""
+Passage index for question answering.
+
+Extracted texts are cut into passages of about ``PASSAGE_CHARS`` characters
+along block boundaries, never across pages, and stored in the ``passages``
+collection under a full-text index. Like the text store, passages are keyed
+by content hash: identical files share them and permissions are applied at
+query time through the documents that reference the hash.
+"""
+
+import re
+from typing import List, Tuple
+
+from services.extraction import StructuredDocument
+
+PASSAGE_INDEX_VERSION = 1
+PASSAGE_CHARS = 1200
+# Blocks longer than a passage are cut at sentence ends where possible
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+
+def _split_long_block(text: str) -> List[str]:
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > PASSAGE_CHARS:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:PASSAGE_CHARS])
+            sentence = sentence[PASSAGE_CHARS:]
+        if current and len(current) + len(sentence) + 1 > PASSAGE_CHARS:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def build_passages(structured: StructuredDocument) -> List[Tuple[int, str]]:
+    """(page_number, text) passages of a document in reading order"""
+    passages = []
+    for number, blocks in structured.page_blocks():
+        current = ""
+        for _, text in blocks:
+            text = text.strip()
+            if not text:
+                continue
+            for piece in _split_long_block(text) if len(text) > PASSAGE_CHARS else [text]:
+                if current and len(current) + len(piece) + 1 > PASSAGE_CHARS:
+                    passages.append((number, current))
+                    current = ""
+                current = f"{current}\n{piece}" if current else piece
+        if current:
+            passages.append((number, current))
+    return passages
+
+
+class PassageIndex:
+    @staticmethod
+    async def add(db, file_hash: str, structured: StructuredDocument) -> int:
+        """Index the passages of an extracted text. Returns the number of passages."""
+        passages = build_passages(structured)
+        await db.passages.delete_many({"content_hash": file_hash})
+        if passages:
+            await db.passages.insert_many([
+                {
+                    "_id": f"{file_hash}:{ordinal}",
+                    "content_hash": file_hash,
+                    "ordinal": ordinal,
+                    "page": page,
+                    "text": text,
+                }
+                for ordinal, (page, text) in enumerate(passages)
+            ])
+        await db.extracted_texts.update_one(
+            {"_id": file_hash}, {"$set": {"passages_version": PASSAGE_INDEX_VERSION}}
+        )
+        return len(passages)
+
+    @staticmethod
+    async def remove(db, file_hash: str):
+        await db.passages.delete_many({"content_hash": file_hash})
+
+    @staticmethod
+    async def search(db, query: str, limit: int) -> List[dict]:
+        """Best matching passages of any document, with their text score"""
+        cursor = db.passages.find(
+            {"$text": {"$search": query}},
+            {"content_hash": 1, "page": 1, "text": 1, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+        return await cursor.to_list(length=limit)
@@ -0,0 +1,206 @@
+"""
+Question answering over the document corpus.
+
+The question is matched against the passage index, passages of documents the
+user may not open are dropped, and the best ones are packed into a context of
+at most ``ASK_CONTEXT_TOKENS`` tokens. The LLM answers from that context only
+and refers to the passages as [n], which become citations with document id
+and page.
+
+Repeated questions are cheap. The ids and scores of the passages the index
+returns are kept in memory per normalized question for
+``ASK_RETRIEVAL_TTL_SECONDS``; which of them the user may see, and their text,
+is looked up on every request, so a deleted or hidden document drops out
+immediately. Answers are cached in the LLM cache per question and passage set,
+so a document that changes what is retrieved also changes the answer.
+"""
+
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from models import VisibilityLevel
+from services.ai_service import estimate_tokens
+from services.llm_cache import LLMCache, make_key
+from services.llm_client import LLMClient, LLM_MODEL
+from services.passage_index import PassageIndex
+
+ASK_PROMPT_VERSION = "1"
+ASK_CONTEXT_TOKENS = int(os.getenv("ASK_CONTEXT_TOKENS", "3000"))
+ASK_ANSWER_TOKENS = 600
+ASK_MAX_PASSAGES = 8
+# Passages fetched from the index before the permission filter
+ASK_CANDIDATES = 100
+ASK_RETRIEVAL_TTL_SECONDS = int(os.getenv("ASK_RETRIEVAL_TTL_SECONDS", "300"))
+RETRIEVAL_CACHE_SIZE = 1000
+
+NO_PASSAGES_ANSWER = "Không tìm thấy tài liệu nào liên quan đến câu hỏi này."
+
+
+def normalize_question(question: str) -> str:
+    """Case, punctuation and spacing do not make a different question"""
+    return " ".join(re.findall(r"\w+", unicodedata.normalize("NFC", question.lower())))
+
+
+def permission_query(user) -> dict:
+    """Documents a user may open: their own, public ones and those shared with their group"""
+    allowed = [{"owner_id": user.id}, {"visibility": VisibilityLevel.PUBLIC}]
+    if user.group:
+        allowed.append({"visibility": VisibilityLevel.GROUP, "group": user.group})
+    return {"$or": allowed}
+
+
+class QuestionAnswering:
+    _retrieval_cache: "OrderedDict[str, tuple]" = OrderedDict()
+    _stats = {
+        "questions": 0,
+        "retrieval_cache_hits": 0,
+        "answer_cache_hits": 0,
+        "unanswered": 0,
+    }
+
+    @classmethod
+    def _cache_get(cls, key: str):
+        entry = cls._retrieval_cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        cls._retrieval_cache.move_to_end(key)
+        return entry[1]
+
+    @classmethod
+    def _cache_put(cls, key: str, value):
+        cls._retrieval_cache[key] = (time.monotonic() + ASK_RETRIEVAL_TTL_SECONDS, value)
+        cls._retrieval_cache.move_to_end(key)
+        while len(cls._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            cls._retrieval_cache.popitem(last=False)
+
+    @staticmethod
+    async def _visible_passages(db, candidates: List[dict], query: dict) -> List[dict]:
+        """Candidates whose text belongs to a document matching ``query``, with their text and that document's id and title"""
+        hashes = list({candidate["content_hash"] for candidate in candidates})
+        cursor = db.documents.find({"$and": [{"content_hash": {"$in": hashes}}, query]}, {"title": 1, "content_hash": 1})
+        documents = {}
+        async for document in cursor:
+            documents.setdefault(document["content_hash"], document)
+        visible = [candidate for candidate in candidates if candidate["content_hash"] in documents]
+        if not visible:
+            return []
+
+        cursor = db.passages.find({"_id": {"$in": [candidate["_id"] for candidate in visible]}}, {"page": 1, "text": 1})
+        texts = {passage["_id"]: passage async for passage in cursor}
+        return [
+            {
+                "passage_id": candidate["_id"],
+                "document_id": str(documents[candidate["content_hash"]]["_id"]),
+                "title": documents[candidate["content_hash"]]["title"],
+                "page": texts[candidate["_id"]]["page"],
+                "text": texts[candidate["_id"]]["text"],
+                "score": candidate["score"],
+            }
+            for candidate in visible if candidate["_id"] in texts
+        ]
+
+    @classmethod
+    async def retrieve(cls, db, user, question: str) -> List[dict]:
+        """Best passages of documents the user may open, best first"""
+        question_key = normalize_question(question)
+        candidates = cls._cache_get(question_key)
+        if candidates is not None:
+            cls._stats["retrieval_cache_hits"] += 1
+        else:
+            # Only ids and scores are kept, permissions and text are read again on every request
+            found = await PassageIndex.search(db, question_key, ASK_CANDIDATES)
+            candidates = [
+                {"_id": passage["_id"], "content_hash": passage["content_hash"], "score": passage["score"]}
+                for passage in found
+            ]
+            cls._cache_put(question_key, candidates)
+        if not candidates:
+            return []
+        return await cls._visible_passages(db, candidates, permission_query(user))
+
+    @staticmethod
+    def pack_context(passages: List[dict]) -> Tuple[str, List[dict]]:
+        """Number and join the best passages that fit the token budget"""
+        used, parts, tokens = [], [], 0
+        for passage in passages:
+            part = f"[{len(used) + 1}] ({passage['title']}, trang {passage['page']})\n{passage['text']}"
+            cost = estimate_tokens(part)
+            if tokens + cost > ASK_CONTEXT_TOKENS:
+                continue
+            used.append(passage)
+            parts.append(part)
+            tokens += cost
+            if len(used) >= ASK_MAX_PASSAGES:
+                break
+        return "\n\n".join(parts), used
+
+    @staticmethod
+    def citations(answer: str, used: List[dict]) -> List[dict]:
+        """The passages an answer refers to as [n], all of them when it names none"""
+        numbers = sorted({int(number) for number in re.findall(r"\[(\d+)\]", answer) if 1 <= int(number) <= len(used)})
+        return [
+            {
+                "number": number,
+                "document_id": used[number - 1]["document_id"],
+                "title": used[number - 1]["title"],
+                "page": used[number - 1]["page"],
+                "passage_id": used[number - 1]["passage_id"],
+            }
+            for number in numbers or range(1, len(used) + 1)
+        ]
+
+    @classmethod
+    async def ask(cls, db, user, question: str) -> dict:
+        cls._stats["questions"] += 1
+        passages = await cls.retrieve(db, user, question)
+        context, used = cls.pack_context(passages)
+        if not used:
+            cls._stats["unanswered"] += 1
+            return {"question": question, "answer": NO_PASSAGES_ANSWER, "citations": [], "cached": False}
+
+        cache_key = make_key(
+            LLM_MODEL, "ask", ASK_PROMPT_VERSION,
+            {"max_tokens": ASK_ANSWER_TOKENS, "temperature": 0.2, "passages": [p["passage_id"] for p in used]},
+            normalize_question(question)
+        )
+        answer: Optional[str] = await LLMCache.get(cache_key)
+        cached = answer is not None
+        if cached:
+            cls._stats["answer_cache_hits"] += 1
+        else:
+            answer = await LLMClient.chat(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "Bạn là trợ lý trả lời câu hỏi dựa trên tài liệu nội bộ. Chỉ dùng thông tin trong các "
+                            "đoạn trích được cung cấp. Ghi số đoạn trích đã dùng trong ngoặc vuông, ví dụ [1]. "
+                            "Nếu các đoạn trích không có câu trả lời, hãy nói rõ là không tìm thấy."
+                        ),
+                    },
+                    {"role": "user", "content": f"Các đoạn trích:\n\n{context}\n\nCâu hỏi: {question}"},
+                ],
+                max_tokens=ASK_ANSWER_TOKENS,
+                temperature=0.2
+            )
+            if answer:
+                await LLMCache.put(cache_key, answer, "ask")
+
+        return {
+            "question": question,
+            "answer": answer,
+            "citations": cls.citations(answer, used),
+            "cached": cached,
+        }
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            **cls._stats,
+            "retrieval_cache_entries": len(cls._retrieval_cache),
+            "context_tokens": ASK_CONTEXT_TOKENS,
+        }
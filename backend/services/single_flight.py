@@ -0,0 +1,55 @@
+"""
+Request coalescing: concurrent identical computations run once.
+
+The first caller for a key (operation, content key, parameters) starts the
+computation as its own task; callers arriving while it runs wait for the same
+task and get the same result or exception. The task is shielded, so a caller
+that goes away (a closed connection) does not cancel the work for the
+others. Coalescing is per process; the text store and the LLM cache share
+results across processes once the first computation is done.
+"""
+
+import json
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class SingleFlight:
+    _in_flight: Dict[tuple, asyncio.Task] = {}
+    _stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _key(operation: str, content_key: str, params: Optional[dict]) -> tuple:
+        return operation, content_key, json.dumps(params or {}, sort_keys=True, default=str)
+
+    @classmethod
+    def _forget(cls, key: tuple, task: asyncio.Task):
+        if cls._in_flight.get(key) is task:
+            del cls._in_flight[key]
+        # Mark the exception as retrieved when every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    @classmethod
+    async def run(cls, operation: str, content_key: str, params: Optional[dict],
+                  compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return ``await compute()``, sharing one run between concurrent identical calls"""
+        key = cls._key(operation, content_key, params)
+        stats = cls._stats.setdefault(operation, {"started": 0, "coalesced": 0})
+        task = cls._in_flight.get(key)
+        if task is None:
+            stats["started"] += 1
+            task = asyncio.ensure_future(compute())
+            cls._in_flight[key] = task
+            task.add_done_callback(lambda finished: cls._forget(key, finished))
+        else:
+            stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "in_flight": len(cls._in_flight),
+            "operations": {operation: dict(stats) for operation, stats in cls._stats.items()},
+            "coalesced": sum(stats["coalesced"] for stats in cls._stats.values()),
+        }
@@ -0,0 +1,84 @@
+import os
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+import aiofiles
+
+from services.text_store import content_hash
+
+# Files analyzed by /ai/analyze-file wait here until they are uploaded or expire
+STAGING_DIR = os.getenv("STAGING_DIR", os.path.join("uploads", "staging"))
+STAGING_TTL_MINUTES = int(os.getenv("STAGING_TTL_MINUTES", "60"))
+
+
+class StagingArea:
+    @staticmethod
+    async def stage_file(db, owner_id, filename: str, content: bytes) -> dict:
+        """Write an uploaded file to the staging area and record it with an expiry"""
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        await asyncio.to_thread(StagingArea.purge_expired_files)
+
+        staging_id = str(uuid.uuid4())
+        file_extension = filename.split('.')[-1].lower()
+        file_path = os.path.join(STAGING_DIR, f"{staging_id}.{file_extension}")
+
+        async with aiofiles.open(file_path, 'wb') as f:
+            await f.write(content)
+
+        record = {
+            "_id": staging_id,
+            "owner_id": owner_id,
+            "filename": filename,
+            "file_path": file_path,
+            "file_extension": file_extension,
+            "file_size": len(content),
+            "content_hash": content_hash(content),
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(minutes=STAGING_TTL_MINUTES),
+        }
+        await db.staged_uploads.insert_one(record)
+        return record
+
+    @staticmethod
+    async def save_analysis(db, staging_id: str, summary: str, tags: list):
+        """Keep the AI results next to the staged file, its text is in the text store"""
+        await db.staged_uploads.update_one(
+            {"_id": staging_id},
+            {"$set": {"summary": summary, "tags": tags}}
+        )
+
+    @staticmethod
+    async def claim(db, staging_id: str, owner_id) -> Optional[dict]:
+        """Take a staged upload out of the staging area.
+
+        The record is deleted atomically so a staging id can only be used once.
+        Returns None if the id is unknown, expired, belongs to another user, or
+        its file has already been purged.
+        """
+        record = await db.staged_uploads.find_one_and_delete({
+            "_id": staging_id,
+            "owner_id": owner_id,
+            "expires_at": {"$gt": datetime.utcnow()},
+        })
+        if not record or not os.path.exists(record["file_path"]):
+            return None
+        return record
+
+    @staticmethod
+    def purge_expired_files():
+        """Remove staged files older than the TTL.
+
+        Mongo's TTL index only removes the records, the blobs are cleaned up here.
+        """
+        if not os.path.isdir(STAGING_DIR):
+            return
+        cutoff = time.time() - STAGING_TTL_MINUTES * 60
+        for entry in os.scandir(STAGING_DIR):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
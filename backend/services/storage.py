@@ -0,0 +1,120 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator
+
+import zstandard
+
+# Storage tiers tracked on each document record
+HOT_TIER = "hot"
+COLD_TIER = "cold"
+
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", os.path.join("uploads", "cold"))
+ZSTD_LEVEL = int(os.getenv("COLD_STORAGE_ZSTD_LEVEL", "10"))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class DocumentStorage:
+    @staticmethod
+    def get_tier(document: dict) -> str:
+        """Return the storage tier of a document record (legacy records are hot)"""
+        return document.get("storage_tier") or HOT_TIER
+
+    @staticmethod
+    def cold_path_for(file_path: str) -> str:
+        """Location of the compressed copy of an uploaded file"""
+        return os.path.join(COLD_STORAGE_DIR, os.path.basename(file_path) + ".zst")
+
+    @staticmethod
+    def exists(document: dict) -> bool:
+        """Check that the stored file of a document is present in its tier"""
+        if not document.get("file_path"):
+            return False
+        if DocumentStorage.get_tier(document) == COLD_TIER:
+            return bool(document.get("cold_path")) and os.path.exists(document["cold_path"])
+        return os.path.exists(document["file_path"])
+
+    @staticmethod
+    def iter_content(document: dict) -> Iterator[bytes]:
+        """Yield the original file bytes, decompressing cold documents on the fly"""
+        if DocumentStorage.get_tier(document) == COLD_TIER:
+            decompressor = zstandard.ZstdDecompressor()
+            with open(document["cold_path"], "rb") as f:
+                with decompressor.stream_reader(f) as reader:
+                    while True:
+                        chunk = reader.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        yield chunk
+        else:
+            with open(document["file_path"], "rb") as f:
+                while True:
+                    chunk = f.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    @staticmethod
+    @asynccontextmanager
+    async def local_copy(document: dict) -> AsyncIterator[str]:
+        """Yield a filesystem path holding the original file.
+
+        Hot documents use their file directly; cold documents are decompressed,
+        in a thread off the event loop, into a temporary file that is removed
+        afterwards. Used where the reader runs in another process and needs a
+        path rather than a stream.
+        """
+        if DocumentStorage.get_tier(document) != COLD_TIER:
+            yield document["file_path"]
+            return
+
+        suffix = "." + document["file_path"].split('.')[-1]
+        with tempfile.NamedTemporaryFile(suffix=suffix) as temp_file:
+            def write_copy():
+                for chunk in DocumentStorage.iter_content(document):
+                    temp_file.write(chunk)
+                temp_file.flush()
+
+            await asyncio.to_thread(write_copy)
+            yield temp_file.name
+
+    @staticmethod
+    async def content_hash(document: dict) -> str:
+        """SHA-256 of the original file bytes (as ``text_store.content_hash``), computed in a thread"""
+        def digest():
+            sha256 = hashlib.sha256()
+            for chunk in DocumentStorage.iter_content(document):
+                sha256.update(chunk)
+            return sha256.hexdigest()
+
+        return await asyncio.to_thread(digest)
+
+    @staticmethod
+    def compress_to_cold(file_path: str) -> str:
+        """Write a zstd-compressed copy of a hot file and return its path.
+
+        The copy is written to a ``.part`` file and renamed into place, so an
+        interrupted move never leaves a truncated cold file behind and can
+        simply be started again.
+        """
+        os.makedirs(COLD_STORAGE_DIR, exist_ok=True)
+        cold_path = DocumentStorage.cold_path_for(file_path)
+        part_path = cold_path + ".part"
+
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, write_checksum=True)
+        with open(file_path, "rb") as src, open(part_path, "wb") as dst:
+            compressor.copy_stream(src, dst, read_size=STREAM_CHUNK_SIZE, write_size=STREAM_CHUNK_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        os.replace(part_path, cold_path)
+        return cold_path
+
+    @staticmethod
+    def remove(document: dict) -> None:
+        """Delete every stored copy of a document's file"""
+        for path in (document.get("file_path"), document.get("cold_path")):
+            if path and os.path.exists(path):
+                os.remove(path)
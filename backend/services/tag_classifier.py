@@ -0,0 +1,262 @@
+"""
+Local tag classifier: TF-IDF features and one-vs-rest logistic regression in
+NumPy, trained offline from already tagged documents (train_tag_classifier.py).
+
+Prediction takes milliseconds. Callers only fall back to the LLM when the
+classifier is not confident, and a small sample of confident predictions is
+also sent to the LLM to keep track of how often the two agree.
+"""
+
+import os
+import re
+import json
+import math
+import random
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Tags documents are classified into
+ALLOWED_TAGS = [
+    "ATM", "dịch vụ khách hàng", "sự cố", "tín dụng", "doanh nghiệp",
+    "quy định", "onboarding", "IT", "quy trình", "core banking",
+]
+
+TAG_MODEL_PATH = os.getenv(
+    "TAG_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "tag_classifier.npz")
+)
+# Below this confidence the LLM is asked instead
+TAG_CONFIDENCE_THRESHOLD = float(os.getenv("TAG_CONFIDENCE_THRESHOLD", "0.7"))
+# Share of confident predictions also checked against the LLM
+TAG_SHADOW_SAMPLE_RATE = float(os.getenv("TAG_SHADOW_SAMPLE_RATE", "0.05"))
+TAG_ACCEPT_PROBABILITY = 0.5
+MAX_TAGS = 3
+
+MAX_FEATURES = 10000
+MIN_DOCUMENT_FREQUENCY = 2
+MAX_TEXT_CHARS = 20000
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased syllables plus syllable bigrams, Vietnamese words are mostly two syllables"""
+    words = re.findall(r"\w+", unicodedata.normalize("NFC", text[:MAX_TEXT_CHARS].lower()))
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def _sigmoid(values: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(values, -30, 30)))
+
+
+class TagModel:
+    def __init__(self, vocabulary: List[str], idf: np.ndarray, weights: np.ndarray, bias: np.ndarray,
+                 labels: List[str], metadata: Optional[dict] = None):
+        self.vocabulary = vocabulary
+        self.index = {term: position for position, term in enumerate(vocabulary)}
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.labels = labels
+        self.metadata = metadata or {}
+
+    def vectorize(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized TF-IDF rows"""
+        matrix = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term, count in Counter(tokenize(text)).items():
+                column = self.index.get(term)
+                if column is not None:
+                    matrix[row, column] = (1.0 + math.log(count)) * self.idf[column]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def probabilities(self, texts: List[str]) -> np.ndarray:
+        return _sigmoid(self.vectorize(texts) @ self.weights + self.bias)
+
+    def predict(self, text: str) -> Tuple[List[str], float, Dict[str, float]]:
+        """Return (tags, confidence, probability per tag).
+
+        Confidence is how far the closest decision was from the boundary: the
+        lowest probability among the chosen tags, or one minus the highest
+        among the others. No tag at all counts as not confident.
+        """
+        probabilities = self.probabilities([text])[0]
+        order = np.argsort(-probabilities)
+        chosen = [int(i) for i in order[:MAX_TAGS] if probabilities[i] >= TAG_ACCEPT_PROBABILITY]
+        others = [int(i) for i in order if int(i) not in chosen]
+
+        if not chosen:
+            confidence = 0.0
+        else:
+            confidence = float(min(probabilities[i] for i in chosen))
+            if others:
+                confidence = min(confidence, float(1.0 - probabilities[others[0]]))
+        scores = {label: round(float(p), 4) for label, p in zip(self.labels, probabilities)}
+        return [self.labels[i] for i in chosen], confidence, scores
+
+    @classmethod
+    def train(cls, texts: List[str], tag_lists: List[List[str]], labels: List[str],
+              epochs: int = 300, learning_rate: float = 2.0, l2: float = 1e-4) -> "TagModel":
+        """Fit vocabulary, IDF and one logistic regression per label with full-batch gradient descent"""
+        document_frequency = Counter()
+        for text in texts:
+            document_frequency.update(set(tokenize(text)))
+        vocabulary = [
+            term for term, frequency in document_frequency.most_common(MAX_FEATURES)
+            if frequency >= MIN_DOCUMENT_FREQUENCY
+        ]
+        idf = np.array(
+            [math.log((1 + len(texts)) / (1 + document_frequency[term])) + 1.0 for term in vocabulary],
+            dtype=np.float32
+        )
+
+        model = cls(vocabulary, idf, np.zeros((len(vocabulary), len(labels)), dtype=np.float32),
+                    np.zeros(len(labels), dtype=np.float32), labels)
+        features = model.vectorize(texts)
+        targets = np.array([[label in tags for label in labels] for tags in tag_lists], dtype=np.float32)
+
+        for _ in range(epochs):
+            errors = _sigmoid(features @ model.weights + model.bias) - targets
+            model.weights -= learning_rate * (features.T @ errors / len(texts) + l2 * model.weights)
+            model.bias -= learning_rate * errors.mean(axis=0)
+        return model
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        part_path = path + ".part.npz"
+        np.savez_compressed(
+            part_path,
+            vocabulary=np.array(self.vocabulary, dtype=object),
+            idf=self.idf,
+            weights=self.weights,
+            bias=self.bias,
+            labels=np.array(self.labels, dtype=object),
+            metadata=np.array(json.dumps(self.metadata, ensure_ascii=False, default=str)),
+        )
+        os.replace(part_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TagModel":
+        with np.load(path, allow_pickle=True) as data:
+            return cls(
+                list(data["vocabulary"]), data["idf"], data["weights"], data["bias"],
+                list(data["labels"]), json.loads(str(data["metadata"]))
+            )
+
+
+def tag_overlap(first: List[str], second: List[str]) -> float:
+    """Jaccard similarity of two tag lists, case-insensitive"""
+    first, second = {tag.lower() for tag in first}, {tag.lower() for tag in second}
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+class TagClassifier:
+    _model: Optional[TagModel] = None
+    _loaded_mtime: Optional[float] = None
+    _stats = {
+        "requests": 0,
+        "classifier_answers": 0,
+        "llm_fallbacks": 0,
+        "shadow_checks": 0,
+        "shadow_overlap_sum": 0.0,
+        "fallback_overlap_sum": 0.0,
+        "fallback_compared": 0,
+    }
+
+    @classmethod
+    def get_model(cls) -> Optional[TagModel]:
+        """The trained model, reloaded when the file is replaced by a new training run"""
+        try:
+            mtime = os.path.getmtime(TAG_MODEL_PATH)
+        except OSError:
+            return None
+        if cls._model is None or mtime != cls._loaded_mtime:
+            cls._model = TagModel.load(TAG_MODEL_PATH)
+            cls._loaded_mtime = mtime
+            print(f"Loaded tag classifier trained at {cls._model.metadata.get('trained_at')}")
+        return cls._model
+
+    @classmethod
+    def classify(cls, text: str, allowed: Optional[List[str]] = None) -> Optional[Tuple[List[str], float]]:
+        """Return (tags, confidence), or None when no model is trained or it does not know the allowed tags.
+
+        Tags are returned in the spelling of ``allowed`` (``ALLOWED_TAGS`` by default).
+        """
+        model = cls.get_model()
+        allowed = allowed or ALLOWED_TAGS
+        if model is None:
+            return None
+        by_label = {tag.lower(): tag for tag in allowed}
+        if not set(by_label) <= set(model.labels):
+            return None
+        tags, confidence, _ = model.predict(text)
+        return [by_label[tag] for tag in tags if tag in by_label], confidence
+
+    @classmethod
+    def should_shadow_check(cls) -> bool:
+        return random.random() < TAG_SHADOW_SAMPLE_RATE
+
+    @classmethod
+    def record(cls, used_classifier: bool, predicted: Optional[List[str]] = None, llm_tags: Optional[List[str]] = None,
+               shadow: bool = False):
+        """Track classifier use and, where the LLM also answered, how much the two agree"""
+        stats = cls._stats
+        if shadow:
+            stats["shadow_checks"] += 1
+            stats["shadow_overlap_sum"] += tag_overlap(predicted or [], llm_tags or [])
+            return
+        stats["requests"] += 1
+        if used_classifier:
+            stats["classifier_answers"] += 1
+            return
+        stats["llm_fallbacks"] += 1
+        if predicted is not None and llm_tags is not None:
+            stats["fallback_compared"] += 1
+            stats["fallback_overlap_sum"] += tag_overlap(predicted, llm_tags)
+
+    @classmethod
+    def stats(cls) -> dict:
+        stats = cls._stats
+        model = cls._model
+        return {
+            "model_loaded": model is not None,
+            "trained_at": model.metadata.get("trained_at") if model else None,
+            "training_evaluation": model.metadata.get("evaluation") if model else None,
+            "confidence_threshold": TAG_CONFIDENCE_THRESHOLD,
+            "requests": stats["requests"],
+            "classifier_answers": stats["classifier_answers"],
+            "llm_fallbacks": stats["llm_fallbacks"],
+            "llm_call_rate": round(stats["llm_fallbacks"] / stats["requests"], 3) if stats["requests"] else 0.0,
+            # Agreement with the LLM on confident predictions (sampled) and on fallbacks
+            "shadow_checks": stats["shadow_checks"],
+            "confident_agreement": round(stats["shadow_overlap_sum"] / stats["shadow_checks"], 3)
+            if stats["shadow_checks"] else None,
+            "fallback_agreement": round(stats["fallback_overlap_sum"] / stats["fallback_compared"], 3)
+            if stats["fallback_compared"] else None,
+        }
+
+
+def evaluate(model: TagModel, texts: List[str], tag_lists: List[List[str]],
+             thresholds: Tuple[float, ...] = (0.5, 0.6, 0.7, 0.8, 0.9)) -> dict:
+    """Quality of confident predictions against the share of documents left to the LLM, per threshold"""
+    predictions = [model.predict(text)[:2] for text in texts]
+    report = {"documents": len(texts), "thresholds": {}}
+    for threshold in thresholds:
+        confident = [(tags, expected) for (tags, confidence), expected in zip(predictions, tag_lists)
+                     if confidence >= threshold]
+        report["thresholds"][str(threshold)] = {
+            "llm_call_rate": round(1 - len(confident) / len(texts), 3) if texts else 0.0,
+            "overlap_when_confident": round(
+                sum(tag_overlap(tags, expected) for tags, expected in confident) / len(confident), 3
+            ) if confident else None,
+        }
+    report["overlap_all"] = round(
+        sum(tag_overlap(tags, expected) for (tags, _), expected in zip(predictions, tag_lists)) / len(texts), 3
+    ) if texts else None
+    report["evaluated_at"] = datetime.utcnow().isoformat()
+    return report
@@ -0,0 +1,250 @@
+import re
+import json
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+import zstandard
+
+from services.ai_service import AIService
+from services.extraction import StructuredDocument, EXTRACTION_VERSION
+from services.near_duplicates import NearDuplicateIndex, MINHASH_VERSION
+from services.ocr import OCR_PIPELINE_VERSION
+from services.passage_index import PassageIndex, PASSAGE_INDEX_VERSION
+from services.single_flight import SingleFlight
+
+# Leading part of the text kept uncompressed for the full-text index used by search
+SEARCH_TEXT_MAX_CHARS = 50000
+
+# Extraction status tracked on document records
+EXTRACTION_DONE = "done"
+EXTRACTION_FAILED = "failed"
+
+# Parsers and OCR a stored text was produced with
+TEXT_PIPELINE_VERSION = f"{EXTRACTION_VERSION}.{OCR_PIPELINE_VERSION}"
+# Near-duplicate signature and passages derived from a stored text
+TEXT_INDEX_VERSION = f"{MINHASH_VERSION}.{PASSAGE_INDEX_VERSION}"
+
+
+def content_hash(content: bytes) -> str:
+    """Hash identifying a file's bytes, shared by identical uploads"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class TextStore:
+    @staticmethod
+    def build_record(file_hash: str, structured: StructuredDocument) -> dict:
+        """Build the extracted_texts record for a file hash"""
+        compressor = zstandard.ZstdCompressor()
+        text = structured.text
+        return {
+            "_id": file_hash,
+            "file_type": structured.file_type,
+            "text": compressor.compress(text.encode("utf-8")),
+            "layout": compressor.compress(json.dumps(structured.to_layout()).encode("utf-8")),
+            "length": len(text),
+            "page_count": len(structured.pages),
+            # Page offset index, lets page requests slice the text without the full layout
+            "page_offsets": [[page.start, page.end] for page in structured.pages],
+            "search_text": re.sub(r'\s+', ' ', text[:SEARCH_TEXT_MAX_CHARS]).strip(),
+            "pipeline_version": TEXT_PIPELINE_VERSION,
+            "created_at": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def decode_record(record: dict) -> str:
+        return zstandard.ZstdDecompressor().decompress(record["text"]).decode("utf-8")
+
+    @staticmethod
+    def decode_structured(record: dict) -> StructuredDocument:
+        decompressor = zstandard.ZstdDecompressor()
+        layout = json.loads(decompressor.decompress(record["layout"])) if record.get("layout") else []
+        return StructuredDocument.from_layout(record.get("file_type", ""), TextStore.decode_record(record), layout)
+
+    @staticmethod
+    async def get(db, file_hash: Optional[str]) -> Optional[str]:
+        """Return the stored text for a file hash, or None if it was never extracted"""
+        if not file_hash:
+            return None
+        record = await db.extracted_texts.find_one({"_id": file_hash}, {"text": 1})
+        if not record:
+            return None
+        return TextStore.decode_record(record)
+
+    @staticmethod
+    async def exists(db, file_hash: Optional[str]) -> bool:
+        if not file_hash:
+            return False
+        return await db.extracted_texts.find_one({"_id": file_hash}, {"_id": 1}) is not None
+
+    @staticmethod
+    async def get_structured(db, file_hash: Optional[str]) -> Optional[StructuredDocument]:
+        """Return the stored text with its page and block offsets"""
+        if not file_hash:
+            return None
+        record = await db.extracted_texts.find_one(
+            {"_id": file_hash}, {"search_text": 0, "minhash": 0, "minhash_bands": 0}
+        )
+        if not record:
+            return None
+        return TextStore.decode_structured(record)
+
+    @staticmethod
+    async def get_pages(db, file_hash: Optional[str], first: int, last: Optional[int]) -> Optional[tuple]:
+        """Return (page_count, [(page_number, text), ...]) for a page range of a stored file"""
+        if not file_hash:
+            return None
+        record = await db.extracted_texts.find_one({"_id": file_hash}, {"text": 1, "page_offsets": 1, "layout": 1})
+        if not record:
+            return None
+        if "page_offsets" in record:
+            text = TextStore.decode_record(record)
+            offsets = record["page_offsets"]
+        else:
+            structured = TextStore.decode_structured(record)
+            text = structured.text
+            offsets = [[page.start, page.end] for page in structured.pages]
+        last = min(last or len(offsets), len(offsets))
+        pages = [(number, text[offsets[number - 1][0]:offsets[number - 1][1]]) for number in range(first, last + 1)]
+        return len(offsets), pages
+
+    @staticmethod
+    async def put(db, file_hash: str, structured: StructuredDocument, replace: bool = False):
+        """Persist an extracted document; identical files are stored once.
+
+        The record gets the near-duplicate signature of its text as well, and
+        its passages are indexed for question answering. An existing record is
+        only overwritten with ``replace`` (re-extraction with newer parsers).
+        """
+        record = TextStore.build_record(file_hash, structured)
+        record.update(await asyncio.to_thread(NearDuplicateIndex.signature_fields, structured.text))
+        if replace:
+            await db.extracted_texts.replace_one({"_id": file_hash}, record, upsert=True)
+            await PassageIndex.add(db, file_hash, structured)
+            return
+        record.pop("_id")
+        result = await db.extracted_texts.update_one(
+            {"_id": file_hash},
+            {"$setOnInsert": record},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            await PassageIndex.add(db, file_hash, structured)
+
+    @staticmethod
+    async def get_or_extract(db, file_hash: str, file_path: str, file_type: str) -> StructuredDocument:
+        """Return the stored extraction of a file, parsing and persisting it on first use.
+
+        Concurrent first uses of the same file share one extraction.
+        """
+        structured = await TextStore.get_structured(db, file_hash)
+        if structured is not None:
+            return structured
+
+        async def extract():
+            extracted = await AIService.extract_structured(file_path, file_type)
+            await TextStore.put(db, file_hash, extracted)
+            return extracted
+
+        return await SingleFlight.run("extract", file_hash, {"file_type": file_type}, extract)
+
+    @staticmethod
+    async def reextract(db, file_hash: str, file_path: str, file_type: str) -> StructuredDocument:
+        """Extract a file again with the current parsers, unless its stored text already is that recent.
+
+        A failed parse comes back as an empty document, so an empty result
+        never replaces a stored text that has content; that raises instead.
+        """
+        record = await db.extracted_texts.find_one({"_id": file_hash}, {"pipeline_version": 1, "length": 1})
+        if record and record.get("pipeline_version") == TEXT_PIPELINE_VERSION:
+            return await TextStore.get_structured(db, file_hash)
+
+        async def extract():
+            extracted = await AIService.extract_structured(file_path, file_type)
+            if not extracted.text.strip() and record and record.get("length"):
+                raise RuntimeError(f"Re-extraction returned no text, keeping the stored text of {file_hash}")
+            await TextStore.put(db, file_hash, extracted, replace=True)
+            return extracted
+
+        return await SingleFlight.run("reextract", file_hash, {"file_type": file_type}, extract)
+
+    @staticmethod
+    async def reindex(db, file_hash: str) -> bool:
+        """Recompute the near-duplicate signature and passages of a stored text if they are outdated.
+
+        Returns False when there is no stored text for the hash.
+        """
+        record = await db.extracted_texts.find_one(
+            {"_id": file_hash}, {"text": 1, "layout": 1, "file_type": 1, "minhash_version": 1, "passages_version": 1}
+        )
+        if not record:
+            return False
+        if record.get("minhash_version") != MINHASH_VERSION:
+            fields = await asyncio.to_thread(NearDuplicateIndex.signature_fields, TextStore.decode_record(record))
+            update = {"$set": fields}
+            if "minhash" not in fields:
+                update["$unset"] = {"minhash": "", "minhash_bands": ""}
+            await db.extracted_texts.update_one({"_id": file_hash}, update)
+        if record.get("passages_version") != PASSAGE_INDEX_VERSION:
+            await PassageIndex.add(db, file_hash, TextStore.decode_structured(record))
+        return True
+
+    @staticmethod
+    async def mark_extraction(db, document_id, error: Optional[Exception] = None):
+        """Record on a document whether its text could be extracted, and why not"""
+        if error is None:
+            await db.documents.update_one(
+                {"_id": document_id},
+                {"$set": {"extraction_status": EXTRACTION_DONE}, "$unset": {"extraction_error": ""}}
+            )
+        else:
+            await db.documents.update_one(
+                {"_id": document_id},
+                {"$set": {"extraction_status": EXTRACTION_FAILED, "extraction_error": str(error)}}
+            )
+
+    @staticmethod
+    async def release(db, file_hash: Optional[str]):
+        """Delete the stored text once no document refers to the file hash anymore"""
+        if not file_hash:
+            return
+        if not await db.documents.find_one({"content_hash": file_hash}, {"_id": 1}):
+            await db.extracted_texts.delete_one({"_id": file_hash})
+            await PassageIndex.remove(db, file_hash)
+
+    @staticmethod
+    async def backfill_signatures(db, limit: int = 500) -> dict:
+        """Add near-duplicate signatures to texts stored before they existed, or with an older version"""
+        query = {"minhash_version": {"$ne": MINHASH_VERSION}}
+        indexed = 0
+        async for record in db.extracted_texts.find(query, {"text": 1}).limit(limit):
+            text = TextStore.decode_record(record)
+            fields = await asyncio.to_thread(NearDuplicateIndex.signature_fields, text)
+            update = {"$set": fields}
+            if "minhash" not in fields:
+                update["$unset"] = {"minhash": "", "minhash_bands": ""}
+            await db.extracted_texts.update_one({"_id": record["_id"]}, update)
+            indexed += 1
+        remaining = await db.extracted_texts.count_documents(query)
+        return {"indexed": indexed, "remaining": remaining}
+
+    @staticmethod
+    async def backfill_passages(db, limit: int = 500) -> dict:
+        """Index the passages of texts stored before the passage index existed, or with an older version"""
+        query = {"passages_version": {"$ne": PASSAGE_INDEX_VERSION}}
+        indexed = 0
+        async for record in db.extracted_texts.find(query, {"text": 1, "layout": 1, "file_type": 1}).limit(limit):
+            await PassageIndex.add(db, record["_id"], TextStore.decode_structured(record))
+            indexed += 1
+        remaining = await db.extracted_texts.count_documents(query)
+        return {"indexed": indexed, "remaining": remaining}
+
+    @staticmethod
+    async def find_matching_hashes(db, query: str, limit: int = 1000) -> list:
+        """Return hashes of files whose text matches a full-text query"""
+        cursor = db.extracted_texts.find(
+            {"$text": {"$search": query}},
+            {"_id": 1, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+        return [record["_id"] async for record in cursor]
@@ -0,0 +1,225 @@
+import os
+import uuid
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import aiofiles
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from services.ai_service import AIService
+from services.chunk_store import ChunkStore
+from services.extraction import processing_type
+from services.storage import DocumentStorage, HOT_TIER
+from services.text_store import TextStore, EXTRACTION_DONE
+
+# Sections shorter than this are used verbatim instead of being summarized
+SECTION_SUMMARY_MIN_CHARS = 400
+SECTION_SUMMARY_MAX_WORDS = 120
+# An upload still marked on the document after this long is assumed dead
+VERSION_UPLOAD_STALE_SECONDS = 600
+
+
+class VersionConflict(Exception):
+    """Raised when another version of the same document is being stored"""
+
+
+def _section_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class DocumentVersioning:
+    @staticmethod
+    async def store_version(db, document_id, version: int, content: bytes, file_extension: str,
+                            created_by, sections: List[dict]) -> dict:
+        """Chunk a file, store its new chunks and record the version"""
+        chunks = await asyncio.to_thread(ChunkStore.split, content)
+        # Referenced first, so a version being deleted cannot remove a chunk this one reuses
+        await ChunkStore.add_references(db, chunks)
+        try:
+            new_chunks = await asyncio.to_thread(ChunkStore.write_chunks, chunks)
+            file_hash = await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+            record = {
+                "document_id": document_id,
+                "version": version,
+                "file_extension": file_extension,
+                "file_size": len(content),
+                "content_hash": file_hash,
+                "chunks": [chunk_hash for chunk_hash, _ in chunks],
+                "new_chunk_count": len(new_chunks),
+                "sections": sections,
+                "created_by": created_by,
+                "created_at": datetime.utcnow(),
+            }
+            result = await db.document_versions.insert_one(record)
+        except DuplicateKeyError:
+            await ChunkStore.release_references(db, [chunk_hash for chunk_hash, _ in chunks])
+            raise VersionConflict("Another version of this document was stored at the same time")
+        except Exception:
+            await ChunkStore.release_references(db, [chunk_hash for chunk_hash, _ in chunks])
+            raise
+        record["_id"] = result.inserted_id
+        return record
+
+    @staticmethod
+    async def get_latest_version(db, document: dict) -> Optional[dict]:
+        """Return the latest version, recording the current file as version 1 for older documents"""
+        latest = await db.document_versions.find_one(
+            {"document_id": document["_id"]}, sort=[("version", -1)]
+        )
+        if latest or not DocumentStorage.exists(document):
+            return latest
+
+        content = await asyncio.to_thread(lambda: b"".join(DocumentStorage.iter_content(document)))
+        file_extension = document["file_path"].split('.')[-1].lower()
+
+        # Section summaries of the original upload are unknown, only their hashes are kept
+        async with DocumentStorage.local_copy(document) as path:
+            structured = await AIService.extract_structured(path, processing_type(file_extension))
+        texts = AIService.sections_from_structured(structured)
+        sections = [{"hash": _section_hash(text), "summary": None} for text in texts if text]
+
+        try:
+            return await DocumentVersioning.store_version(
+                db, document["_id"], 1, content, file_extension, document["owner_id"], sections
+            )
+        except VersionConflict:
+            # Another request recorded the original file first
+            return await db.document_versions.find_one(
+                {"document_id": document["_id"]}, sort=[("version", -1)]
+            )
+
+    @staticmethod
+    async def summarize_sections(texts: List[str], previous_sections: List[dict]) -> tuple[List[dict], int]:
+        """Summarize only sections whose text changed since the previous version.
+
+        Returns the section records and the number of sections sent to the LLM.
+        """
+        known = {section["hash"]: section["summary"] for section in previous_sections if section.get("summary")}
+        sections, pending = [], []
+
+        for text in texts:
+            section_hash = _section_hash(text)
+            if section_hash in known:
+                sections.append({"hash": section_hash, "summary": known[section_hash]})
+            elif len(text) < SECTION_SUMMARY_MIN_CHARS:
+                sections.append({"hash": section_hash, "summary": text})
+            else:
+                sections.append({"hash": section_hash, "summary": None})
+                pending.append((len(sections) - 1, text))
+
+        summaries = await asyncio.gather(*[
+            AIService.generate_summary(text, SECTION_SUMMARY_MAX_WORDS) for _, text in pending
+        ])
+        for (index, _), summary in zip(pending, summaries):
+            sections[index]["summary"] = summary
+
+        return sections, len(pending)
+
+    @staticmethod
+    async def add_version(db, document: dict, content: bytes, file_extension: str, file_type, created_by) -> dict:
+        """Replace a document's file with a new version and refresh its metadata incrementally.
+
+        Uploads of the same document are serialized through a mark on the
+        document; a second one raises ``VersionConflict`` while the first runs.
+        """
+        started = datetime.utcnow()
+        claimed = await db.documents.find_one_and_update(
+            {
+                "_id": document["_id"],
+                "$or": [
+                    {"version_upload_at": {"$exists": False}},
+                    {"version_upload_at": {"$lt": started - timedelta(seconds=VERSION_UPLOAD_STALE_SECONDS)}},
+                ],
+            },
+            {"$set": {"version_upload_at": started}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not claimed:
+            raise VersionConflict("Another version of this document is being uploaded")
+        try:
+            # The claimed record is current, the caller's copy may predate the previous upload
+            return await DocumentVersioning._add_version(db, claimed, content, file_extension, file_type, created_by)
+        finally:
+            await db.documents.update_one(
+                {"_id": document["_id"], "version_upload_at": started}, {"$unset": {"version_upload_at": ""}}
+            )
+
+    @staticmethod
+    async def _add_version(db, document: dict, content: bytes, file_extension: str, file_type, created_by) -> dict:
+        previous = await DocumentVersioning.get_latest_version(db, document)
+        previous_sections = previous["sections"] if previous else []
+        version = previous["version"] + 1 if previous else 1
+
+        # The latest version is also kept as a plain file for fast downloads and extraction
+        file_path = os.path.join("uploads", f"{uuid.uuid4()}.{file_extension}")
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(content)
+
+        try:
+            structured = await AIService.extract_structured(file_path, processing_type(file_extension))
+        except Exception:
+            # The current version stays in place when the new file cannot be read
+            os.remove(file_path)
+            raise
+        texts = [text for text in AIService.sections_from_structured(structured) if text]
+        sections, summarized = await DocumentVersioning.summarize_sections(texts, previous_sections)
+        record = await DocumentVersioning.store_version(
+            db, document["_id"], version, content, file_extension, created_by, sections
+        )
+
+        update_data = {
+            "file_path": file_path,
+            "file_type": file_type,
+            "file_size": len(content),
+            "current_version": version,
+            "storage_tier": HOT_TIER,
+            "extraction_status": EXTRACTION_DONE,
+            "updated_at": datetime.utcnow(),
+            "last_accessed_at": datetime.utcnow(),
+        }
+
+        # Only rebuild summary and tags when some section actually changed
+        changed = [section["hash"] for section in sections] != [section["hash"] for section in previous_sections]
+        if changed and sections:
+            combined = "\n\n".join(section["summary"] for section in sections if section["summary"])
+            summary, tags = await asyncio.gather(
+                AIService.generate_summary(combined),
+                AIService.generate_tags(combined, document["title"])
+            )
+            if summary:
+                update_data["summary"] = summary
+            if tags:
+                update_data["tags"] = tags
+
+        await TextStore.put(db, record["content_hash"], structured)
+        update_data["content_hash"] = record["content_hash"]
+
+        await db.documents.update_one(
+            {"_id": document["_id"]},
+            {"$set": update_data, "$unset": {"cold_path": "", "tier_state": "", "extraction_error": ""}}
+        )
+
+        # The previous file lives on as chunks
+        DocumentStorage.remove(document)
+        if document.get("content_hash") != record["content_hash"]:
+            await TextStore.release(db, document.get("content_hash"))
+
+        return {
+            "version": version,
+            "file_size": len(content),
+            "total_chunks": len(record["chunks"]),
+            "new_chunks": record["new_chunk_count"],
+            "total_sections": len(sections),
+            "summarized_sections": summarized,
+            "summary_updated": "summary" in update_data,
+        }
+
+    @staticmethod
+    async def delete_versions(db, document_id):
+        """Remove all versions of a document and release their chunks"""
+        async for version in db.document_versions.find({"document_id": document_id}, {"chunks": 1}):
+            await ChunkStore.release_references(db, version["chunks"])
+        await db.document_versions.delete_many({"document_id": document_id})
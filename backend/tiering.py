@@ -0,0 +1,120 @@
+"""
+Storage tiering job: moves documents that have not been accessed for a while
+to the compressed cold store.
+
+Run it from the backend directory, separately from the API process:
+
+    python tiering.py --days 30
+
+Each move is recorded on the document (``tier_state: "moving"``) before any
+file is touched, so an interrupted run is picked up again by the next one.
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.storage import DocumentStorage, COLD_TIER
+
+DEFAULT_COLD_AFTER_DAYS = int(os.getenv("COLD_AFTER_DAYS", "30"))
+
+
+def idle_query(cutoff: datetime) -> dict:
+    """Documents not accessed since the cutoff"""
+    return {"$or": [
+        {"last_accessed_at": {"$lt": cutoff}},
+        {"last_accessed_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+    ]}
+
+
+async def move_document_to_cold(db, document: dict, cutoff: datetime) -> bool:
+    """Compress one document into the cold tier. Returns True if it was moved."""
+    if not document.get("file_path") or not os.path.exists(document["file_path"]):
+        await db.documents.update_one({"_id": document["_id"]}, {"$unset": {"tier_state": ""}})
+        return False
+
+    # Claim the document; a concurrent run or a fresh access leaves it alone
+    claimed = await db.documents.update_one(
+        {"_id": document["_id"], "storage_tier": {"$ne": COLD_TIER}, **idle_query(cutoff)},
+        {"$set": {"tier_state": "moving"}}
+    )
+    if claimed.matched_count == 0:
+        # An unfinished move of a document read since then is dropped, it stays hot
+        await db.documents.update_one(
+            {"_id": document["_id"], "storage_tier": {"$ne": COLD_TIER}}, {"$unset": {"tier_state": ""}}
+        )
+        return False
+
+    # Compression is CPU and disk bound, keep it off the event loop
+    cold_path = await asyncio.to_thread(DocumentStorage.compress_to_cold, document["file_path"])
+
+    await db.documents.update_one(
+        {"_id": document["_id"]},
+        {
+            "$set": {"storage_tier": COLD_TIER, "cold_path": cold_path, "tiered_at": datetime.utcnow()},
+            "$unset": {"tier_state": ""}
+        }
+    )
+    os.remove(document["file_path"])
+    return True
+
+
+async def cleanup_moved_documents(db) -> int:
+    """Remove hot copies left behind by a run interrupted after the record was updated"""
+    removed = 0
+    async for document in db.documents.find({"storage_tier": COLD_TIER}, {"file_path": 1, "cold_path": 1}):
+        if (document.get("file_path") and os.path.exists(document["file_path"])
+                and document.get("cold_path") and os.path.exists(document["cold_path"])):
+            os.remove(document["file_path"])
+            removed += 1
+    return removed
+
+
+async def run_tiering(days: int, limit: int = 0) -> dict:
+    db = await get_database()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    # Unfinished moves (released again if read since) and documents idle since the cutoff
+    query = {
+        "storage_tier": {"$ne": COLD_TIER},
+        "$or": [{"tier_state": "moving"}, *idle_query(cutoff)["$or"]]
+    }
+
+    stats = {"moved": 0, "skipped": 0, "failed": 0, "cleaned": await cleanup_moved_documents(db)}
+    cursor = db.documents.find(query, {"file_path": 1, "tier_state": 1}).sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    async for document in cursor:
+        try:
+            if await move_document_to_cold(db, document, cutoff):
+                stats["moved"] += 1
+                print(f"Moved {document['_id']} to {COLD_TIER} storage")
+            else:
+                stats["skipped"] += 1
+        except Exception as e:
+            stats["failed"] += 1
+            print(f"Error moving {document['_id']} to {COLD_TIER} storage: {e}")
+
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Move rarely accessed documents to compressed cold storage")
+    parser.add_argument("--days", type=int, default=DEFAULT_COLD_AFTER_DAYS,
+                        help="Move documents not accessed for this many days")
+    parser.add_argument("--limit", type=int, default=0, help="Maximum number of documents to move in this run")
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    try:
+        stats = await run_tiering(args.days, args.limit)
+        print(f"Tiering finished: {stats}")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
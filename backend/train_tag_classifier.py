@@ -0,0 +1,83 @@
+"""
+Train the local tag classifier from documents that already have tags.
+
+Run it from the backend directory whenever enough new documents were tagged:
+
+    python train_tag_classifier.py --holdout 0.2
+
+The text of each document comes from the text store (title and summary when
+it was never extracted). A share of the documents is held out to report, per
+confidence threshold, how often the LLM would still be called and how well
+the confident predictions match the existing tags. The report is saved with
+the model and shown under /metrics. Running API workers pick the new model up
+on their next prediction.
+"""
+
+import argparse
+import asyncio
+import random
+from datetime import datetime
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.tag_classifier import ALLOWED_TAGS, TAG_MODEL_PATH, TagModel, evaluate
+from services.text_store import TextStore
+
+
+async def load_training_set(db) -> tuple:
+    labels = [tag.lower() for tag in ALLOWED_TAGS]
+    texts, tag_lists = [], []
+    cursor = db.documents.find(
+        {"tags": {"$in": labels + ALLOWED_TAGS}},
+        {"title": 1, "summary": 1, "tags": 1, "content_hash": 1}
+    )
+    async for document in cursor:
+        tags = [tag.lower() for tag in document["tags"] if tag.lower() in labels]
+        text = await TextStore.get(db, document.get("content_hash"))
+        if not text:
+            text = f"{document.get('title', '')}\n{document.get('summary') or ''}"
+        texts.append(text)
+        tag_lists.append(tags)
+    return texts, tag_lists, labels
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Train the local tag classifier")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of documents kept for evaluation")
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--output", default=TAG_MODEL_PATH)
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    try:
+        db = await get_database()
+        texts, tag_lists, labels = await load_training_set(db)
+    finally:
+        await close_mongo_connection()
+
+    if len(texts) < 20:
+        print(f"Only {len(texts)} tagged documents, not enough to train")
+        return
+
+    order = list(range(len(texts)))
+    random.Random(42).shuffle(order)
+    split = int(len(order) * (1 - args.holdout))
+    train, holdout = order[:split], order[split:]
+
+    model = TagModel.train([texts[i] for i in train], [tag_lists[i] for i in train], labels, epochs=args.epochs)
+    report = evaluate(model, [texts[i] for i in holdout], [tag_lists[i] for i in holdout])
+    print(f"Holdout evaluation: {report}")
+
+    # The saved model is trained on every document, the report describes the held out run
+    model = TagModel.train(texts, tag_lists, labels, epochs=args.epochs)
+    model.metadata = {
+        "trained_at": datetime.utcnow().isoformat(),
+        "documents": len(texts),
+        "features": len(model.vocabulary),
+        "evaluation": report,
+    }
+    model.save(args.output)
+    print(f"Saved tag classifier with {len(model.vocabulary)} features to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
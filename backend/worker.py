@@ -0,0 +1,338 @@
+"""
+Background worker for the job queue: AI enrichment of uploaded documents,
+analysis of staged files, the documents of backfill runs and near-duplicate
+scans.
+
+Run it from the backend directory, as many instances as needed, separately
+from the API process:
+
+    python worker.py --concurrency 4
+
+Jobs are leased from Mongo, so workers can be added or stopped at any time.
+A worker that dies mid-job loses its lease and the job is retried elsewhere.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+
+from database import connect_to_mongo, close_mongo_connection, get_database
+from services.ai_service import AIService, SUMMARY_MIN_CHARS, TAGS_MIN_CHARS
+from services.backfill import target_version, version_update, EXTRACT, SUMMARY, TAGS, INDEX
+from services.extraction import processing_type
+from services.extraction_pool import ExtractionPool, ExtractionError, ExtractionUnavailable
+from services.job_queue import (
+    JobQueue, PermanentJobError, ENRICH_DOCUMENT, ANALYZE_STAGED, BACKFILL_DOCUMENT, NEAR_DUPLICATE_SCAN,
+    JOB_LEASE_SECONDS
+)
+from services.llm_client import LLMClient
+from services.llm_scheduler import use_lane, BACKGROUND
+from services.near_duplicates import NearDuplicateIndex, near_duplicate_groups, flag_near_duplicate_groups
+from services.staging import StagingArea
+from services.storage import DocumentStorage
+from services.text_store import TextStore
+
+POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+
+
+class JobContext:
+    """Handle given to job handlers for progress reports; also keeps the lease alive"""
+
+    def __init__(self, db, job: dict):
+        self.db = db
+        self.job = job
+        self.progress = {"stage": "started", "percent": 0}
+        self.lost = False
+
+    async def report(self, stage: str, percent: int):
+        self.progress = {"stage": stage, "percent": percent}
+        if not await JobQueue.heartbeat(self.db, self.job, self.progress):
+            self.lost = True
+
+    async def keep_alive(self):
+        while not self.lost:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            if not await JobQueue.heartbeat(self.db, self.job):
+                self.lost = True
+
+
+async def extract_for_job(db, file_hash: str, file_path: str, file_type: str, document_id=None) -> str:
+    """Get the text through the text store, turning extraction failures into job errors"""
+    try:
+        structured = await TextStore.get_or_extract(db, file_hash, file_path, file_type)
+    except ExtractionUnavailable:
+        # Transient, the job is retried later
+        raise
+    except ExtractionError as e:
+        if document_id is not None:
+            await TextStore.mark_extraction(db, document_id, e)
+        raise PermanentJobError(f"Text extraction failed: {e}")
+    if document_id is not None:
+        await TextStore.mark_extraction(db, document_id)
+    return structured.text
+
+
+async def enrich_document(db, job: dict, context: JobContext) -> dict:
+    """Extract a document's text and fill in the summary and tags it does not have yet.
+
+    A near-duplicate of an already enriched document is flagged as such and
+    reuses its summary and tags instead of asking the LLM.
+    """
+    document = await db.documents.find_one({"_id": ObjectId(job["payload"]["document_id"])})
+    if not document:
+        return {"skipped": "document deleted"}
+
+    await context.report("extracting", 10)
+    file_extension = document["file_path"].split('.')[-1].lower()
+    async with DocumentStorage.local_copy(document) as path:
+        text = await extract_for_job(
+            db, document["content_hash"], path, processing_type(file_extension), document["_id"]
+        )
+
+    owner = await db.users.find_one({"_id": document["owner_id"]}, {"group": 1})
+    match = await NearDuplicateIndex.find_enriched_match(db, document, owner.get("group") if owner else None)
+    near_duplicate_of = None
+    if match:
+        source, similarity = match
+        near_duplicate_of = str(source["_id"])
+        await db.documents.update_one(
+            {"_id": document["_id"]},
+            {"$set": {"near_duplicate_of": {
+                "document_id": source["_id"], "similarity": round(similarity, 3), "flagged_at": datetime.utcnow()
+            }}}
+        )
+
+    if document.get("summary") and document.get("tags"):
+        return {"summary": document["summary"], "tags": document["tags"], "near_duplicate_of": near_duplicate_of}
+    if not text:
+        return {"summary": "", "tags": []}
+
+    if match:
+        analysis = {"summary": source["summary"], "tags": source["tags"]}
+        versions = {
+            f"pipeline_versions.{task}": version
+            for task, version in source.get("pipeline_versions", {}).items() if task in (SUMMARY, TAGS)
+        }
+    else:
+        await context.report("generating", 40)
+        analysis = await AIService.enhance_document_metadata(document["file_path"], document["file_type"], document["title"], text=text)
+        if not analysis["summary"] and not analysis["tags"]:
+            raise RuntimeError("AI service returned neither a summary nor tags")
+        versions = version_update(SUMMARY, TAGS)
+
+    await context.report("saving", 90)
+    # Only fill what is still empty, values edited in the meantime are kept
+    update = {}
+    current = await db.documents.find_one({"_id": document["_id"]}, {"summary": 1, "tags": 1})
+    if current and not current.get("summary") and analysis["summary"]:
+        update["summary"] = analysis["summary"]
+        update.update({key: value for key, value in versions.items() if key.endswith(SUMMARY)})
+    if current and not current.get("tags") and analysis["tags"]:
+        update["tags"] = analysis["tags"]
+        update.update({key: value for key, value in versions.items() if key.endswith(TAGS)})
+    if update:
+        await db.documents.update_one({"_id": document["_id"]}, {"$set": update})
+
+    return {"summary": analysis["summary"], "tags": analysis["tags"], "near_duplicate_of": near_duplicate_of}
+
+
+async def analyze_staged(db, job: dict, context: JobContext) -> dict:
+    """Background variant of /ai/analyze-file for a staged upload"""
+    payload = job["payload"]
+    staged = await db.staged_uploads.find_one({"_id": payload["staging_id"]})
+    if not staged:
+        raise PermanentJobError("Staged upload expired or was already used")
+
+    await context.report("extracting", 10)
+    text = await extract_for_job(
+        db, staged["content_hash"], staged["file_path"], processing_type(staged["file_extension"])
+    )
+
+    await context.report("generating", 40)
+    analysis = await AIService.enhance_document_metadata(
+        staged["file_path"], processing_type(staged["file_extension"]), payload.get("title", ""), text=text
+    )
+    await StagingArea.save_analysis(db, staged["_id"], analysis["summary"], analysis["tags"])
+
+    return {
+        "staging_id": staged["_id"],
+        "summary": analysis["summary"],
+        "tags": analysis["tags"],
+        "extracted_text_preview": text[:500] + "..." if len(text) > 500 else text,
+        "has_content": bool(text),
+    }
+
+
+async def backfill_text(db, document: dict, fresh: bool = False) -> str:
+    """The document's stored text, extracted first if there is none; with ``fresh``, re-extracted if outdated"""
+    file_hash = document.get("content_hash")
+    if file_hash and not fresh:
+        text = await TextStore.get(db, file_hash)
+        if text is not None:
+            return text
+    if not DocumentStorage.exists(document):
+        raise PermanentJobError("Document file is missing")
+    if not file_hash:
+        file_hash = await DocumentStorage.content_hash(document)
+        await db.documents.update_one({"_id": document["_id"]}, {"$set": {"content_hash": file_hash}})
+        document["content_hash"] = file_hash
+
+    file_type = processing_type(document["file_path"].split('.')[-1].lower())
+    async with DocumentStorage.local_copy(document) as path:
+        if not fresh:
+            return await extract_for_job(db, file_hash, path, file_type, document["_id"])
+        try:
+            structured = await TextStore.reextract(db, file_hash, path, file_type)
+        except ExtractionUnavailable:
+            raise
+        except ExtractionError as e:
+            await TextStore.mark_extraction(db, document["_id"], e)
+            raise PermanentJobError(f"Text extraction failed: {e}")
+    await TextStore.mark_extraction(db, document["_id"])
+    return structured.text
+
+
+async def backfill_document(db, job: dict, context: JobContext) -> dict:
+    """Run one pipeline stage of a backfill run on a document not at the stage's current version.
+
+    Summaries and tags without a pipeline version were written by the
+    uploader and are only replaced when the run overwrites them.
+    """
+    payload = job["payload"]
+    task, overwrite = payload["task"], payload.get("overwrite", False)
+    version = target_version(task)
+    document = await db.documents.find_one({"_id": ObjectId(payload["document_id"])})
+    if not document:
+        return {"skipped": "document deleted"}
+    if document.get("pipeline_versions", {}).get(task) == version:
+        return {"skipped": "already at target version"}
+
+    await context.report(task, 10)
+    result = {"task": task, "version": version}
+    update = version_update(task)
+    if task == EXTRACT:
+        text = await backfill_text(db, document, fresh=True)
+        result["length"] = len(text)
+    elif task == INDEX:
+        await backfill_text(db, document)
+        await TextStore.reindex(db, document["content_hash"])
+    else:
+        field = task
+        keep = document.get(field) and task not in document.get("pipeline_versions", {}) and not overwrite
+        text = "" if keep else await backfill_text(db, document)
+        if text:
+            await context.report(task, 40)
+            if task == SUMMARY:
+                value = await AIService.generate_summary(text)
+            else:
+                value = await AIService.generate_tags(text, document["title"])
+            # The AI service turns LLM failures into empty results; only short texts really have none
+            if not value and len(text.strip()) >= (SUMMARY_MIN_CHARS if task == SUMMARY else TAGS_MIN_CHARS):
+                raise RuntimeError(f"AI service returned no {task}")
+            if value:
+                update[field] = value
+            result[field] = value
+        else:
+            result["skipped"] = "written by the uploader" if keep else "no text"
+            if keep:
+                # Leave the version unset, the value is not the pipeline's
+                update = {}
+
+    if update:
+        await db.documents.update_one({"_id": document["_id"]}, {"$set": update})
+    return result
+
+
+async def scan_near_duplicates(db, job: dict, context: JobContext) -> dict:
+    """Group the near-duplicate documents of the corpus for /admin/near-duplicates, and flag them if asked"""
+    payload = job["payload"]
+    await context.report("scanning", 10)
+    groups = await near_duplicate_groups(db, payload["threshold"])
+    flagged = 0
+    if payload.get("flag"):
+        await context.report("flagging", 80)
+        flagged = await flag_near_duplicate_groups(db, groups)
+    report = await db.near_duplicate_reports.insert_one({
+        "threshold": payload["threshold"], "groups": groups, "job_id": job["_id"], "created_at": datetime.utcnow()
+    })
+    return {"report_id": str(report.inserted_id), "group_count": len(groups), "flagged": flagged}
+
+
+HANDLERS = {
+    ENRICH_DOCUMENT: enrich_document,
+    ANALYZE_STAGED: analyze_staged,
+    BACKFILL_DOCUMENT: backfill_document,
+    NEAR_DUPLICATE_SCAN: scan_near_duplicates,
+}
+
+
+async def run_job(db, job: dict):
+    context = JobContext(db, job)
+    keep_alive = asyncio.create_task(context.keep_alive())
+    try:
+        if job["attempts"] > job["max_attempts"]:
+            raise PermanentJobError("Job lost its lease too many times")
+        # Jobs yield to interactive requests for the LLM rate limit
+        with use_lane(BACKGROUND):
+            result = await HANDLERS[job["type"]](db, job, context)
+        if context.lost:
+            print(f"Job {job['_id']} was taken over by another worker, dropping its result")
+            return
+        await JobQueue.complete(db, job, result)
+        print(f"Job {job['_id']} ({job['type']}) done")
+    except Exception as e:
+        status = await JobQueue.fail(db, job, e)
+        print(f"Job {job['_id']} ({job['type']}) failed on attempt {job['attempts']}: {e} -> {status}")
+    finally:
+        keep_alive.cancel()
+
+
+async def worker_loop(db, worker_id: str, stopping: asyncio.Event):
+    while not stopping.is_set():
+        job = await JobQueue.lease(db, worker_id, list(HANDLERS))
+        if job is None:
+            try:
+                await asyncio.wait_for(stopping.wait(), POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(db, job)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run background jobs from the job queue")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "4")),
+                        help="Number of jobs processed at the same time")
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    db = await get_database()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    # Finish the running jobs on SIGTERM/SIGINT, stop taking new ones
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    print(f"Worker {worker_id} started with concurrency {args.concurrency}")
+    try:
+        # Each loop leases under its own id so a stale loop cannot pass for the current lease holder
+        await asyncio.gather(*[
+            worker_loop(db, f"{worker_id}-{n}", stopping) for n in range(args.concurrency)
+        ])
+    finally:
+        ExtractionPool.shutdown()
+        await LLMClient.close()
+        await close_mongo_connection()
+        print(f"Worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,20 @@
-from fastapi import FastAPI, UploadFile, File, Form, APIRouter
-from typing import List
+from fastapi import FastAPI, UploadFile, File, Form, APIRouter, HTTPException
+from typing import List, Optional
 import uvicorn
-import tempfile
+import asyncio
+import functools
+import contextvars
+import time
 import os
 
 from openai import OpenAI
 from docx import Document
 
-from method_llm import DocTagger, DocxSummarizer  # import your class
+from method_llm import (  # import your class
+    DocTagger, DocxSummarizer, LLMCache, TagClassifier, BATCH_CONCURRENCY,
+    docx_to_text_with_tables, get_extraction_executor, get_request_executor, shutdown_executors
+)
+from services.llm_scheduler import LLMScheduler, use_lane, BACKGROUND
 
 app = FastAPI(title="LLM API")
 router = APIRouter(prefix="/llm_api")
@@ -15,24 +22,118 @@ router = APIRouter(prefix="/llm_api")
 doc_tagger = DocTagger()
 doc_summarizer = DocxSummarizer()
 
+MAX_BATCH_ITEMS = int(os.getenv("LLM_MAX_BATCH_ITEMS", "200"))
+# Server-side documents referenced by path in batch requests must live under this directory
+DOCUMENT_ROOT = os.path.realpath(os.getenv("LLM_DOCUMENT_ROOT", os.path.join(os.path.dirname(__file__), "..", "uploads")))
+
+async def extract_text(source):
+    """Extract a DOCX file (path or bytes) in the process pool without blocking the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(get_extraction_executor(), docx_to_text_with_tables, source)
+
+async def run_blocking(func, *args):
+    """Run a blocking LLM call on the bounded request executor, keeping the scheduler lane"""
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(get_request_executor(), call)
+
+async def collect_batch(files: Optional[List[UploadFile]], paths: str):
+    """Return (names, texts) for uploaded files and comma-separated document paths.
+
+    Texts are extracted in parallel; a file that cannot be read gets its exception.
+    """
+    files = files or []
+    references = [path.strip() for path in paths.split(",") if path.strip()]
+    if not files and not references:
+        raise HTTPException(status_code=400, detail="Send files or document paths")
+    if len(files) + len(references) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} documents per batch")
+
+    local_paths = []
+    for reference in references:
+        path = os.path.realpath(os.path.join(DOCUMENT_ROOT, reference))
+        if not path.startswith(DOCUMENT_ROOT + os.sep):
+            raise HTTPException(status_code=400, detail=f"Invalid document path: {reference}")
+        local_paths.append(path)
+    sources = [await file.read() for file in files] + local_paths
+    texts = list(await asyncio.gather(*(extract_text(source) for source in sources), return_exceptions=True))
+    return [file.filename for file in files] + references, texts
+
+def batch_item(name: str, key: str, value) -> dict:
+    if isinstance(value, Exception):
+        return {"name": name, key: None, "error": str(value)}
+    return {"name": name, key: value, "error": None}
+
 @router.post("/summarize")
 async def summarize_docx(file: UploadFile = File(...), max_words: int = Form(200)):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-    summary = doc_summarizer.summarize_docx(tmp_path, max_words=max_words)
-    os.remove(tmp_path)
+    text = await extract_text(await file.read())
+    summary = await run_blocking(doc_summarizer.summarize_text, text, max_words)
     return {"summary": summary}
 
 @router.post("/classify")
 async def classify_docx(file: UploadFile = File(...), tags: str = Form(...)):
     list_tags = [t.strip() for t in tags.split(",") if t.strip()]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-    result_tags = doc_tagger.classify_docx(tmp_path, list_tags)
-    os.remove(tmp_path)
+    text = await extract_text(await file.read())
+    result_tags = await run_blocking(doc_tagger.classify_tags, text, list_tags)
     return {"tags": result_tags}
+
+@router.post("/batch/summarize")
+async def batch_summarize(
+    files: Optional[List[UploadFile]] = File(None),
+    paths: str = Form(""),
+    max_words: int = Form(200),
+    concurrency: int = Form(BATCH_CONCURRENCY)
+):
+    """Summarize many DOCX files (uploaded, or paths under LLM_DOCUMENT_ROOT)"""
+    started = time.monotonic()
+    names, texts = await collect_batch(files, paths)
+    readable = [i for i, text in enumerate(texts) if not isinstance(text, Exception)]
+    # Batches give way to single-document requests for the LLM rate limit
+    with use_lane(BACKGROUND):
+        summaries = await run_blocking(
+            doc_summarizer.summarize_many, [texts[i] for i in readable], max_words, min(concurrency, BATCH_CONCURRENCY)
+        )
+    for index, summary in zip(readable, summaries):
+        texts[index] = summary
+    return {
+        "results": [batch_item(name, "summary", value) for name, value in zip(names, texts)],
+        "elapsed_seconds": round(time.monotonic() - started, 3)
+    }
+
+@router.post("/batch/classify")
+async def batch_classify(
+    files: Optional[List[UploadFile]] = File(None),
+    paths: str = Form(""),
+    tags: str = Form(...),
+    concurrency: int = Form(BATCH_CONCURRENCY)
+):
+    """Classify many DOCX files; short documents share a prompt"""
+    started = time.monotonic()
+    list_tags = [t.strip() for t in tags.split(",") if t.strip()]
+    names, texts = await collect_batch(files, paths)
+    readable = [i for i, text in enumerate(texts) if not isinstance(text, Exception)]
+    with use_lane(BACKGROUND):
+        results, stats = await run_blocking(
+            doc_tagger.classify_many, [texts[i] for i in readable], list_tags, min(concurrency, BATCH_CONCURRENCY)
+        )
+    for index, result in zip(readable, results):
+        texts[index] = result
+    return {
+        "results": [batch_item(name, "tags", value) for name, value in zip(names, texts)],
+        "stats": stats,
+        "elapsed_seconds": round(time.monotonic() - started, 3)
+    }
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "llm_cache": LLMCache.stats(),
+        "tag_classifier": TagClassifier.stats(),
+        "llm_scheduler": LLMScheduler.stats(),
+    }
+
+@app.on_event("shutdown")
+async def shutdown():
+    shutdown_executors()
+
 app.include_router(router)
 
 if __name__ == "__main__":
@@ -1,38 +1,150 @@
-from openai import OpenAI
-from docx import Document
-from typing import List
+import io
+import os
+import sys
+import json
+import threading
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from openai import OpenAI, RateLimitError
+from typing import List, Optional, Tuple, Union
 
-class DocxSummarizer:
-    def __init__(self, api_key: str = "", model: str = "gpt-4o-mini"):
-        self.model = model
-        self.client = OpenAI(api_key=api_key)
+# The extraction engine lives in the backend and is shared with this service
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from services.extraction import extract_structured  # noqa: E402
+from services.llm_cache import LLMCache, make_key  # noqa: E402
+from services.llm_scheduler import LLMScheduler, estimate_tokens  # noqa: E402
+from services.tag_classifier import TagClassifier, TAG_CONFIDENCE_THRESHOLD  # noqa: E402
+
+# Bump when a prompt changes so cached responses of the old prompt are not reused
+SUMMARY_PROMPT_VERSION = "1"
+CLASSIFY_PROMPT_VERSION = "1"
+
+# LLM requests in flight at once for all batches of this service
+BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "8"))
+EXTRACTION_WORKERS = int(os.getenv("LLM_EXTRACTION_WORKERS", str(os.cpu_count() or 2)))
+# Threads running blocking LLM calls for requests, more requests wait for a free one
+REQUEST_WORKERS = int(os.getenv("LLM_REQUEST_WORKERS", "32"))
+# Documents up to this length share one classification prompt
+PACK_MAX_CHARS = 2000
+PACK_MAX_DOCUMENTS = 10
+PACK_PROMPT_CHARS = 12000
+# Attempts of a call answered with 429, the scheduler decides how long to wait in between
+RATE_LIMIT_ATTEMPTS = 4
+
+_extraction_executor: Optional[ProcessPoolExecutor] = None
+_request_executor: Optional[ThreadPoolExecutor] = None
+_batch_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_extraction_executor() -> ProcessPoolExecutor:
+    global _extraction_executor
+    if _extraction_executor is None:
+        _extraction_executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    return _extraction_executor
+
+
+def get_request_executor() -> ThreadPoolExecutor:
+    global _request_executor
+    if _request_executor is None:
+        _request_executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix="llm-request")
+    return _request_executor
 
-    def docx_to_text_with_tables(self,path):
-        doc = Document(path)
-        content = []
 
-        para_idx, table_idx = 0, 0  # giữ vị trí paragraph và table
+def get_batch_executor() -> ThreadPoolExecutor:
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers=max(1, BATCH_CONCURRENCY), thread_name_prefix="llm-batch")
+    return _batch_executor
 
-        for element in doc.element.body:
-            if element.tag.endswith('p'):  # paragraph
-                para = doc.paragraphs[para_idx]
-                para_idx += 1
-                text = para.text.strip()
-                if text:
-                    content.append(text)
 
-            elif element.tag.endswith('tbl'):  # table
-                table = doc.tables[table_idx]
-                table_idx += 1
-                for row in table.rows:
-                    row_text = [cell.text.strip() for cell in row.cells]
-                    content.append("| " + " | ".join(row_text) + " |")
+def shutdown_executors():
+    global _extraction_executor, _request_executor, _batch_executor
+    if _extraction_executor is not None:
+        _extraction_executor.shutdown(wait=False, cancel_futures=True)
+        _extraction_executor = None
+    if _request_executor is not None:
+        _request_executor.shutdown(wait=False, cancel_futures=True)
+        _request_executor = None
+    if _batch_executor is not None:
+        _batch_executor.shutdown(wait=False, cancel_futures=True)
+        _batch_executor = None
 
-        return "\n".join(content)
 
+def docx_to_text_with_tables(source: Union[str, bytes]) -> str:
+    """Paragraphs and tables of a DOCX file, given as a path or its bytes, in document order"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return extract_structured(source, "docx").text
+
+
+def scheduled_completion(client: OpenAI, **kwargs):
+    """``client.chat.completions.create`` sent through the shared LLM scheduler"""
+    estimated_tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    for attempt in range(RATE_LIMIT_ATTEMPTS):
+        ticket = LLMScheduler.acquire_sync(estimated_tokens)
+        try:
+            response = client.chat.completions.create(**kwargs)
+        except RateLimitError as e:
+            retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            LLMScheduler.report_rate_limited(retry_after)
+            if attempt == RATE_LIMIT_ATTEMPTS - 1:
+                raise
+            continue
+        LLMScheduler.settle(ticket, response.usage.total_tokens if response.usage else None)
+        return response
+
+
+def submit_in_context(pool: ThreadPoolExecutor, func, *args):
+    """Submit to a thread pool keeping context variables such as the scheduler lane"""
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+
+def submit_batch(func, items: list, concurrency: int) -> list:
+    """Submit ``func`` for every item to the shared batch executor, at most ``concurrency`` of this batch at once"""
+    slots = threading.BoundedSemaphore(max(1, concurrency))
+    futures = []
+    for item in items:
+        slots.acquire()
+        future = submit_in_context(get_batch_executor(), func, item)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    return futures
+
+
+def pack_documents(indices: List[int], texts: List[str]) -> List[List[int]]:
+    """Group short documents into packs that fit one classification prompt"""
+    packs, current, size = [], [], 0
+    for index in indices:
+        length = len(texts[index])
+        if current and (len(current) >= PACK_MAX_DOCUMENTS or size + length > PACK_PROMPT_CHARS):
+            packs.append(current)
+            current, size = [], 0
+        current.append(index)
+        size += length
+    if current:
+        packs.append(current)
+    return packs
+
+
+class DocxSummarizer:
+    def __init__(self, api_key: str = "", model: str = "gpt-4o-mini"):
+        self.model = model
+        # Rate limits are retried by scheduled_completion
+        self.client = OpenAI(api_key=api_key, max_retries=0)
 
     def summarize_text(self, text: str, max_words: int = 500) -> str:
         """Summarize extracted text using OpenAI."""
+        cache_key = make_key(self.model, "docx_summary", SUMMARY_PROMPT_VERSION,
+                             {"temperature": 0.5, "max_words": max_words}, text)
+        cached = LLMCache.get_sync(cache_key)
+        if cached is not None:
+            return cached
+
         prompt = (
             f"Tóm tắt văn bản sau thành khoảng {max_words} từ. "
             "Yêu cầu: viết rõ ràng, dễ hiểu, bằng tiếng Việt, và trình bày dưới dạng markdown "
@@ -40,7 +152,8 @@ class DocxSummarizer:
             f"Văn bản:\n{text}"
         )
 
-        response = self.client.chat.completions.create(
+        response = scheduled_completion(
+            self.client,
             model=self.model,
             messages=[
                 {"role": "system", "content": "Bạn là một trợ lý AI hữu ích, chuyên tóm tắt văn bản."},
@@ -49,41 +162,53 @@ class DocxSummarizer:
             temperature=0.5,
         )
 
-        return response.choices[0].message.content.strip()
+        summary = response.choices[0].message.content.strip()
+        if summary:
+            LLMCache.put_sync(cache_key, summary, "docx_summary")
+        return summary
 
-    def summarize_docx(self, file_path: str, max_words: int = 200) -> str:
-        """End-to-end method: read DOCX and summarize."""
-        text = self.docx_to_text_with_tables(file_path)
+    def summarize_docx(self, source: Union[str, bytes], max_words: int = 200) -> str:
+        """End-to-end method: read DOCX (path or bytes) and summarize."""
+        text = docx_to_text_with_tables(source)
         return self.summarize_text(text, max_words=max_words)
 
+    def summarize_many(self, texts: List[str], max_words: int = 200,
+                       concurrency: int = BATCH_CONCURRENCY) -> List[Union[str, Exception]]:
+        """Summarize many texts with at most ``concurrency`` requests in flight"""
+        def summarize(text):
+            try:
+                return self.summarize_text(text, max_words=max_words)
+            except Exception as e:
+                return e
+
+        return [future.result() for future in submit_batch(summarize, texts, concurrency)]
+
 class DocTagger:
     def __init__(self, api_key: str = "", model: str = "gpt-4o-mini"):
         self.model = model
-        self.client = OpenAI(api_key=api_key)
-
-    def docx_to_text_with_tables(self, path):
-        doc = Document(path)
-        content = []
-        para_idx, table_idx = 0, 0
-
-        for element in doc.element.body:
-            if element.tag.endswith('p'):
-                para = doc.paragraphs[para_idx]
-                para_idx += 1
-                text = para.text.strip()
-                if text:
-                    content.append(text)
-
-            elif element.tag.endswith('tbl'):
-                table = doc.tables[table_idx]
-                table_idx += 1
-                for row in table.rows:
-                    row_text = [cell.text.strip() for cell in row.cells]
-                    content.append("| " + " | ".join(row_text) + " |")
-
-        return "\n".join(content)
+        # Rate limits are retried by scheduled_completion
+        self.client = OpenAI(api_key=api_key, max_retries=0)
 
     def classify_tags(self, text: str, list_tags: List[str]) -> List[str]:
+        # The local classifier answers confident cases without an LLM call
+        classified = TagClassifier.classify(text, list_tags)
+        if classified and classified[1] >= TAG_CONFIDENCE_THRESHOLD:
+            TagClassifier.record(used_classifier=True)
+            return classified[0]
+
+        tags = self._classify_tags_llm(text, list_tags)
+        TagClassifier.record(used_classifier=False, predicted=classified[0] if classified else None, llm_tags=tags)
+        return tags
+
+    def _cache_key(self, text: str, list_tags: List[str]) -> str:
+        return make_key(self.model, "docx_classify", CLASSIFY_PROMPT_VERSION, {"temperature": 0, "tags": list_tags}, text)
+
+    def _classify_tags_llm(self, text: str, list_tags: List[str]) -> List[str]:
+        cache_key = self._cache_key(text, list_tags)
+        cached = LLMCache.get_sync(cache_key)
+        if cached is not None:
+            return cached
+
         prompt = (
             "Bạn là một hệ thống phân loại văn bản.\n\n"
             f"Danh sách tag cho phép: {', '.join(list_tags)}\n\n"
@@ -92,7 +217,8 @@ class DocTagger:
             f"Văn bản:\n{text}"
         )
 
-        response = self.client.chat.completions.create(
+        response = scheduled_completion(
+            self.client,
             model=self.model,
             messages=[
                 {"role": "system", "content": "Bạn là một trợ lý AI chuyên phân loại văn bản."},
@@ -103,9 +229,92 @@ class DocTagger:
 
         tags_text = response.choices[0].message.content.strip()
         tags = [t.strip() for t in tags_text.split(",") if t.strip()]
-        valid_tags = [t for t in tags if t in list_tags]
-        return valid_tags[:3]
+        valid_tags = [t for t in tags if t in list_tags][:3]
+        LLMCache.put_sync(cache_key, valid_tags, "docx_classify")
+        return valid_tags
+
+    def _classify_pack(self, texts: List[str], list_tags: List[str]) -> List[List[str]]:
+        """Classify several short documents with a single prompt.
+
+        Falls back to one request per document if the answer cannot be parsed.
+        """
+        documents = "\n\n".join(f"### Văn bản {number}\n{text}" for number, text in enumerate(texts, 1))
+        prompt = (
+            "Bạn là một hệ thống phân loại văn bản.\n\n"
+            f"Danh sách tag cho phép: {', '.join(list_tags)}\n\n"
+            f"Dưới đây là {len(texts)} văn bản được đánh số. Với mỗi văn bản, chọn tối đa 3 tag phù hợp nhất. "
+            "Chỉ trả lời bằng một đối tượng JSON, khóa là số thứ tự văn bản, giá trị là danh sách tag, "
+            'ví dụ: {"1": ["tag"], "2": []}.\n\n'
+            f"{documents}"
+        )
+
+        try:
+            response = scheduled_completion(
+                self.client,
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "Bạn là một trợ lý AI chuyên phân loại văn bản."},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+            answer = json.loads(response.choices[0].message.content)
+            results = [
+                [tag for tag in answer.get(str(number), []) if tag in list_tags][:3]
+                for number in range(1, len(texts) + 1)
+            ]
+        except (ValueError, AttributeError, TypeError) as e:
+            print(f"Packed classification answer unusable, classifying one by one: {e}")
+            return [self._classify_tags_llm(text, list_tags) for text in texts]
+
+        for text, tags in zip(texts, results):
+            LLMCache.put_sync(self._cache_key(text, list_tags), tags, "docx_classify")
+        return results
+
+    def classify_many(self, texts: List[str], list_tags: List[str],
+                      concurrency: int = BATCH_CONCURRENCY) -> Tuple[List[Union[List[str], Exception]], dict]:
+        """Classify many texts. Returns (per-text tags or exception, run statistics).
+
+        The local classifier and the cache answer first; the remaining short
+        documents are packed several per prompt, long ones get their own.
+        """
+        results: List[Union[List[str], Exception, None]] = [None] * len(texts)
+        stats = {"classifier": 0, "cache": 0, "llm_requests": 0}
+        pending = []
+        for index, text in enumerate(texts):
+            classified = TagClassifier.classify(text, list_tags)
+            if classified and classified[1] >= TAG_CONFIDENCE_THRESHOLD:
+                TagClassifier.record(used_classifier=True)
+                results[index] = classified[0]
+                stats["classifier"] += 1
+                continue
+            cached = LLMCache.get_sync(self._cache_key(text, list_tags))
+            if cached is not None:
+                results[index] = cached
+                stats["cache"] += 1
+                continue
+            pending.append(index)
+
+        packs = pack_documents([i for i in pending if len(texts[i]) <= PACK_MAX_CHARS], texts)
+        packs += [[i] for i in pending if len(texts[i]) > PACK_MAX_CHARS]
+        stats["llm_requests"] = len(packs)
+
+        def classify(pack):
+            if len(pack) == 1:
+                return [self._classify_tags_llm(texts[pack[0]], list_tags)]
+            return self._classify_pack([texts[i] for i in pack], list_tags)
+
+        for pack, future in zip(packs, submit_batch(classify, packs, concurrency)):
+            try:
+                for index, tags in zip(pack, future.result()):
+                    results[index] = tags
+                    TagClassifier.record(used_classifier=False, llm_tags=tags)
+            except Exception as e:
+                for index in pack:
+                    results[index] = e
+        return results, stats
 
-    def classify_docx(self, file_path: str, list_tags: List[str]) -> List[str]:
-        text = self.docx_to_text_with_tables(file_path)
+    def classify_docx(self, source: Union[str, bytes], list_tags: List[str]) -> List[str]:
+        text = docx_to_text_with_tables(source)
         return self.classify_tags(text, list_tags)
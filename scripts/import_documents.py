@@ -0,0 +1,337 @@
+"""
+Bulk import script: ingests a directory tree of real files as documents
+
+Folders are mapped to owners, groups and tags with a JSON mapping file:
+
+    {
+        "default": {"owner": "admin", "visibility": "private"},
+        "Operations/ATM": {"owner": "john_doe", "group": "developers", "tags": ["ATM"], "visibility": "group"},
+        "HR": {"owner": "jane_smith", "tags": ["onboarding"], "visibility": "public"}
+    }
+
+The longest matching folder prefix wins; tags of all matching prefixes are merged.
+
+Usage:
+    python scripts/import_documents.py /data/procedures --mapping mapping.json --workers 8
+
+Files are copied into the backend uploads directory and their text is
+extracted in a process pool. Documents are written with unordered
+``insert_many`` batches. Every committed batch is appended to a checkpoint
+file, so re-running the same command resumes an interrupted import. Each
+document also records its source path (unique), so files committed just
+before a crash are not imported twice.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from services.extraction import extract_structured  # noqa: E402
+from services.text_store import TextStore  # noqa: E402
+
+# Database configuration
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "knowledge_management")
+
+FILE_TYPES = {
+    'pdf': 'pdf',
+    'doc': 'doc',
+    'docx': 'docx',
+    'png': 'image',
+    'jpg': 'image',
+    'jpeg': 'image',
+    'gif': 'image'
+}
+
+MAX_FILE_SIZE = 10 * 1024 * 1024  # Same limit as the upload endpoint
+COPY_BUFFER_SIZE = 1024 * 1024
+REPORT_INTERVAL = 5.0
+
+
+def ingest_file(source_path: str, uploads_dir: str) -> dict:
+    """Copy one file into storage and extract its text. Runs in a worker process."""
+    file_extension = source_path.split('.')[-1].lower()
+    filename = f"{uuid.uuid4()}.{file_extension}"
+    target_path = os.path.join(uploads_dir, filename)
+
+    # Stream the copy and hash it on the way instead of loading the file into memory
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        while True:
+            block = src.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            dst.write(block)
+
+    file_type = FILE_TYPES[file_extension]
+    try:
+        structured = extract_structured(target_path, file_type)
+    except Exception:
+        os.remove(target_path)
+        raise
+
+    return {
+        "stored_path": target_path,
+        "file_path": os.path.join("uploads", filename),
+        "file_type": file_type,
+        "file_size": os.path.getsize(target_path),
+        "content_hash": digest.hexdigest(),
+        "structured": structured,
+    }
+
+
+def load_mapping(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {key.strip('/'): value for key, value in json.load(f).items()}
+
+
+def resolve_metadata(relative_dir: str, mapping: dict) -> dict:
+    """Merge mapping entries from the most general to the most specific folder"""
+    metadata = dict(mapping.get("default", {}))
+    tags = list(metadata.get("tags", []))
+    parts = [part for part in relative_dir.split(os.sep) if part and part != "."]
+    for depth in range(1, len(parts) + 1):
+        entry = mapping.get("/".join(parts[:depth]))
+        if entry:
+            metadata.update(entry)
+            tags.extend(tag for tag in entry.get("tags", []) if tag not in tags)
+    metadata["tags"] = tags
+    return metadata
+
+
+def load_checkpoint(path: str) -> set:
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    done.add(line)
+    return done
+
+
+def iter_files(root: str, done: set):
+    """Yield importable files in a stable order, skipping checkpointed ones"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            relative_path = os.path.relpath(os.path.join(dirpath, name), root)
+            if relative_path in done:
+                continue
+            if name.split('.')[-1].lower() not in FILE_TYPES:
+                continue
+            yield relative_path
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.imported = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_report < REPORT_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        print(f"📄 {self.imported} imported, {self.failed} failed, {self.skipped} skipped | "
+              f"{self.imported / elapsed:.1f} files/s, {self.bytes / elapsed / (1024 * 1024):.2f} MB/s")
+
+
+def remove_stored(items: list):
+    """Delete the copied files of documents that were not inserted"""
+    for item in items:
+        try:
+            os.remove(item["stored_path"])
+        except FileNotFoundError:
+            pass
+
+
+async def flush_batch(db, batch: list, checkpoint, stats: ImportStats):
+    """Insert a batch of documents and record their source paths in the checkpoint"""
+    if not batch:
+        return
+
+    # Documents of a batch inserted before the checkpoint was written (crash, kill) exist already
+    sources = [item["document"]["import_source"] for item in batch]
+    existing = set()
+    async for document in db.documents.find({"import_source": {"$in": sources}}, {"import_source": 1}):
+        existing.add(document["import_source"])
+    done = [item for item in batch if item["document"]["import_source"] in existing]
+    batch = [item for item in batch if item["document"]["import_source"] not in existing]
+    remove_stored(done)
+    stats.skipped += len(done)
+
+    documents = [item["document"] for item in batch]
+    try:
+        if documents:
+            await db.documents.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        # A duplicate source was inserted by another run meanwhile, the file is imported
+        duplicates = [batch[index] for index, error in errors.items() if error.get("code") == 11000]
+        failed = [batch[index] for index, error in errors.items() if error.get("code") != 11000]
+        remove_stored(duplicates + failed)
+        stats.skipped += len(duplicates)
+        stats.failed += len(failed)
+        if failed:
+            print(f"❌ {len(failed)} documents in batch failed to insert")
+        done += duplicates
+        batch = [item for index, item in enumerate(batch) if index not in errors]
+
+    # Identical files share one text store record, duplicate keys are expected; the texts of
+    # documents found already inserted may have been lost with the crash that left them out
+    extracted = {item["document"]["content_hash"]: item["structured"] for item in batch + done}
+    records = [TextStore.build_record(file_hash, structured) for file_hash, structured in extracted.items()]
+    if records:
+        try:
+            await db.extracted_texts.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if errors:
+                print(f"⚠️ {len(errors)} extracted texts failed to insert")
+
+    for item in batch + done:
+        checkpoint.write(item["source"] + "\n")
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+    stats.imported += len(batch)
+
+
+async def import_directory(args):
+    root = os.path.abspath(args.root)
+    mapping = load_mapping(args.mapping)
+    uploads_dir = os.path.abspath(args.uploads_dir)
+    os.makedirs(uploads_dir, exist_ok=True)
+
+    client = AsyncIOMotorClient(MONGODB_URL)
+    db = client[DATABASE_NAME]
+    await db.documents.create_index("import_source", unique=True, sparse=True)
+
+    # Resolve every owner named in the mapping with a single query
+    usernames = {entry["owner"] for entry in mapping.values() if entry.get("owner")}
+    owners = {}
+    async for user in db.users.find({"username": {"$in": list(usernames)}}, {"username": 1}):
+        owners[user["username"]] = user["_id"]
+    missing = usernames - set(owners)
+    if missing:
+        print(f"❌ Unknown owners in mapping: {', '.join(sorted(missing))}")
+        client.close()
+        return
+
+    done = load_checkpoint(args.checkpoint)
+    print(f"📥 Importing {root} ({len(done)} files already imported)")
+
+    stats = ImportStats()
+    loop = asyncio.get_running_loop()
+    batch = []
+    # Bound the number of files in flight so memory stays flat for any tree size
+    in_flight = asyncio.Semaphore(args.workers * 4)
+    pending = set()
+
+    async def process(relative_path: str):
+        try:
+            source_path = os.path.join(root, relative_path)
+            if os.path.getsize(source_path) > MAX_FILE_SIZE:
+                stats.skipped += 1
+                return
+            metadata = resolve_metadata(os.path.dirname(relative_path), mapping)
+            if not metadata.get("owner"):
+                stats.skipped += 1
+                print(f"⚠️ No owner mapped for {relative_path}")
+                return
+
+            result = await loop.run_in_executor(pool, ingest_file, source_path, uploads_dir)
+            now = datetime.utcnow()
+            batch.append({
+                "source": relative_path,
+                "stored_path": result["stored_path"],
+                "structured": result["structured"],
+                "document": {
+                    "title": os.path.splitext(os.path.basename(relative_path))[0][:200],
+                    "summary": None,
+                    "tags": metadata["tags"],
+                    "visibility": metadata.get("visibility", "private"),
+                    "group": metadata.get("group"),
+                    "owner_id": owners[metadata["owner"]],
+                    "file_path": result["file_path"],
+                    "file_type": result["file_type"],
+                    "file_size": result["file_size"],
+                    "content_hash": result["content_hash"],
+                    "import_source": source_path,
+                    "storage_tier": "hot",
+                    "created_at": now,
+                    "updated_at": now,
+                    "last_accessed_at": now,
+                    "rating_sum": 0,
+                    "rating_count": 0,
+                    "average_rating": 0.0
+                }
+            })
+            stats.bytes += result["file_size"]
+        except Exception as e:
+            stats.failed += 1
+            print(f"❌ Error importing {relative_path}: {e}")
+        finally:
+            in_flight.release()
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool, \
+                open(args.checkpoint, 'a', encoding='utf-8') as checkpoint:
+            for relative_path in iter_files(root, done):
+                await in_flight.acquire()
+                task = asyncio.create_task(process(relative_path))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+                if len(batch) >= args.batch_size:
+                    current, batch[:] = list(batch), []
+                    await flush_batch(db, current, checkpoint, stats)
+                stats.report()
+
+            if pending:
+                await asyncio.gather(*pending)
+            await flush_batch(db, list(batch), checkpoint, stats)
+            stats.report(force=True)
+        print("✅ Import completed")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a directory tree of documents")
+    parser.add_argument("root", help="Directory to import")
+    parser.add_argument("--mapping", help="JSON file mapping folders to owner, group, tags and visibility")
+    parser.add_argument("--uploads-dir", default=os.path.join(BACKEND_DIR, "uploads"),
+                        help="Backend uploads directory")
+    parser.add_argument("--checkpoint", default=".import_checkpoint",
+                        help="File recording imported paths, used to resume")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="Extraction processes")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per insert_many batch")
+    args = parser.parse_args()
+    asyncio.run(import_directory(args))
+
+
+if __name__ == "__main__":
+    main()